@@ -1,14 +1,23 @@
-from threading import Thread, Lock
+from threading import Condition, Thread, Lock
 
 import numpy as np
-import math
-import sys
 import time
 
 import cv2
 
-
+import instrumentation
+from calibrationstore import ARENA_CALIBRATION, CalibrationStore
+from cameramodel import CameraModel
+from framepipeline import LatestFrameSlot, ReorderBuffer
+from framesource import FrameSource, open_source
 from packet import Packet
+from preview import PreviewRenderer
+from roidetector import RoiDetector
+from sharedposes import SharedPoseTable
+
+# Time taken by every stage of the tracking pipeline, see instrumentation.py
+STAGE_TIMES = {stage: instrumentation.histogram(f'tracker.{stage}')
+               for stage in ('capture', 'detect', 'pose', 'publish', 'latency')}
 
 class ArUcoTracker:
   ARUCO_DICT = {
@@ -45,17 +54,48 @@ class ArUcoTracker:
   }
 
   def __init__(self, arUco_type="DICT_5X5_50", HOST = '127.0.0.1', PORT = '4242',
-                    CHOSEN_CAMERA = 2, POSITION_MARKERS = 0, commHub = None) -> None:
+                    CHOSEN_CAMERA = 2, POSITION_MARKERS = 0, commHub = None, detect_workers = 2,
+                    incremental = False, resync_interval = 30, roi_padding = 1.0,
+                    headless = False, preview_fps = 15, preview_sink = None,
+                    preview_name = 'Robot_Detection', camera_model = None, undistort_frames = False,
+                    calibration_file = ARENA_CALIBRATION, resolution = "1280x720",
+                    stage_timer = None) -> None:
 
     self.CHOSEN_CAMERA = CHOSEN_CAMERA
     self.DESTINATION = (HOST, PORT)
     self.POSITION_MARKERS = POSITION_MARKERS
     self.CommHub = commHub
     self.packets_lock = Lock()
+    self.captureResolution = resolution
+    # Called with (stage, seconds) for the 'capture', 'detect', 'pose' and 'publish' stages of every frame,
+    # and the 'latency' from capture to publish
+    self.stageTimer = stage_timer
 
     self.arucoDict = cv2.aruco.Dictionary_get(self.ARUCO_DICT[arUco_type])
     self.arucoParams = cv2.aruco.DetectorParameters_create()
-    self.id2coords = {}
+    # Only search around each robot's last position, with periodic full frame searches
+    self.roiDetector = RoiDetector(self.arucoDict, self.arucoParams, resync_interval, roi_padding,
+                                   ignore_ids=[POSITION_MARKERS]) if incremental else None
+    # Robots seen in the latest frame, with their [x, y, z, bearing] and the frame's capture time
+    self.robotIDs = np.empty(0, dtype=int)
+    self.robotPoses = np.empty((0, 4))
+    self.posesTimestamp = 0
+    # Bumped for every frame with robots in it, so only new poses are published to the hub
+    self.posesGeneration = 0
+    self.posesPublished = Condition(self.packets_lock)
+    self.tracking = True
+    self.alive = True
+
+    # Capture -> Detection workers -> Track Robots pipeline
+    self.frames = LatestFrameSlot()
+    self.detections = ReorderBuffer(producers=detect_workers)
+    instrumentation.gauge('tracker.dropped_frames', lambda: self.frames.dropped)
+
+    # Without a display, nothing is drawn unless the preview is exported to an image or MJPEG sink
+    self.headless = headless
+    self.preview = None
+    if not headless or preview_sink is not None:
+      self.preview = PreviewRenderer(preview_name, preview_fps, preview_sink, on_quit=self.stop)
 
     self.arenaMaxX = 0
     self.arenaMaxY = 0
@@ -65,9 +105,34 @@ class ArUcoTracker:
     self.arenaMeasurement = 0.88 # This is relevant to the distance of ArUco Tags defining the Robot Arena in m
 
     self.cap = self.init_camera()
-    self.scale = self.calculate_scale()
+
+    # Lens distortion is removed from the marker corners, or from whole frames if 'undistort_frames'
+    if isinstance(camera_model, str):
+      camera_model = CameraModel.load(camera_model)
+    if camera_model is not None:
+      camera_model = camera_model.for_resolution(int(self.cap.get(3)), int(self.cap.get(4)))
+    self.cameraModel = camera_model
+    self.undistortFrames = undistort_frames and camera_model is not None
+
+    # Reuse the arena calibration from a previous run with the same camera, if it is still valid
+    self.calibrationStore = None
+    if calibration_file is not None:
+      self.calibrationStore = CalibrationStore(calibration_file, self.arenaMeasurement)
+      self.calibrationKey = CalibrationStore.key(self.CHOSEN_CAMERA, self.resolution(), camera_model)
+    self.scale = self.restore_calibration() if self.calibrationStore is not None else 0
+    if not self.scale:
+      self.scale = self.calculate_scale()
+      if self.calibrationStore is not None and self.scale and self.scale > 0:
+        self.calibrationStore.save(self.calibrationKey, self.scale,
+          [self.arenaMaxX, self.arenaMaxY, self.arenaMinX, self.arenaMinY])
     print(f"Scaling Factor for 1m: {self.scale}")
 
+    self.capture_thread = Thread(target=self.capture_frames, name="Capture Frames")
+    self.capture_thread.start()
+    self.detect_threads = [Thread(target=self.detect_markers, name=f"Detect Markers {worker}")
+                            for worker in range(detect_workers)]
+    for detect_thread in self.detect_threads:
+      detect_thread.start()
     self.trackRobots_thread = Thread(target=self.track_robots, name="Track Robots")
     self.trackRobots_thread.start()
     self.sendCoordinates_thread = Thread(target=self.send_coordinates, name="Send Coordinates")
@@ -75,31 +140,72 @@ class ArUcoTracker:
 
 
 
-  def init_camera(self) -> cv2.VideoCapture:
+  def init_camera(self) -> FrameSource:
     '''
     Initialise the Camera Setup to enable Video Capture
 
     Returns:
     --------
-    cap -> cv2.VideoCapture
-      CV2's VideoCapture instance
+    cap -> framesource.FrameSource
+      Source with the same interface as CV2's VideoCapture
     '''
-    # Open Video Capture with External Chosen Camera on appropriate USB
-    cap = cv2.VideoCapture(self.CHOSEN_CAMERA)
-    if not cap.isOpened():
+    # Open Video Capture with External Chosen Camera on appropriate USB, or a video file,
+    # image directory or any other FrameSource
+    cap = open_source(self.CHOSEN_CAMERA)
+    if not cap.isOpened() and not isinstance(self.CHOSEN_CAMERA, FrameSource):
       # Fallback attempt to open Video Capture with onboard Webcam
-      cap = cv2.VideoCapture(0)
+      cap = open_source(0)
     if not cap.isOpened():
-      print("Cannot Open Camera")
-      exit()
+      raise IOError(f"Cannot Open Camera {self.CHOSEN_CAMERA}")
 
-    # Change Resolution of the frame to 1280x720
-    self.change_res(cap, self.POSSIBLE_RESOLUTIONS["1280x720"])
-    time.sleep(1.5)
+    # Change Resolution of the frame, 1280x720 by default
+    self.change_res(cap, self.POSSIBLE_RESOLUTIONS[self.captureResolution])
+    self.wait_until_ready(cap)
     return cap
 
 
 
+  def wait_until_ready(self, cap, timeout=1.5) -> bool:
+    '''
+    Waits for the camera to deliver a frame at its configured resolution, instead of sleeping for
+    a fixed time after changing it
+
+    Parameters:
+    -----------
+    cap -> cv2.VideoCapture
+      Instance of CV2's Video Capture
+    timeout -> float
+      Longest time to wait in s
+
+    Returns:
+    --------
+    ready -> bool
+      False if the camera was still not delivering frames once the timeout expired
+    '''
+    deadline = time.perf_counter() + timeout
+    width, height = int(cap.get(3)), int(cap.get(4))
+    while time.perf_counter() < deadline:
+      ret, frame = cap.read()
+      if ret and frame.shape[1] == width and frame.shape[0] == height:
+        return True
+      if not ret:
+        time.sleep(0.01)
+    print(f"Camera not ready after {timeout}s, continuing anyway")
+    return False
+
+
+
+  def resolution(self) -> tuple:
+    '''
+    Returns:
+    --------
+    (width, height) -> tuple
+      Resolution the camera is capturing at
+    '''
+    return (int(self.cap.get(3)), int(self.cap.get(4)))
+
+
+
   def change_res(self, cap, resolution) -> None:
     '''
     Change the resolution of the Video Capture
@@ -116,6 +222,107 @@ class ArUcoTracker:
 
 
 
+  def measure_arena(self, tags, ids) -> float:
+    '''
+    Sets the arena bounds from the corners of the two arena markers, and calculates the pixel scale
+    factor for a real world metre
+
+    Parameters:
+    -----------
+    tags, ids ->
+      Detected markers, in the same format as cv2.aruco.detectMarkers
+
+    Returns:
+    --------
+    oneMetreScaleFactor -> float
+      0 if both arena markers were not detected
+    '''
+    if len(tags) == 0 or np.count_nonzero(ids.flatten() == self.POSITION_MARKERS) != 2:
+      return 0
+
+    ids = ids.flatten()
+    # loop over the detected ArUCo corners
+    positionMarkers = {}
+    for index, (markerCorner, markerID) in enumerate(zip(tags, ids)):
+      positionMarkers[index] = {}
+      if markerID != 0:
+        pass
+      corners = self.undistort_corners(markerCorner.reshape((4, 2)))
+      (positionMarkers[index]["topLeft"],
+        positionMarkers[index]["topRight"],
+        positionMarkers[index]["bottomRight"],
+        positionMarkers[index]["bottomLeft"]) = corners
+
+    # At this stage, position_markers will have stored the corners of the
+    # ArUco Tags
+    topMaxX, topMaxY = float('-inf'), float('-inf')
+    bottomMinX, bottomMinY = float('inf'), float('inf')
+
+    # Note: Top Left corner of the Camera is 0, 0
+    # This means the top corners are closer to zero (Y Min) and
+    # bottom corners are closer to Y Max
+    for indexes in positionMarkers:
+      topMaxX = max(positionMarkers[indexes]['bottomRight'][0], topMaxX)
+      topMaxX = max(positionMarkers[indexes]['topRight'][0], topMaxX)
+      topMaxY = max(positionMarkers[indexes]['bottomLeft'][1], topMaxY)
+      topMaxY = max(positionMarkers[indexes]['bottomRight'][1], topMaxY)
+
+      bottomMinX = min(positionMarkers[indexes]['topLeft'][0], bottomMinX)
+      bottomMinX = min(positionMarkers[indexes]['bottomLeft'][0], bottomMinX)
+      bottomMinY = min(positionMarkers[indexes]['topLeft'][1], bottomMinY)
+      bottomMinY = min(positionMarkers[indexes]['topRight'][1], bottomMinY)
+
+    # Set global values to keep track of arena Coordinates
+    self.arenaMaxX, self.arenaMaxY = topMaxX, topMaxY
+    self.arenaMaxY, self.arenaMinY = bottomMinX, bottomMinY
+
+    # Calculates the number of pixels in 1 Metre
+    oneMetreScaleFactor = (topMaxY - bottomMinY) / self.arenaMeasurement
+    return oneMetreScaleFactor
+
+
+
+  def restore_calibration(self, probe_frames=5) -> float:
+    '''
+    Reuses the arena calibration stored for this camera and resolution. The first few frames are
+    still searched for the arena markers, and if they are in view the arena is measured afresh in
+    case it has moved
+
+    Parameters:
+    -----------
+    probe_frames -> int
+      Number of frames searched for the arena markers before falling back to the stored calibration
+
+    Returns:
+    --------
+    oneMetreScaleFactor -> float
+      0 if no valid calibration is stored
+    '''
+    calibration = self.calibrationStore.load(self.calibrationKey, self.resolution())
+    if calibration is None:
+      return 0
+
+    for _ in range(probe_frames):
+      ret, frame = self.cap.read()
+      if not ret:
+        break
+      if self.undistortFrames:
+        frame = self.cameraModel.undistort_frame(frame)
+      (tags, ids, rejected) = cv2.aruco.detectMarkers(frame,
+        self.arucoDict, parameters=self.arucoParams)
+      oneMetreScaleFactor = self.measure_arena(tags, ids)
+      if oneMetreScaleFactor:
+        arena = [self.arenaMaxX, self.arenaMaxY, self.arenaMinX, self.arenaMinY]
+        if arena != calibration['arena'] or oneMetreScaleFactor != calibration['scale']:
+          self.calibrationStore.save(self.calibrationKey, oneMetreScaleFactor, arena)
+        return oneMetreScaleFactor
+
+    print("Arena markers not in view, reusing the stored arena calibration")
+    self.arenaMaxX, self.arenaMaxY, self.arenaMinX, self.arenaMinY = calibration['arena']
+    return calibration['scale']
+
+
+
   def calculate_scale(self) -> float:
     '''
     Automates the calculation the pixel scale factor for a real world metre
@@ -126,63 +333,27 @@ class ArUcoTracker:
       This value is used to scale coordinates in tracking
     '''
 
-    oneMetreScaleFactor = 0
-
     while True:
       ret, frame = self.cap.read()
       if not ret:
         print("Can't received frame (stream end?). Exiting...")
         break
+      if self.undistortFrames:
+        frame = self.cameraModel.undistort_frame(frame)
 
       # detect ArUco markers in the input frame
       (tags, ids, rejected) = cv2.aruco.detectMarkers(frame,
         self.arucoDict, parameters=self.arucoParams)
-      # verify *at least* one ArUco marker was detected
-      # and that two Identifying Markers were detected
-      if len(tags) > 0 and np.count_nonzero(ids.flatten() == self.POSITION_MARKERS) == 2:
-        ids = ids.flatten()
-        # loop over the detected ArUCo corners
-        positionMarkers = {}
-        for index, (markerCorner, markerID) in enumerate(zip(tags, ids)):
-          positionMarkers[index] = {}
-          if markerID != 0:
-            pass
-          corners = markerCorner.reshape((4, 2))
-          (positionMarkers[index]["topLeft"],
-            positionMarkers[index]["topRight"],
-            positionMarkers[index]["bottomRight"],
-            positionMarkers[index]["bottomLeft"]) = corners
-
-        # At this stage, position_markers will have stored the corners of the
-        # ArUco Tags
-        topMaxX, topMaxY = float('-inf'), float('-inf')
-        bottomMinX, bottomMinY = float('inf'), float('inf')
-
-        # Note: Top Left corner of the Camera is 0, 0
-        # This means the top corners are closer to zero (Y Min) and
-        # bottom corners are closer to Y Max
-        for indexes in positionMarkers:
-          topMaxX = max(positionMarkers[indexes]['bottomRight'][0], topMaxX)
-          topMaxX = max(positionMarkers[indexes]['topRight'][0], topMaxX)
-          topMaxY = max(positionMarkers[indexes]['bottomLeft'][1], topMaxY)
-          topMaxY = max(positionMarkers[indexes]['bottomRight'][1], topMaxY)
-
-          bottomMinX = min(positionMarkers[indexes]['topLeft'][0], bottomMinX)
-          bottomMinX = min(positionMarkers[indexes]['bottomLeft'][0], bottomMinX)
-          bottomMinY = min(positionMarkers[indexes]['topLeft'][1], bottomMinY)
-          bottomMinY = min(positionMarkers[indexes]['topRight'][1], bottomMinY)
-
-        # Set global values to keep track of arena Coordinates
-        self.arenaMaxX, self.arenaMaxY = topMaxX, topMaxY
-        self.arenaMaxY, self.arenaMinY = bottomMinX, bottomMinY
-
-        # Calculates the number of pixels in 1 Metre
-        oneMetreScaleFactor = (topMaxY - bottomMinY) / self.arenaMeasurement
-
+      oneMetreScaleFactor = self.measure_arena(tags, ids)
+      if oneMetreScaleFactor:
         # Cleans up Window created
-        cv2.destroyAllWindows()
+        if not self.headless:
+          cv2.destroyAllWindows()
         return oneMetreScaleFactor
 
+      if self.headless:
+        continue
+
       # Display the resulting frame
       cv2.imshow('Arena_Calibration', frame)
       # Waits for exit of the program
@@ -191,55 +362,173 @@ class ArUcoTracker:
         return -1
 
 
-  def track_robots(self):
+  def capture_frames(self):
     '''
-    Tracks the positions of the ArUco Tags, and updates an ID: Coordinates Dictionary
+    Reads frames from the camera as fast as it delivers them, always keeping only the latest
+    one for the detection workers
     '''
-    while True:
+    while self.alive:
+      start = time.perf_counter()
       ret, frame = self.cap.read()
+      timestamp = time.time()
       if not ret:
         print("Can't received frame (stream end?). Exiting...")
         break
+      if self.undistortFrames:
+        frame = self.cameraModel.undistort_frame(frame)
+      self.time_stage('capture', start)
+      self.frames.put(frame, timestamp)
+    self.frames.close()
 
-      (tags, ids, rejected) = cv2.aruco.detectMarkers(frame,
-        self.arucoDict, parameters=self.arucoParams)
 
-      cv2.aruco.drawDetectedMarkers(frame, tags, borderColor = (0, 255, 0))
 
+  def detect_markers(self):
+    '''
+    Detection worker. Runs ArUco detection on the latest captured frame. OpenCV releases the GIL
+    while detecting, so several workers run in parallel. Every claimed frame gets a result, None if
+    detection failed, so the tracking thread is never left waiting for a sequence number
+    '''
+    try:
+      while True:
+        claimed = self.frames.take()
+        if claimed is None:
+          break
+        sequence, timestamp, frame = claimed
+        detection = None
+        try:
+          start = time.perf_counter()
+          if self.roiDetector is not None:
+            (tags, ids, full_frame) = self.roiDetector.detect(frame)
+          else:
+            (tags, ids, rejected) = cv2.aruco.detectMarkers(frame,
+              self.arucoDict, parameters=self.arucoParams)
+            full_frame = True
+          self.time_stage('detect', start)
+          detection = (timestamp, frame, tags, ids, full_frame)
+        except cv2.error as e:
+          print(f"ERROR: Detection failed on frame {sequence}, skipping it: {e}")
+        finally:
+          self.detections.put(sequence, detection)
+    finally:
+      self.detections.producer_done()
 
-      if len(tags) > 0:
-        ids = ids.flatten()
-        # loop over the detected ArUCo corners
-        for (markerCorner, markerID) in zip(tags, ids):
-          # Ignores ArUco Tags of ID 'POSITION_MARKERS' as these are reserved for trackers
-          if markerID == self.POSITION_MARKERS:
-            continue
-          corners = markerCorner.reshape((4, 2))
-          (topLeft, topRight, bottomRight, bottomLeft) = corners
 
-          frontOfTagX = (topLeft[0] + topRight[0]) / 2
-          frontOfTagY = (topLeft[1] + topRight[1]) / 2
 
-          # Finds the Centre Point of the robot and draws onto the frame
-          centreX, centreY, centreZ = self.get_robot_centre(topLeft, bottomRight)
-          cv2.circle(frame, (int(centreX), int(centreY)), 4, (0, 0, 255), -1)
+  def track_robots(self):
+    '''
+    Tracks the positions of the ArUco Tags, and keeps the poses of the robots seen in the latest
+    frame. Detections are handled in the order their frames were captured
+    '''
+    while True:
+      detection = self.detections.get()
+      if detection is None:
+        break
+      timestamp, frame, tags, ids, full_frame = detection
+      if self.roiDetector is not None:
+        self.roiDetector.update(tags, ids, full_frame)
 
-          bearing = math.atan2(frontOfTagY - centreY, frontOfTagX - centreX)
+      start = time.perf_counter()
+      robotIDs, robotPoses, centres = self.markers_to_poses(tags, ids)
+      self.time_stage('pose', start)
+      # print(f"Robots {robotIDs} are positioned: {robotPoses}")
+      if len(robotIDs) > 0:
+        with self.posesPublished:
+          self.robotIDs, self.robotPoses, self.posesTimestamp = robotIDs, robotPoses, timestamp
+          self.posesGeneration += 1
+          self.posesPublished.notify()
 
-          # Scales the Robots Centre Point to Metres
-          coordinates = self.scale_coordinates(centreX, centreY, centreZ)
+      # Hand the frame over to be drawn and displayed at the preview's own rate
+      if self.preview is not None:
+        self.preview.offer(frame, tags, centres)
 
-          coordinates.append(bearing)
-          # print(f"Robot {markerID} is positioned: {coordinates}")
-          self.packets_lock.acquire()
-          self.id2coords[markerID] = coordinates
-          self.packets_lock.release()
+    with self.posesPublished:
+      self.tracking = False
+      self.posesPublished.notify()
+
+
+
+  def time_stage(self, stage, start):
+    '''
+    Records how long a pipeline stage took, and reports it to the stage timer if there is one
+
+    Parameters:
+    -----------
+    stage -> string
+      Name of the stage
+    start -> float
+      time.perf_counter() when the stage started
+    '''
+    elapsed = time.perf_counter() - start
+    STAGE_TIMES[stage].record(elapsed)
+    if self.stageTimer is not None:
+      self.stageTimer(stage, elapsed)
 
-      # Display the resulting frame
-      cv2.imshow('Robot_Detection', frame)
-      # Waits for exit of the program
-      if cv2.waitKey(1) == ord('q'):
-        sys.exit()
+
+
+  def markers_to_poses(self, tags, ids):
+    '''
+    Converts every marker detected in a frame into a robot pose in a single pass
+
+    Parameters:
+    -----------
+    tags -> tuple
+      Detected marker corners, as returned by cv2.aruco.detectMarkers
+    ids -> np.array
+      Detected marker IDs, as returned by cv2.aruco.detectMarkers
+
+    Returns:
+    --------
+    (robotIDs, robotPoses, centres) -> tuple of np.array
+      IDs of the robots, excluding the arena markers, an (N, 4) array of their [x, y, z, bearing]
+      in metres, and an (N, 2) array of their pixel centres
+    '''
+    if len(tags) == 0:
+      return np.empty(0, dtype=int), np.empty((0, 4)), np.empty((0, 2))
+
+    corners = self.undistort_corners(np.concatenate(tags).reshape(-1, 4, 2))
+    ids = ids.flatten()
+    # Ignores ArUco Tags of ID 'POSITION_MARKERS' as these are reserved for trackers
+    isRobot = ids != self.POSITION_MARKERS
+    corners, ids = corners[isRobot], ids[isRobot]
+
+    # Centre is the midpoint of the top left and bottom right corners, front the midpoint of the top edge
+    centres = (corners[:, 0] + corners[:, 2]) / 2
+    fronts = (corners[:, 0] + corners[:, 1]) / 2
+
+    robotPoses = np.empty((len(ids), 4))
+    robotPoses[:, 0] = (centres[:, 0] - self.arenaMinX) / self.scale
+    robotPoses[:, 1] = (centres[:, 1] - self.arenaMinY) / self.scale
+    robotPoses[:, 2] = 0  # Robots are assumed to be on a flat plane
+    robotPoses[:, 3] = np.arctan2(fronts[:, 1] - centres[:, 1], fronts[:, 0] - centres[:, 0])
+    return ids, robotPoses, centres
+
+
+
+  def undistort_corners(self, corners):
+    '''
+    Removes the lens distortion from detected marker corners, unless there is no camera model or
+    the frames themselves have already been undistorted
+
+    Parameters:
+    -----------
+    corners -> np.array
+      Pixel coordinates of the corners, of shape (..., 2)
+    '''
+    if self.cameraModel is None or self.undistortFrames:
+      return corners
+    return self.cameraModel.undistort_points(corners)
+
+
+
+  def stop(self):
+    '''
+    Stops capturing frames. The detection workers and tracking thread finish once the frames
+    already captured have been handled
+    '''
+    self.alive = False
+    self.frames.close()
+    if self.preview is not None:
+      self.preview.close()
 
 
 
@@ -284,19 +573,57 @@ class ArUcoTracker:
 
   def send_coordinates(self):
     '''
-    Updates the positions of the robot of ID: robotID with updated scaled coordinates
+    Updates the positions of the robots seen in the latest frame with their scaled coordinates.
+    Sleeps until the tracker publishes a new generation of poses, skipping any generations that
+    were replaced before they could be sent
     '''
+    sentGeneration = 0
     while True:
-      readDictionary = self.id2coords.items()
-      try:
-        for robotID, robotCoordinates in readDictionary:
-          self.CommHub.update_position(robotID, robotCoordinates[:3], robotCoordinates[-1:])
-      except RuntimeError:
-        pass
+      with self.posesPublished:
+        while self.posesGeneration == sentGeneration and self.tracking:
+          self.posesPublished.wait()
+        if self.posesGeneration == sentGeneration:
+          break
+        sentGeneration = self.posesGeneration
+        robotIDs, robotPoses, timestamp = self.robotIDs, self.robotPoses, self.posesTimestamp
+      start = time.perf_counter()
+      self.CommHub.update_positions(robotIDs, robotPoses, timestamp)
+      self.time_stage('publish', start)
+      latency = time.time() - timestamp
+      STAGE_TIMES['latency'].record(latency)
+      if self.stageTimer is not None:
+        self.stageTimer('latency', latency)
+
+
+
+def run_tracker_process(pose_table, stats_port=None, **kwargs):
+  '''
+  Entry point for running the tracker in its own process, writing poses into a shared pose table
+  rather than into a CommHub in the same interpreter
+
+  Parameters:
+  -----------
+  pose_table -> string
+    Name of the sharedposes.SharedPoseTable read by the CommHub
+  stats_port -> int
+    Local UDP port serving the process's instrumentation, see instrumentation.StatsServer.
+    None does not serve it
+  kwargs ->
+    Passed on to ArUcoTracker
+  '''
+  poseTable = SharedPoseTable(pose_table)
+  statsServer = instrumentation.StatsServer(stats_port) if stats_port is not None else None
+  try:
+    tracker = ArUcoTracker(commHub=poseTable, **kwargs)
+    tracker.sendCoordinates_thread.join()
+  finally:
+    if statsServer is not None:
+      statsServer.close()
+    poseTable.close()
 
 '''
   TODO:
-    - Add Pinhole Camera Calibration to accomodate for Camera Distortion
+    - Estimate marker pose with the camera model to account for robots' height above the arena
       |-> Look into: https://automaticaddison.com/how-to-perform-pose-estimation-using-an-aruco-marker/
 
 '''
\ No newline at end of file
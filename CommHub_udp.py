@@ -1,11 +1,15 @@
 #!/usr/bin/python3
 import time
 
+from multiprocessing import Process
 from threading import Lock
 
-from ArUcoTracker import ArUcoTracker
+import instrumentation
+from ArUcoTracker import ArUcoTracker, run_tracker_process
 from commhub import CommHub
 from graphMaker import graphMaker
+from shardedhub import ShardedCommHub
+from sharedposes import SharedPoseTable
 
 # Parameters for the Buzz ComHub
 FORWARD_FREQ = 500  # Hz
@@ -14,12 +18,66 @@ FORWARD_FREQ = 500  # Hz
 SERVER_IP = '144.32.175.138'
 PORT = 4242
 
+# Set to False to start collecting data straight away, e.g. when restarting mid-experiment
+WAIT_FOR_ENTER = True
+
+# Run the tracker in its own process, handing poses to the CommHub through shared memory,
+# so that vision and networking do not compete for the same GIL
+TRACKER_PROCESS = False
+
+# Live latency and throughput stats of the tracker and CommHub. Read them with
+# 'python instrumentation.py 4243', the tracker process serves its own on STATS_PORT + 1.
+# STATS_FILE also writes them to a JSON file every second. Set INSTRUMENTATION = False to turn them off
+INSTRUMENTATION = True
+STATS_PORT = 4243
+STATS_FILE = None
+
+# Record every pose and the forwarded traffic to this file, e.g. 'results/control_data/run1.tel'
+# to include the run in boxplotGenerator. None records nothing
+TELEMETRY_FILE = None
+
+# Degrade forwarding for packet loss and noise experiments, e.g. impairment.Impairment(seed=1, loss=0.25)
+# for the 'Packet Loss 25%' runs of boxplotGenerator. None forwards everything as it is
+IMPAIRMENT = None
+
+# Spread forwarding over this many worker processes sharing PORT, see shardedhub.ShardedCommHub.
+# Their stats are served from STATS_PORT + 2 onwards. 0 runs a single CommHub
+SHARDS = 0
+
+
+def create_comm_hub(pose_table=None):
+  if SHARDS:
+    return ShardedCommHub(SHARDS, forward_freq=FORWARD_FREQ, host=SERVER_IP, port=PORT, pose_table=pose_table,
+                          impairment=IMPAIRMENT, telemetry=TELEMETRY_FILE,
+                          stats_port=STATS_PORT + 2 if INSTRUMENTATION else None)
+  return CommHub(forward_freq=FORWARD_FREQ, host=SERVER_IP, port=PORT, pose_table=pose_table,
+                 impairment=IMPAIRMENT, telemetry=TELEMETRY_FILE)
+
+
 if __name__ == '__main__':
 
-  comm_hub = CommHub(forward_freq=FORWARD_FREQ, host=SERVER_IP, port=PORT)
-  robotTracker = ArUcoTracker(HOST=SERVER_IP, PORT=PORT, commHub=comm_hub)
+  stats_server = stats_writer = None
+  if not INSTRUMENTATION:
+    instrumentation.disable()
+  else:
+    stats_server = instrumentation.StatsServer(STATS_PORT)
+    if STATS_FILE is not None:
+      stats_writer = instrumentation.SnapshotWriter(STATS_FILE)
+
+  if TRACKER_PROCESS:
+    pose_table = SharedPoseTable()
+    comm_hub = create_comm_hub(pose_table.name)
+    tracker_process = Process(target=run_tracker_process, args=(pose_table.name,),
+                              kwargs={'HOST': SERVER_IP, 'PORT': PORT,
+                                      'stats_port': STATS_PORT + 1 if INSTRUMENTATION else None},
+                              name="Tracker", daemon=True)
+    tracker_process.start()
+  else:
+    comm_hub = create_comm_hub()
+    robotTracker = ArUcoTracker(HOST=SERVER_IP, PORT=PORT, commHub=comm_hub)
 
-  graphs = graphMaker(commHub=comm_hub, frequency=0.5, experiment_length=45, num_robots=8)
+  graphs = graphMaker(commHub=comm_hub, frequency=0.5, experiment_length=45, num_robots=8,
+                       start_prompt=WAIT_FOR_ENTER)
 
   time.sleep(0.5)
   while graphs.gatherDataThread.is_alive():
@@ -30,4 +88,14 @@ if __name__ == '__main__':
     while True:
       time.sleep(0.1)
   except KeyboardInterrupt:
-    pass
\ No newline at end of file
+    print(f"Forwarding: {comm_hub.forward_stats()}")
+    if SHARDS:
+      comm_hub.close()  # Every worker flushes its telemetry as it closes
+    elif comm_hub.telemetry is not None:
+      comm_hub.telemetry.flush()
+    if TRACKER_PROCESS:
+      tracker_process.terminate()
+      tracker_process.join()
+      pose_table.close()
+    if stats_writer is not None:
+      stats_writer.close()
\ No newline at end of file
@@ -0,0 +1,159 @@
+from threading import Lock
+
+import numpy as np
+
+from ArUcoTracker import ArUcoTracker
+
+
+def arena_transform(x=0.0, y=0.0, angle=0.0):
+  '''
+  Build the transform placing a camera's arena in the shared arena
+
+  Parameters:
+  -----------
+  x, y -> float
+    Position, in the shared arena in m, of the origin of the camera's arena
+  angle -> float
+    Rotation of the camera's arena relative to the shared arena in radians
+
+  Returns:
+  --------
+  transform -> np.array
+    3x3 homogeneous transform from the camera's arena to the shared arena
+  '''
+  cos, sin = np.cos(angle), np.sin(angle)
+  return np.array([[cos, -sin, x],
+                   [sin,  cos, y],
+                   [0,    0,   1]])
+
+
+class MultiCameraTracker:
+  '''
+  Multi Camera Tracker
+  Tracks robots over an arena larger than one camera's field of view. Every camera runs its own
+  ArUcoTracker, with its own capture and detection threads and its own arena markers. Each camera's
+  poses are mapped into a shared arena frame, and robots seen by several cameras at once, in the zones
+  where their views overlap, are merged into one pose before reaching the CommHub
+  :param cameras: list of dict. One entry per camera with
+      'source'    ~ index or video file path, as passed to cv2.VideoCapture
+      'transform' ~ 3x3 transform from the camera's arena to the shared arena, see arena_transform.
+                    Defaults to the identity
+      Every other key is passed on to that camera's ArUcoTracker
+  :param commHub: CommHub. Receives the fused poses, anything with update_positions will do
+  :param max_skew: float. Observations of a robot more than max_skew s older than its latest
+      observation, from any camera, are considered stale and left out of the fused pose
+  Every other parameter is passed on to every camera's ArUcoTracker
+  '''
+
+  def __init__(self, cameras, commHub=None, max_skew=0.05, **kwargs) -> None:
+    self.CommHub = commHub
+    self.max_skew = max_skew
+    self.fusion_lock = Lock()
+    self.observations = [{} for _ in cameras]  # per camera, robot id : ([x, y, z, yaw], timestamp)
+
+    self.trackers = []
+    for index, camera in enumerate(cameras):
+      camera = dict(camera)
+      source = camera.pop('source')
+      transform = np.asarray(camera.pop('transform', np.eye(3)), dtype=np.float64)
+      options = {**kwargs, 'preview_name': f"Robot_Detection {index}", **camera}
+      self.trackers.append(ArUcoTracker(CHOSEN_CAMERA=source,
+        commHub=CameraFeed(self, index, transform), **options))
+
+
+
+  def update_camera(self, camera, robot_ids, poses, timestamp):
+    '''
+    Record the robots seen by one camera, and publish the fused poses of those robots
+
+    Parameters:
+    -----------
+    camera -> int
+      Index of the camera
+    robot_ids -> np.array
+      IDs of the robots the camera saw
+    poses -> np.array
+      (N, 4) array of their [x, y, z, yaw] in the shared arena
+    timestamp -> float
+      Capture time of the frame
+    '''
+    with self.fusion_lock:
+      seen = self.observations[camera]
+      for robotID, pose in zip(robot_ids, poses):
+        seen[int(robotID)] = (pose, timestamp)
+      fused = [self.fuse(int(robotID)) for robotID in robot_ids]
+
+    if self.CommHub is not None and len(fused) > 0:
+      fusedPoses, timestamps = zip(*fused)
+      self.CommHub.update_positions(robot_ids, np.array(fusedPoses), np.array(timestamps))
+
+
+
+  def fuse(self, robotID):
+    '''
+    Merge every camera's recent observation of a robot into a single pose. Positions are
+    averaged, and bearings are combined with a circular mean so that they wrap correctly
+
+    Returns:
+    --------
+    (pose, timestamp) -> tuple
+      Fused [x, y, z, yaw], and the mean capture time of the observations used
+    '''
+    observations = [seen[robotID] for seen in self.observations if robotID in seen]
+    latest = max(timestamp for _, timestamp in observations)
+    poses = np.array([pose for pose, timestamp in observations if latest - timestamp <= self.max_skew])
+    timestamps = [timestamp for _, timestamp in observations if latest - timestamp <= self.max_skew]
+
+    pose = poses.mean(axis=0)
+    pose[3] = np.arctan2(np.sin(poses[:, 3]).sum(), np.cos(poses[:, 3]).sum())
+    return pose, sum(timestamps) / len(timestamps)
+
+
+
+  def stop(self):
+    '''
+    Stop every camera's tracker
+    '''
+    for tracker in self.trackers:
+      tracker.stop()
+
+
+
+  def join(self):
+    '''
+    Wait for every camera to finish, e.g. at the end of the recorded video files
+    '''
+    for tracker in self.trackers:
+      tracker.sendCoordinates_thread.join()
+
+
+class CameraFeed:
+  '''
+  PRIVATE
+  Stands in for the CommHub of one camera's ArUcoTracker, moving its poses into the shared arena
+  before handing them to the MultiCameraTracker
+  :param tracker: MultiCameraTracker. Tracker fusing the cameras
+  :param camera: int. Index of the camera
+  :param transform: np.array. 3x3 transform from the camera's arena to the shared arena
+  '''
+
+  def __init__(self, tracker, camera, transform):
+    self.tracker = tracker
+    self.camera = camera
+    self.transform = transform
+
+
+  def update_positions(self, robot_ids, poses, timestamp=None):
+    poses = np.array(poses, dtype=np.float64)
+    # Map the position and a point just ahead of the robot, so the bearing follows any rotation
+    # or perspective in the transform
+    ahead = poses[:, :2] + 0.01 * np.column_stack((np.cos(poses[:, 3]), np.sin(poses[:, 3])))
+    position, ahead = self.apply(poses[:, :2]), self.apply(ahead)
+    poses[:, :2] = position
+    poses[:, 3] = np.arctan2(ahead[:, 1] - position[:, 1], ahead[:, 0] - position[:, 0])
+    self.tracker.update_camera(self.camera, robot_ids, poses, timestamp)
+
+
+  def apply(self, points):
+    homogeneous = np.column_stack((points, np.ones(len(points)))) @ self.transform.T
+    return homogeneous[:, :2] / homogeneous[:, 2:]
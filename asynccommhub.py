@@ -0,0 +1,260 @@
+import asyncio
+import time
+
+from concurrent.futures import Future
+from threading import Thread
+
+from commhub import PACKETS_INVALID, PACKETS_RECEIVED, RECEIVE_TIME, CommHub
+from packet import Packet
+from scheduler import ForwardScheduler
+
+
+class CommHubProtocol(asyncio.DatagramProtocol):
+    '''
+    PRIVATE
+    Hands every datagram received by an AsyncCommHub's transport back to the hub
+    :param commHub: AsyncCommHub. The hub the datagrams are delivered to
+    '''
+
+    def __init__(self, commHub):
+        self.commHub = commHub
+
+
+    def datagram_received(self, data, addr):
+      start = time.perf_counter()
+      received_packet = Packet.from_buffer(data, len(data), addr)
+      if received_packet:
+        self.commHub.queue_packets((received_packet,))
+        PACKETS_RECEIVED.add()
+      else:
+        PACKETS_INVALID.add()
+      RECEIVE_TIME.record_since(start)
+
+
+    def error_received(self, exc):
+      print(f"CommHub socket error: {exc}")
+
+
+class LoopScheduler(ForwardScheduler):
+    '''
+    PRIVATE
+    ForwardScheduler whose ticks are event loop timers instead of a thread of their own. Ticks are
+    accounted for in the same way, so get_stats works unchanged, and notifications from any thread
+    schedule an event driven tick on the loop
+    :param loop: asyncio.AbstractEventLoop. Event loop the ticks run on
+    Every other parameter is passed on to ForwardScheduler
+    '''
+
+    def __init__(self, loop, callback, period, event_driven=False, coalesce_window=0.0):
+        super().__init__(callback, period, event_driven, coalesce_window)
+        self.loop = loop
+        self.timer = None
+
+
+    def run(self):
+      '''
+      Start ticking. Must be called on the event loop, and returns straight away
+      '''
+      self.reset_stats()
+      if self.event_driven:
+        self.arm_idle()
+      else:
+        self.schedule_periodic(self.loop.time())
+
+
+    def schedule_periodic(self, deadline):
+      '''
+      Schedule a tick at event loop time 'deadline'. Ticks are spaced from the previous deadline
+      rather than from the end of the previous tick, so slow ticks do not lower the rate
+      '''
+      self.timer = self.loop.call_at(deadline, self.periodic_tick, deadline)
+
+
+    def periodic_tick(self, deadline):
+      if not self.alive:
+        return
+      self.tick(max(self.loop.time() - deadline, 0.0))
+      if not self.period:
+        self.schedule_periodic(self.loop.time())
+        return
+      deadline += self.period
+      now = self.loop.time()
+      if now > deadline:
+        # Skip the deadlines that have already passed rather than running them back to back
+        missed = int((now - deadline) / self.period)
+        deadline += missed * self.period
+        with self.stats_lock:
+          self.missed += missed
+      self.schedule_periodic(deadline)
+
+
+    def notify(self):
+      '''
+      Signal that new packets or positions are waiting to be forwarded. Safe to call from any thread
+      '''
+      if self.event_driven and self.alive and not self.pending.is_set():
+        self.pending.set()
+        self.loop.call_soon_threadsafe(self.notified, time.perf_counter())
+
+
+    def notified(self, when):
+      '''
+      PRIVATE
+      Replace the idle timer with a tick once the coalesce window is over
+      '''
+      if not self.alive:
+        return
+      self.cancel()
+      self.timer = self.loop.call_later(self.coalesce_window, self.event_tick, when)
+
+
+    def event_tick(self, notified):
+      self.pending.clear()
+      if self.alive:
+        self.tick(time.perf_counter() - notified)
+        self.arm_idle()
+
+
+    def arm_idle(self):
+      '''
+      PRIVATE
+      Tick anyway after a whole period without notifications, or by the wakeup asked for by the
+      last tick, so robots keep receiving their positions
+      '''
+      timeout = self.period or None
+      if self.wakeup is not None:
+        timeout = min(timeout or float('inf'), max(self.wakeup - time.perf_counter(), 0.0))
+      self.timer = self.loop.call_later(timeout, self.idle_tick) if timeout is not None else None
+
+
+    def idle_tick(self):
+      if self.alive:
+        self.tick(0.0)
+        self.arm_idle()
+
+
+    def cancel(self):
+      '''
+      Cancel the pending tick, if any. Must be called on the event loop
+      '''
+      if self.timer is not None:
+        self.timer.cancel()
+        self.timer = None
+
+
+class AsyncCommHub(CommHub):
+    '''
+    Communication Hub driven by a single asyncio event loop
+    Offers the same interface as CommHub, but receiving and forwarding both run on one event loop,
+    with forwarding ticks scheduled as loop timers, instead of on a pair of threads. When event driven,
+    notifications schedule ticks on the loop, see LoopScheduler
+    :param forward_freq: float. Frequency of automatic calls to CommHub.forward_packets in Hertz
+        Set forward_freq=0 for maximum frequency
+        If left as None, CommHub.forward_packets must be called manually
+    :param loop: asyncio.AbstractEventLoop. Event loop to run on. If left as None, a new event loop
+        is created and run on a background thread
+    Every other parameter is passed on to CommHub
+    '''
+
+    def __init__(self, forward_freq=None, loop=None, **kwargs):
+        self.loop = loop
+        self.transport = None
+        self.loop_thread = None
+        super().__init__(forward_freq=forward_freq, **kwargs)
+
+
+    def start(self, forward_freq, host, port):
+      '''
+      Bind the CommHub's socket to the event loop and schedule the first forwarding tick
+
+      Parameters:
+      -----------
+      forward_freq -> float
+        Frequency of automatic calls to CommHub.forward_packets in Hertz, see CommHub
+      host -> string
+        The host of the CommHub
+      port -> int
+        The port of the CommHub
+      '''
+      self.socket = self.bind(host, port)
+      self.socket.setblocking(False)
+      self.sendto = self.timed_sendto(self.socket.sendto)  # Until the transport takes over the socket
+      self.register_gauges()
+
+      if self.loop is None:
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = Thread(target=self.loop.run_forever, name="CommHub Event Loop")
+        self.loop_thread.start()
+      # Tick on the event loop instead of a forwarding thread of its own
+      self.scheduler = LoopScheduler(self.loop, self.forward_packets, self.scheduler.period,
+                                     self.scheduler.event_driven, self.scheduler.coalesce_window)
+
+      future = asyncio.run_coroutine_threadsafe(self.open_endpoint(forward_freq), self.loop)
+      if self.loop_thread is not None:
+        future.result()
+
+
+    async def open_endpoint(self, forward_freq):
+      '''
+      Create the datagram transport on the event loop and start forwarding
+      '''
+      self.transport, _ = await self.loop.create_datagram_endpoint(
+        lambda: CommHubProtocol(self), sock=self.socket)
+      self.sendto = self.timed_sendto(self.transport.sendto)
+      print("Receiving Endpoint Initialised...")
+
+      if forward_freq is not None:
+        print("Forwarding Timer Initialised...")
+        self.scheduler.run()
+
+
+    def forward_packets(self):
+      '''
+      Drives communication between robots. All information shared between robots, and any
+      updates to positions are not sent unless this function is called.
+      Calls made from outside the event loop are run on the event loop, and block until done
+      '''
+      try:
+        running_loop = asyncio.get_running_loop()
+      except RuntimeError:
+        running_loop = None
+      if running_loop is self.loop or not self.loop.is_running():
+        return CommHub.forward_packets(self)
+
+      done = Future()
+
+      def forward():
+        try:
+          done.set_result(CommHub.forward_packets(self))
+        except Exception as e:
+          done.set_exception(e)
+
+      self.loop.call_soon_threadsafe(forward)
+      return done.result()
+
+
+    def close(self):
+      '''
+      Stop forwarding, close the transport and, if the CommHub owns its event loop, stop it
+      '''
+      self.alive = False
+      self.scheduler.stop()
+
+      def shutdown():
+        self.scheduler.cancel()
+        if self.transport is not None:
+          self.transport.close()
+        if self.loop_thread is not None:
+          self.loop.stop()
+
+      if self.loop.is_running():
+        self.loop.call_soon_threadsafe(shutdown)
+      else:
+        shutdown()
+      if self.loop_thread is not None:
+        self.loop_thread.join()
+        self.loop.close()
+      if self.pose_table is not None:
+        self.pose_table.close()
+      if self.telemetry is not None:
+        self.telemetry.close()
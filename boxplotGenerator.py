@@ -1,12 +1,51 @@
 import csv
+import glob
+import os
+import re
 import matplotlib.pyplot as plt
 import numpy
 
+import telemetry
+from swarmmetrics import swarm_metrics
+
+
+def load_results(name):
+  '''
+  Average distance of the swarm at the end of every run of an experiment. Runs recorded with
+  telemetry, as results/<name>/*.tel, are read straight from the recordings; otherwise the
+  distances written to results/<name>.csv by graphMaker are used. The per shard recordings of a
+  ShardedCommHub run, <run>.shard<n>.tel, are merged into one run
+
+  Returns:
+  --------
+  distances -> numpy.array
+    One average distance per run
+  '''
+  recordings = sorted(glob.glob(os.path.join('results', name, '*.tel')))
+  if not recordings:
+    return numpy.genfromtxt(f'results/{name}.csv', delimiter=',')
+  runs = {}
+  for recording in recordings:
+    run = re.sub(r'\.shard\d+$', '', os.path.splitext(recording)[0])
+    runs.setdefault(run, []).append(telemetry.load(recording))
+  distances = []
+  for records in runs.values():
+    if len(records) > 1:
+      records = numpy.concatenate(records)
+      records = records[numpy.argsort(records['time'], kind='stable')]
+    else:
+      records = records[0]
+    _, poses = telemetry.final_poses(records)
+    if len(poses) >= 2:
+      distances.append(swarm_metrics(poses[:, :3])['mean_distance'])
+  return numpy.array(distances)
+
+
 if __name__ == '__main__':
-  my_control_data = numpy.genfromtxt('results/control_data.csv', delimiter=',')
-  packet_loss_data_25 = numpy.genfromtxt('results/packet_loss_25.csv', delimiter=',')
-  packet_loss_data_50 = numpy.genfromtxt('results/packet_loss_50.csv', delimiter=',')
-  packet_loss_data_75 = numpy.genfromtxt('results/packet_loss_75.csv', delimiter=',')
+  my_control_data = load_results('control_data')
+  packet_loss_data_25 = load_results('packet_loss_25')
+  packet_loss_data_50 = load_results('packet_loss_50')
+  packet_loss_data_75 = load_results('packet_loss_75')
 
 
   my_dict = {'Control': my_control_data,
@@ -0,0 +1,119 @@
+import json
+import os
+
+from cameramodel import CACHE_DIR
+
+
+ARENA_CALIBRATION = os.path.join(CACHE_DIR, 'arena.json')
+
+
+class CalibrationStore:
+    '''
+    Arena Calibration Store
+    Persists the arena's pixel scale factor and bounds to a JSON file, keyed by camera and resolution,
+    so that a restarted tracker can reuse them instead of waiting to see both arena markers again
+    :param path: string. Path of the JSON file
+    :param arena_measurement: float. Distance between the arena markers in m. Calibrations made for
+        a different arena are not reused
+    '''
+
+    def __init__(self, path=ARENA_CALIBRATION, arena_measurement=0.88):
+        self.path = path
+        self.arena_measurement = arena_measurement
+
+
+    @staticmethod
+    def key(camera, resolution, camera_model=None):
+      '''
+      Parameters:
+      -----------
+      camera -> int/string
+        Index or path of the camera, as passed to cv2.VideoCapture
+      resolution -> tuple
+        (width, height) of the captured frames
+      camera_model -> CameraModel
+        Lens model used to undistort the frames, if any. Undistortion moves the arena markers
+
+      Returns:
+      --------
+      key -> string
+        Identifies the calibration in the store
+      '''
+      key = f"{camera}@{resolution[0]}x{resolution[1]}"
+      if camera_model is not None:
+        key += f"/{camera_model.cache_key()}"
+      return key
+
+
+    def read(self):
+      try:
+        with open(self.path) as file:
+          return json.load(file)
+      except FileNotFoundError:
+        return {}
+      except (OSError, ValueError) as err:
+        print(f"Ignoring unreadable calibration file '{self.path}': {err}")
+        return {}
+
+
+    def load(self, key, resolution):
+      '''
+      Look up a stored calibration and check it is still usable
+
+      Parameters:
+      -----------
+      key -> string
+        See CalibrationStore.key
+      resolution -> tuple
+        (width, height) of the captured frames. The stored bounds must lie inside the frame
+
+      Returns:
+      --------
+      calibration -> dict ~ with 'scale' and the 'arena' bounds [maxX, maxY, minX, minY]
+
+      None ~ if nothing usable is stored
+      '''
+      calibration = self.read().get(key)
+      if calibration is None:
+        return None
+      try:
+        scale = float(calibration['scale'])
+        arena = [float(bound) for bound in calibration['arena']]
+        measurement = float(calibration['arena_measurement'])
+      except (KeyError, TypeError, ValueError):
+        return None
+
+      if (scale <= 0 or len(arena) != 4 or measurement != self.arena_measurement or
+          any(bound < 0 or bound > max(resolution) for bound in arena)):
+        return None
+      return {'scale': scale, 'arena': arena}
+
+
+    def save(self, key, scale, arena):
+      '''
+      Store a calibration, replacing any previous one for the same key
+
+      Parameters:
+      -----------
+      key -> string
+        See CalibrationStore.key
+      scale -> float
+        Number of pixels in 1 metre
+      arena -> list
+        Arena bounds in pixels: [maxX, maxY, minX, minY]
+      '''
+      calibrations = self.read()
+      calibrations[key] = {
+        'scale': float(scale),
+        'arena': [float(bound) for bound in arena],
+        'arena_measurement': self.arena_measurement,
+      }
+      try:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Write then rename, so that a crash mid-write never leaves a corrupt file behind
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+          json.dump(calibrations, file, indent=2)
+        os.replace(temp_path, self.path)
+      except OSError as err:
+        print(f"Could not save calibration to '{self.path}': {err}")
@@ -0,0 +1,153 @@
+import hashlib
+import os
+
+import numpy as np
+
+import cv2
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration')
+
+
+class CameraModel:
+    '''
+    Pinhole Camera Model
+    Corrects lens distortion using the camera's intrinsics. Only the detected marker corners need to
+    be undistorted, which costs next to nothing per frame. Whole frames can also be undistorted, with
+    remap tables that are computed once and cached on disk
+    :param camera_matrix: np.array. 3x3 intrinsic matrix [[fx, 0, cx], [0, fy, cy], [0, 0, 1]]
+    :param dist_coeffs: np.array. Distortion coefficients (k1, k2, p1, p2[, k3...])
+    :param resolution: tuple. (width, height) of the frames the intrinsics apply to
+    :param cache_dir: string. Directory the remap tables are cached in
+    '''
+
+    def __init__(self, camera_matrix, dist_coeffs, resolution, cache_dir=CACHE_DIR):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).ravel()
+        self.resolution = (int(resolution[0]), int(resolution[1]))
+        self.cache_dir = cache_dir
+        self.maps = None  # (map1, map2) remap tables, built on first use
+
+
+    @classmethod
+    def load(cls, path, cache_dir=CACHE_DIR):
+      '''
+      Load intrinsics saved by numpy (.npz, with 'camera_matrix', 'dist_coeffs' and 'resolution')
+      or by OpenCV's calibration tools (.yml/.yaml/.xml, with 'camera_matrix',
+      'distortion_coefficients', 'image_width' and 'image_height')
+
+      Parameters:
+      -----------
+      path -> string
+        Path of the calibration file
+
+      Returns:
+      --------
+      cameraModel -> CameraModel
+      '''
+      if path.endswith('.npz'):
+        with np.load(path) as calibration:
+          return cls(calibration['camera_matrix'], calibration['dist_coeffs'],
+                     calibration['resolution'], cache_dir)
+
+      storage = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+      if not storage.isOpened():
+        raise FileNotFoundError(f"Cannot open calibration file '{path}'")
+      try:
+        return cls(storage.getNode('camera_matrix').mat(),
+                   storage.getNode('distortion_coefficients').mat(),
+                   (storage.getNode('image_width').real(), storage.getNode('image_height').real()),
+                   cache_dir)
+      finally:
+        storage.release()
+
+
+    def for_resolution(self, width, height):
+      '''
+      Adapt the intrinsics to frames captured at another resolution with the same field of view
+
+      Returns:
+      --------
+      cameraModel -> CameraModel
+        self if the resolution is unchanged, otherwise a rescaled copy
+      '''
+      if (width, height) == self.resolution:
+        return self
+      scale = np.array([[width / self.resolution[0]], [height / self.resolution[1]], [1]])
+      return CameraModel(self.camera_matrix * scale, self.dist_coeffs, (width, height), self.cache_dir)
+
+
+    def undistort_points(self, points):
+      '''
+      Remove the lens distortion from pixel coordinates. The result stays in pixels, as seen by an
+      ideal camera with the same intrinsics
+
+      Parameters:
+      -----------
+      points -> np.array
+        Array of (x, y) pixel coordinates of any shape (..., 2)
+
+      Returns:
+      --------
+      undistorted -> np.array
+        Undistorted coordinates, in the same shape as 'points'
+      '''
+      points = np.asarray(points, dtype=np.float64)
+      if points.size == 0:
+        return points
+      undistorted = cv2.undistortPoints(points.reshape(-1, 1, 2), self.camera_matrix,
+                                        self.dist_coeffs, P=self.camera_matrix)
+      return undistorted.reshape(points.shape)
+
+
+    def undistort_frame(self, frame):
+      '''
+      Remove the lens distortion from a whole frame using the cached remap tables
+      '''
+      map1, map2 = self.remap_tables()
+      return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+
+    def remap_tables(self):
+      '''
+      Build the undistortion remap tables, or load them from the cache if these intrinsics have
+      been seen before
+
+      Returns:
+      --------
+      (map1, map2) -> tuple of np.array
+        Fixed point tables, as returned by cv2.initUndistortRectifyMap
+      '''
+      if self.maps is not None:
+        return self.maps
+
+      cache_path = None
+      if self.cache_dir is not None:
+        cache_path = os.path.join(self.cache_dir, f"remap_{self.cache_key()}.npz")
+        if os.path.exists(cache_path):
+          try:
+            with np.load(cache_path) as maps:
+              self.maps = (maps['map1'], maps['map2'])
+            return self.maps
+          except (OSError, ValueError, KeyError) as err:
+            print(f"Ignoring unreadable remap cache '{cache_path}': {err}")
+
+      self.maps = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                              self.camera_matrix, self.resolution, cv2.CV_16SC2)
+      if cache_path is not None:
+        try:
+          os.makedirs(self.cache_dir, exist_ok=True)
+          np.savez(cache_path, map1=self.maps[0], map2=self.maps[1])
+        except OSError as err:
+          print(f"Could not cache remap tables to '{cache_path}': {err}")
+      return self.maps
+
+
+    def cache_key(self):
+      '''
+      Fingerprint of the intrinsics and resolution the remap tables depend on
+      '''
+      digest = hashlib.sha1(self.camera_matrix.tobytes())
+      digest.update(self.dist_coeffs.tobytes())
+      digest.update(np.array(self.resolution, dtype=np.int64).tobytes())
+      return digest.hexdigest()[:16]
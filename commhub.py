@@ -5,7 +5,81 @@ import time
 from collections import defaultdict
 from threading import Thread, Lock
 
-from packet import Packet
+import instrumentation
+from locationtable import LocationTable
+from packet import BufferPool, FrameBuilder, MSG_SIZE, Packet, PacketTemplate, UDP_MTU
+from packetqueue import PacketQueue
+from scheduler import ForwardScheduler
+from sharedposes import SharedPoseTable
+from spatialindex import UniformGrid
+from telemetry import TelemetryRecorder
+
+# Hot path metrics, shared by every CommHub in the process. See instrumentation.py
+RECEIVE_TIME = instrumentation.histogram('hub.receive')  # Draining and decoding a batch of datagrams
+PACKETS_RECEIVED = instrumentation.counter('hub.packets_received')
+PACKETS_INVALID = instrumentation.counter('hub.packets_invalid')
+UPDATE_TIME = instrumentation.histogram('hub.update_position')
+FORWARD_TIME = instrumentation.histogram('hub.forward_tick')
+SENDTO_TIME = instrumentation.histogram('hub.sendto')
+DATAGRAMS_SENT = instrumentation.counter('hub.datagrams_sent')
+BYTES_SENT = instrumentation.counter('hub.bytes_sent')
+
+
+def relative_rab(source, destination):
+  '''
+  Computes the Range and Bearing of source robots as seen by destination robots
+
+  Parameters:
+  -----------
+  source -> np.array
+    (..., 4) array of [x, y, z, yaw] rows for the sending robots
+  destination -> np.array
+    (..., 4) array of [x, y, z, yaw] rows for the receiving robots, broadcastable against source
+
+  Returns:
+  --------
+  (distance, azimuth, elevation) -> tuple of np.array
+    Element-wise Range and Bearing, with angles wrapped following the same rules as the
+    on board RAB sensor
+  '''
+  # Relative vector from the destination to the source
+  rel_vector = source[..., :3] - destination[..., :3]
+  planar = np.hypot(rel_vector[..., 0], rel_vector[..., 1])
+  distance = np.hypot(planar, rel_vector[..., 2])
+
+  # Compute azimuth (theta) and elevation (phi), converting azimuth to the receivers coordinates
+  rel_theta = np.arctan2(rel_vector[..., 1], rel_vector[..., 0]) - destination[..., 3]
+  rel_phi = np.arctan2(rel_vector[..., 2], planar)
+
+  # Wrap angles
+  azimuth = np.where(rel_theta > np.pi, rel_theta - 2*np.pi, rel_theta)
+  elevation = np.where(rel_phi < 0., rel_phi + 2*np.pi, rel_phi)
+  return distance, azimuth, elevation
+
+
+def all_pairs(num_robots, sources=None):
+  '''
+  Enumerate every ordered (source, destination) pair of distinct robots, grouped by source
+
+  Parameters:
+  -----------
+  num_robots -> int
+    Number of robots
+  sources -> np.array
+    Ascending row indices of the sending robots. Defaults to every robot
+
+  Returns:
+  --------
+  (src, dst) -> tuple of np.array
+    Row indices of the sending and receiving robots
+  '''
+  if sources is None:
+    src, dst = np.nonzero(~np.eye(num_robots, dtype=bool))
+    return src, dst
+  src = np.repeat(sources, num_robots)
+  dst = np.tile(np.arange(num_robots), len(sources))
+  not_self = src != dst
+  return src[not_self], dst[not_self]
 
 
 class CommHub:
@@ -16,67 +90,273 @@ class CommHub:
     :param forward_freq: float. Frequency of automatic calls to CommHub.forward_packets in Hertz
         Set forward_freq=0 for maximum frequency
         If left as None, CommHub.forward_packets must be called manually
+    :param event_driven: bool. Forward as soon as new packets or positions arrive instead of at a fixed
+        rate. forward_freq then sets the slowest rate at which positions are still forwarded
+    :param coalesce_window: float. When event driven, time in seconds to keep gathering new packets and
+        positions before forwarding
     :param neighbor_distance: float. The range for communication between robots. Distance units must
         be consistent with the units used for CommHub.update_position
+    :param range_limited: bool. Only forward packets between robots closer than neighbor_distance.
+        If left as False, every robot receives the traffic of every other robot
+    :param recv_batch: int. Maximum number of datagrams drained from the socket in one pass of the
+        receiving thread. Set recv_batch=1 to handle one datagram at a time
+    :param coalesce: bool. Pack everything bound for a robot in a tick, its own position first, into as
+        few datagrams as possible. Robots must decode these with packet.decode_frame
+    :param mtu: int. Maximum size of a coalesced datagram in bytes
+    :param queue_length: int. Most packets held per robot while waiting to be forwarded
+    :param queue_policy: string. What to drop once a robot's queue is full: 'drop-oldest',
+        'drop-newest' or 'latest', see packetqueue.PacketQueue
+    :param pose_table: string. Name of a sharedposes.SharedPoseTable written by a tracker in another
+        process. Its poses are read into the CommHub before every forwarding tick
+    :param impairment: impairment.Impairment. Loss, delay, duplication and noise applied to forwarding,
+        for experiments. None forwards everything as it is. Held back packets are sent by the first
+        tick after they fall due, so when forwarding manually they wait for the next call to
+        CommHub.forward_packets. When coalescing they share the frames of that tick
+    :param telemetry: string. Path of a telemetry.TelemetryRecorder file recording every pose update
+        and the packets forwarded from each robot in every tick. None records nothing
     :param host: string. The host of the CommHub. HOST default is "localhost"
     :param port: int. The port of the CommHub. PORT default is 8000
     '''
 
-    def __init__(self, forward_freq=None, neighbor_distance=1.7, host='144.32.175.138', port=4242):
+    def __init__(self, forward_freq=None, neighbor_distance=1.7, host='144.32.175.138', port=4242,
+                 range_limited=False, recv_batch=64, coalesce=False, mtu=UDP_MTU,
+                 event_driven=False, coalesce_window=0.0, queue_length=64, queue_policy='drop-oldest',
+                 pose_table=None, impairment=None, telemetry=None):
         self.alive = True
-        self.locs = {}  # comm_id : np.array()
+        self.locations = LocationTable()  # x, y, z, yaw and timestamp of every comm_id
         self.neighbor_distance = neighbor_distance
-        self.packets = defaultdict(list)
+        self.range_limited = range_limited
+        self.grid = UniformGrid(neighbor_distance)
+        if queue_policy not in PacketQueue.POLICIES:
+            raise ValueError(f"Unknown queue policy '{queue_policy}', expected one of {PacketQueue.POLICIES}")
+        self.packets = defaultdict(lambda: PacketQueue(queue_length, queue_policy))
         self.packets_lock = Lock()
         self.id2ip = {}
+        self.templates = []  # Reusable PacketTemplates for the packets forwarded in a tick
+        self.coalesce = coalesce
+        self.mtu = mtu
+        self.frames = []  # Reusable FrameBuilders, one per destination robot
+        self.pose_template = PacketTemplate()
+        self.recv_batch = recv_batch
+        self.pool = BufferPool(max(64, recv_batch))  # Receive buffers, handed back once forwarded
+        # Poses written by a tracker running in its own process, mapped read only
+        self.pose_table = SharedPoseTable(pose_table, readonly=True) if pose_table is not None else None
+        self.pose_sequence = 0
+        self.pose_table_lock = Lock()  # Both forwarding and readers of the locations sync the table
+        self.impairment = impairment
+        self.telemetry = TelemetryRecorder(telemetry) if telemetry is not None else None
+        self.scheduler = ForwardScheduler(self.forward_packets, self.forward_period(forward_freq),
+                                          event_driven, coalesce_window)
+
+        self.start(forward_freq, host, port)
+
+
+    def start(self, forward_freq, host, port):
+      '''
+      Bind the CommHub's socket and start the receiving and, if requested, forwarding threads
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      Parameters:
+      -----------
+      forward_freq -> float
+        Frequency of automatic calls to CommHub.forward_packets in Hertz, see CommHub
+      host -> string
+        The host of the CommHub
+      port -> int
+        The port of the CommHub
+      '''
+      self.socket = self.bind(host, port)
+      self.sendto = self.timed_sendto(self.socket.sendto)
+      self.register_gauges()
 
-        try:
-            self.socket.bind((host, port))
-        except OSError as e:
-            self.socket.close()
-            print("ERROR: Trying to create a CommHub on a busy address")
-            raise e
+      if forward_freq is not None:
+        self.forward_thread = Thread(target=self.auto_forward, args=(
+          self.scheduler.period,), name="Auto Forwarder")
+        self.forward_thread.start()
+
+      self.received_thread = Thread(target=self.receive, name="Receiver")
+      self.received_thread.start()
+
+
+    def timed_sendto(self, sendto):
+      '''
+      Wrap a sendto function so every datagram sent is timed and counted. Instrumentation is only
+      checked once here, so when it is disabled before the CommHub starts sending costs nothing extra
 
-        if forward_freq is not None:
-            if forward_freq:
-                period = 1/forward_freq
-            else:
-                period = 0
+      Returns:
+      --------
+      sendto -> function
+        Takes the same arguments as 'sendto'
+      '''
+      if not instrumentation.REGISTRY.enabled:
+        return sendto
 
-            self.forward_thread = Thread(target=self.auto_forward, args=(
-                period,), name="Auto Forwarder")
-            self.forward_thread.start()
+      def send(payload, addr):
+        start = time.perf_counter()
+        sent = sendto(payload, addr)
+        SENDTO_TIME.record_since(start)
+        DATAGRAMS_SENT.add()
+        BYTES_SENT.add(len(payload))
+        return sent
+      return send
 
-        self.received_thread = Thread(target=self.receive, name="Receiver")
-        self.received_thread.start()
+
+    def register_gauges(self):
+      '''
+      Report the CommHub's queues and forwarding in instrumentation snapshots
+      '''
+      instrumentation.gauge('hub.robots', lambda: len(self.id2ip))
+      instrumentation.gauge('hub.queued', lambda: sum(
+        queue['depth'] for queue in self.queue_stats().values()))
+      instrumentation.gauge('hub.dropped', lambda: sum(
+        queue['dropped'] for queue in self.queue_stats().values()))
+      instrumentation.gauge('hub.forwarding', self.forward_stats)
+
+
+    def bind(self, host, port):
+      '''
+      Create the UDP socket of the CommHub, bound to (host, port)
+
+      Returns:
+      --------
+      socket -> socket.socket
+        The bound socket
+      '''
+      udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+      try:
+        udp_socket.bind((host, port))
+      except OSError as e:
+        udp_socket.close()
+        print("ERROR: Trying to create a CommHub on a busy address")
+        raise e
+      return udp_socket
+
+
+    @staticmethod
+    def forward_period(forward_freq):
+      '''
+      Returns:
+      --------
+      period -> float
+        Time between calls to CommHub.forward_packets, 0 if forward_freq is 0
+      '''
+      if forward_freq:
+        return 1/forward_freq
+      return 0
+
+
+    def close(self):
+      '''
+      Stop the receiving and forwarding threads and close the socket
+      '''
+      self.alive = False
+      self.scheduler.stop()
+      self.wake_receiver()
+      for thread in (getattr(self, 'forward_thread', None), self.received_thread):
+        if thread is not None:
+          thread.join()
+      self.socket.close()
+      if self.pose_table is not None:
+        self.pose_table.close()
+      if self.telemetry is not None:
+        self.telemetry.close()
+
+
+    def wake_receiver(self):
+      '''
+      Wake the receiving thread with an empty datagram so it notices the CommHub is closing
+      '''
+      try:
+        self.socket.sendto(b'', self.socket.getsockname())
+      except OSError:
+        pass
 
 
     def receive(self):
       '''
-      New Thread that blocks until a new packet arrives on the socket. Packets
-      are added to self.packets and IPs of senders stored according to their ID
+      New Thread that blocks until a new packet arrives on the socket. Every packet already
+      waiting on the socket is then drained in the same pass, and the whole batch is added
+      to self.packets, with IPs of senders stored according to their ID, under a single lock
       '''
 
       print("Receiving Thread Initialised...")  # Debug
       while self.alive: # While Comm Hub Alive
-        received_packet = Packet.from_socket(self.socket) # Read Packet from Socket
+        received_packets = self.receive_batch() # Read Packets from Socket
+        if received_packets is None:
+          break
+
+        self.queue_packets(received_packets)
+
+
+    def queue_packets(self, received_packets):
+      '''
+      Add received packets to self.packets and store the IPs of their senders, under a single lock
+
+      Parameters:
+      -----------
+      received_packets -> list of Packet Objects
+        Valid packets, in the order they were received
+      '''
+      self.packets_lock.acquire()
+      for received_packet in received_packets:
+        # print("Received packet from Robot {}".format(received_packet.comm_id))  # Debug
         # Update IP/id database
         self.id2ip[received_packet.comm_id] = received_packet.addr
+        dropped = self.packets[received_packet.comm_id].append(received_packet)
+        if dropped is not None:
+          dropped.release()
+      self.packets_lock.release()
+      self.scheduler.notify()
+
+
+    def receive_batch(self):
+      '''
+      Block until a datagram arrives, then keep reading without blocking until the socket is
+      empty or CommHub.recv_batch datagrams have been read. Datagrams are received into
+      buffers of the CommHub's BufferPool, and malformed ones are discarded
+
+      Returns:
+      --------
+      received_packets -> list of Packet Objects ~ if successful
 
+      None ~ if socket.error occured before anything was received
+      '''
+      received_packets = []
+      flags = 0
+      start = None
+      while len(received_packets) < self.recv_batch:
+        buffer = self.pool.acquire()
+        try:
+          length, addr = self.socket.recvfrom_into(buffer, MSG_SIZE, flags)
+        except BlockingIOError:
+          # Nothing else is pending on the socket
+          self.pool.release(buffer)
+          break
+        except OSError:
+          # The socket is broken
+          self.pool.release(buffer)
+          return received_packets or None
+        if not flags:
+          # Only time the batch from the first datagram, not the wait for it
+          start = time.perf_counter()
+          flags = socket.MSG_DONTWAIT
+
+        received_packet = Packet.from_buffer(buffer, length, addr, self.pool)
         if received_packet:
-          # print("Received packet from Robot {}".format(received_packet.comm_id))  # Debug
-          self.packets_lock.acquire()
-          self.packets[received_packet.comm_id].append(received_packet)
-          self.packets_lock.release()
+          received_packets.append(received_packet)
         else:
-          break
+          self.pool.release(buffer)
+          PACKETS_INVALID.add()
+      if start is not None:
+        RECEIVE_TIME.record_since(start)
+        PACKETS_RECEIVED.add(len(received_packets))
+      return received_packets
 
 
     def auto_forward(self, period):
       '''
-      New thread to automatically call CommHub.forward_packets at a certain frequency
+      New thread to automatically call CommHub.forward_packets at a certain frequency, or as new
+      packets and positions arrive when event driven. See scheduler.ForwardScheduler
 
       Parameters:
       -----------
@@ -84,9 +364,31 @@ class CommHub:
         Time Delay between handling of packet forwarding
       '''
       print("Forwarding Thread Initialised...")
-      while self.alive:
-        time.sleep(period)
-        self.forward_packets()
+      self.scheduler.period = period
+      self.scheduler.run()
+
+
+    def forward_stats(self):
+      '''
+      Returns:
+      --------
+      stats -> dict
+        Achieved forwarding rate, tick durations and overruns, see ForwardScheduler.get_stats
+      '''
+      return self.scheduler.get_stats()
+
+
+    def queue_stats(self):
+      '''
+      Returns:
+      --------
+      stats -> dict
+        robot id : depth, drop and age counters of the robot's queue, see PacketQueue.get_stats
+      '''
+      self.packets_lock.acquire()
+      stats = {robot_id: queue.get_stats() for robot_id, queue in self.packets.items()}
+      self.packets_lock.release()
+      return stats
 
 
     def forward_packets(self):
@@ -94,48 +396,148 @@ class CommHub:
       Drives communication between robots. All information shared between robots, and any
       updates to positions are not sent unless this function is called
       '''
-      try:
-        # For all known robots, get addresses and ids
-        for robot_id1, robot_addr1 in self.id2ip.items():
-
-          # If there are packets from these robots, put them into a data structure
-          self.packets_lock.acquire()
-          tmppackets = self.packets[robot_id1][:]
-          self.packets[robot_id1] = []
-          self.packets_lock.release()
-          if len(tmppackets) == 0:
-            tmppackets = [Packet(0.0, 0.0, 0.0, robot_id1)]
-
-          # Cycle through all other robots and forward the packets
-          for robot_id2, addr2 in self.id2ip.items():
-            try:
-              # Compute relative vector and distance
-              rel_vector = self.locs[robot_id1][:-1] - self.locs[robot_id2][:-1]
-              distance = np.linalg.norm(rel_vector)
-
-              # Send updated own location to the robot
-              if robot_id1 == robot_id2:
-                self.send_to(robot_id2, Packet(
-                  self.locs[robot_id1][0], self.locs[robot_id1][1], self.locs[robot_id1][2], robot_id1, theta=self.locs[robot_id1][3]))
-
-              # Only forward packets if within comms distance, in RAB format
-              else:  # if distance < self.neighbor_distance:
-                # Compute azimuth (theta) and elevation (phi)
-                rel_theta = np.arctan2(rel_vector[1], rel_vector[0])
-                rel_phi = np.arctan2(rel_vector[2], np.linalg.norm(rel_vector[:2]))
-
-                # convert angle to receivers coordinate
-                rel_theta = rel_theta - self.locs[robot_id2][3]
-                # Wrap angles
-                azimuth = rel_theta - 2*np.pi if rel_theta > np.pi else rel_theta
-                elevation = rel_phi + 2*np.pi if rel_phi < 0. else rel_phi
-
-                self.send_to_with_rb(robot_id2, tmppackets, np.array(
-                  (distance*100.0, azimuth, elevation)))  # *100.0 to obtain [cm] on board
-            except KeyError as e:
-              pass  # print("No locs for Robot {}".format(robot_id2))
-      except RuntimeError as e:
-        print("Caught Runtime Exception caused by robot IP appearing out of sync")
+      start = time.perf_counter()
+      if self.pose_table is not None:
+        self.sync_pose_table()
+
+      # Snapshot the known robots so the receiver thread can keep registering new ones
+      robots = list(self.id2ip.items())
+
+      # Pack the locations of all located robots into one contiguous array for this tick
+      snapshot = self.locations.snapshot()
+      located = [robot_id for robot_id, _ in robots if robot_id in snapshot]
+      row = {robot_id: index for index, robot_id in enumerate(located)}
+      positions = snapshot.poses(located)
+      if self.impairment is not None:
+        positions = self.impairment.perturb(positions)
+
+      # Robots whose packets, and own position, are forwarded in this tick
+      sources = self.forward_sources(robots)
+      source_rows = None
+      if len(sources) < len(robots):
+        source_rows = np.array(sorted(row[robot_id] for robot_id, _ in sources if robot_id in row),
+                               dtype=np.intp)
+
+      # Only visit robots within comms distance when range limited, otherwise every other robot
+      if self.range_limited:
+        src, dst = self.grid.neighbour_pairs(positions, self.neighbor_distance)
+        if source_rows is not None:
+          from_source = np.zeros(len(located), dtype=bool)
+          from_source[source_rows] = True
+          src, dst = src[from_source[src]], dst[from_source[src]]
+      else:
+        src, dst = all_pairs(len(located), source_rows)
+      distance, azimuth, elevation = relative_rab(positions[src], positions[dst])
+
+      # Drop the lost links up front, and find out which are delayed or duplicated
+      delays = copies = None
+      if self.impairment is not None:
+        delivered, delays, copies = self.impairment.draw(distance, self.neighbor_distance)
+        src, dst, distance, azimuth, elevation = (
+          links[delivered] for links in (src, dst, distance, azimuth, elevation))
+        if delays is not None:
+          delays, copies = delays[delivered], copies[delivered]
+      distance *= 100.0  # *100.0 to obtain [cm] on board
+      bounds = np.searchsorted(src, np.arange(len(located) + 1))
+
+      # Start the datagram of every source with its own location. Other destinations only get one
+      # if packets are forwarded to them
+      if self.coalesce:
+        while len(self.frames) < len(located):
+          self.frames.append(FrameBuilder(self.mtu))
+        for frame in self.frames[:len(located)]:
+          frame.reset()
+        for i in (range(len(located)) if source_rows is None else source_rows):
+          self.frames[i].add(self.pose_template.load(Packet(
+            positions[i, 0], positions[i, 1], positions[i, 2], located[i], theta=positions[i, 3])))
+
+      traffic = []  # (row, packets received, copies forwarded) of robots whose packets were forwarded
+
+      # For all known robots, get addresses and ids
+      for robot_id1, robot_addr1 in sources:
+
+        # If there are packets from these robots, put them into a data structure
+        self.packets_lock.acquire()
+        tmppackets = self.packets[robot_id1].drain()
+        self.packets_lock.release()
+        received = len(tmppackets)
+        if len(tmppackets) == 0:
+          tmppackets = [Packet(0.0, 0.0, 0.0, robot_id1)]
+
+        i = row.get(robot_id1)
+        if i is None:
+          self.release_packets(tmppackets)
+          continue  # print("No locs for Robot {}".format(robot_id1))
+
+        # Serialise the packets once, only their RAB field changes between destinations
+        templates = self.load_templates(tmppackets)
+        self.release_packets(tmppackets)
+        if received and self.telemetry is not None:
+          traffic.append((i, received, received * (bounds[i + 1] - bounds[i])))
+
+        # Cycle through the neighbouring robots and forward the packets, in RAB format
+        if delays is not None:
+          for pair in range(bounds[i], bounds[i + 1]):
+            self.defer_templates_with_rb(located[dst[pair]], templates,
+              (distance[pair], azimuth[pair], elevation[pair]), delays[pair], copies[pair], start)
+          if not self.coalesce:
+            self.send_to(robot_id1, Packet(
+              positions[i, 0], positions[i, 1], positions[i, 2], robot_id1, theta=positions[i, 3]))
+          continue
+
+        if self.coalesce:
+          for pair in range(bounds[i], bounds[i + 1]):
+            self.frame_templates_with_rb(dst[pair], located[dst[pair]], templates,
+              (distance[pair], azimuth[pair], elevation[pair]))
+          continue
+
+        # Send updated own location to the robot
+        self.send_to(robot_id1, Packet(
+          positions[i, 0], positions[i, 1], positions[i, 2], robot_id1, theta=positions[i, 3]))
+
+        for pair in range(bounds[i], bounds[i + 1]):
+          self.send_templates_with_rb(located[dst[pair]], templates,
+            (distance[pair], azimuth[pair], elevation[pair]))
+
+      if self.impairment is not None:
+        due = self.impairment.collect(time.perf_counter())
+        if self.coalesce:
+          self.frame_deferred(due, row)
+        else:
+          for payload, addr in due:
+            self.sendto(payload, addr)
+        next_due = self.impairment.next_due()
+        if next_due is not None:
+          # Come back for them even if nothing new arrives when event driven
+          self.scheduler.wake_at(next_due)
+
+      if self.coalesce:
+        for i, robot_id in enumerate(located):
+          if self.frames[i].count:
+            self.sendto(self.frames[i].payload(), self.id2ip[robot_id])
+
+      if traffic:
+        rows, received, forwarded = zip(*traffic)
+        self.telemetry.record_traffic([located[i] for i in rows], positions[list(rows)], received, forwarded)
+      FORWARD_TIME.record_since(start)
+
+
+    def forward_sources(self, robots):
+      '''
+      Robots whose packets, and own position, this CommHub forwards. All of them, unless the
+      CommHub is one of several sharing the swarm, see shardedhub.ShardWorker
+
+      Parameters:
+      -----------
+      robots -> list
+        (robot id, address) of every known robot
+
+      Returns:
+      --------
+      robots -> list
+        (robot id, address) of the robots to forward from
+      '''
+      return robots
 
 
     def send_to(self, destination, packets):
@@ -152,13 +554,13 @@ class CommHub:
       try:
         packets[0]
       except (AttributeError, TypeError):
-        self.socket.sendto(packets.byte_string(), self.id2ip[destination])
+        self.sendto(packets.byte_string(), self.id2ip[destination])
         # print(" comm packet sender {} receiver {}".format(sender,destination))
         return
 
       for packet in packets:
         msg = packet.byte_string()
-        self.socket.sendto(msg, self.id2ip[destination])
+        self.sendto(msg, self.id2ip[destination])
 
 
 
@@ -179,17 +581,161 @@ class CommHub:
       try:
         packets[0]
       except (AttributeError, TypeError):
-        packets.set_rb(rel_rb[0], rel_rb[1], rel_rb[2])
-        self.socket.sendto(packets.byte_string(), self.id2ip[destination])
-        return
+        packets = [packets]
+
+      self.send_templates_with_rb(destination, self.load_templates(packets), rel_rb)
 
+
+    def send_templates_with_rb(self, destination, templates, rel_rb):
+      '''
+      Forward already serialised packets to 'destination', patching in the Range and Bearing
+      between the source and destination robot
+
+      Parameters:
+      -----------
+      destination -> int
+        Destination Robot ID to send Packets to
+      templates -> list of PacketTemplate Objects
+        Serialised packets, see CommHub.load_templates
+      rel_rb -> tuple/np.array
+        The Distance, Range and Bearing between the source and destination robot
+      '''
+      addr = self.id2ip[destination]
+      for template in templates:
+        template.set_rb(rel_rb[0], rel_rb[1], rel_rb[2])
+        self.sendto(template.payload(), addr)
+
+
+    def frame_templates_with_rb(self, index, destination, templates, rel_rb):
+      '''
+      Add already serialised packets to the coalesced datagram of 'destination', sending the
+      datagram and starting a new one whenever it fills up
+
+      Parameters:
+      -----------
+      index -> int
+        Index of the destination's FrameBuilder in self.frames
+      destination -> int
+        Destination Robot ID to send Packets to
+      templates -> list of PacketTemplate Objects
+        Serialised packets, see CommHub.load_templates
+      rel_rb -> tuple/np.array
+        The Distance, Range and Bearing between the source and destination robot
+      '''
+      frame = self.frames[index]
+      for template in templates:
+        if frame.add(template, rel_rb):
+          continue
+        if frame.count:
+          self.sendto(frame.payload(), self.id2ip[destination])
+          frame.reset()
+        if not frame.add(template, rel_rb):
+          # Too large to share a datagram, send it on its own
+          template.set_rb(rel_rb[0], rel_rb[1], rel_rb[2])
+          self.sendto(template.payload(), self.id2ip[destination])
+
+
+    def defer_templates_with_rb(self, destination, templates, rel_rb, delay, copies, now):
+      '''
+      Hold copies of already serialised packets back for 'delay' seconds before they are sent to
+      'destination', see impairment.Impairment. When coalescing they are held as frame records, to be
+      packed with everything else bound for 'destination' in the tick they fall due, see
+      CommHub.frame_deferred
+
+      Parameters:
+      -----------
+      destination -> int
+        Destination Robot ID to send Packets to
+      templates -> list of PacketTemplate Objects
+        Serialised packets, see CommHub.load_templates
+      rel_rb -> tuple/np.array
+        The Distance, Range and Bearing between the source and destination robot
+      delay -> float
+        Time from 'now' the packets are sent, in seconds
+      copies -> int
+        Number of times each packet is sent
+      now -> float
+        time.perf_counter() reading
+      '''
+      addr = self.id2ip[destination]
+      for template in templates:
+        template.set_rb(rel_rb[0], rel_rb[1], rel_rb[2])
+        for _ in range(copies):
+          if self.coalesce:
+            self.impairment.schedule(delay, template.content(), destination, now)
+          else:
+            self.impairment.schedule(delay, template.payload(), addr, now)
+
+
+    def frame_deferred(self, due, row):
+      '''
+      Pack held back records into the coalesced datagrams of their destinations for this tick
+
+      Parameters:
+      -----------
+      due -> list
+        (record, destination robot id) of every record due, see impairment.Impairment.collect
+      row -> dict
+        robot id : index of the robot's FrameBuilder in self.frames, for the robots located this tick
+      '''
+      extra = {}  # Frames of destinations no longer located
+      for record, destination in due:
+        addr = self.id2ip.get(destination)
+        if addr is None:
+          continue
+        i = row.get(destination)
+        if i is not None:
+          frame = self.frames[i]
+        else:
+          frame = extra.get(destination)
+          if frame is None:
+            frame = extra[destination] = FrameBuilder(self.mtu)
+        if frame.add_record(record):
+          continue
+        if frame.count:
+          self.sendto(frame.payload(), addr)
+          frame.reset()
+        if not frame.add_record(record):
+          # Too large to share a datagram, send it on its own
+          self.sendto(record, addr)
+      for destination, frame in extra.items():
+        if frame.count:
+          self.sendto(frame.payload(), self.id2ip[destination])
+
+
+    def load_templates(self, packets):
+      '''
+      Serialise 'packets' into the reusable PacketTemplates of the CommHub
+
+      Parameters:
+      -----------
+      packets -> list of Packet Objects
+        Packets to be forwarded
+
+      Returns:
+      --------
+      templates -> list of PacketTemplate Objects
+        One template per packet. Only valid until the next call
+      '''
+      while len(self.templates) < len(packets):
+        self.templates.append(PacketTemplate())
+      return [template.load(packet) for template, packet in zip(self.templates, packets)]
+
+
+    def release_packets(self, packets):
+      '''
+      Hand the receive buffers of packets that have been dealt with back to the buffer pool
+
+      Parameters:
+      -----------
+      packets -> list of Packet Objects
+        Packets that will not be read again
+      '''
       for packet in packets:
-        packet.set_rb(rel_rb[0], rel_rb[1], rel_rb[2])
-        msg = packet.byte_string()
-        self.socket.sendto(msg, self.id2ip[destination])
+        packet.release()
 
 
-    def update_position(self, robot_id, loc, yaw):
+    def update_position(self, robot_id, loc, yaw, timestamp=None):
       '''
       Update the position of the specified robot from information from the Camera
 
@@ -199,11 +745,84 @@ class CommHub:
         The ID of the robot whose position is to be updated
       loc -> list/tuple/numpy.array
         The updated position of the robot
-      yaw -> float
+      yaw -> float/list
         Bearing of the Robot
+      timestamp -> float
+        Time the position was captured. Defaults to now
+      '''
+      start = time.perf_counter()
+      yaw = np.ravel(yaw)[0]
+      self.locations.update(robot_id, loc[0], loc[1], loc[2], yaw, timestamp)
+      self.record_poses([robot_id], [[loc[0], loc[1], loc[2], yaw]], timestamp)
+      # print("Robot {} pos {}".format(robot_id, (*loc, yaw)))
+      self.scheduler.notify()
+      UPDATE_TIME.record_since(start)
+
+
+    def update_positions(self, robot_ids, poses, timestamp=None):
+      '''
+      Update the positions of several robots at once, such as every robot seen in a camera frame
+
+      Parameters:
+      -----------
+      robot_ids -> list/np.array
+        IDs of the robots whose positions are to be updated
+      poses -> np.array
+        (N, 4) array with one [x, y, z, yaw] row per robot
+      timestamp -> float
+        Time the positions were captured. Defaults to now
       '''
-      self.locs[int(robot_id)] = np.append(np.array(loc), yaw)
-      # print("Robot {} pos {}".format(robot_id, self.locs[robot_id]))
+      start = time.perf_counter()
+      self.locations.update_many(robot_ids, poses, timestamp)
+      self.record_poses(robot_ids, poses, timestamp)
+      self.scheduler.notify()
+      UPDATE_TIME.record_since(start)
+
+
+    def sync_pose_table(self):
+      '''
+      Copy any poses written to the shared pose table since the last sync into the CommHub. Safe to
+      call from several threads, each write is only applied once
+      '''
+      if self.pose_table.sequence() == self.pose_sequence:
+        return
+      with self.pose_table_lock:
+        if self.pose_table.sequence() == self.pose_sequence:
+          return  # Already synced by another thread
+        sequence, robot_ids, poses, timestamps = self.pose_table.read()
+        if len(robot_ids) > 0:
+          self.locations.update_many(robot_ids, poses, timestamps)
+          self.record_poses(robot_ids, poses, timestamps)
+        self.pose_sequence = sequence
+
+
+    def record_poses(self, robot_ids, poses, timestamp):
+      '''
+      Record a pose update in the CommHub's telemetry, if it has any, see TelemetryRecorder.record_poses
+      '''
+      if self.telemetry is not None:
+        self.telemetry.record_poses(robot_ids, poses, timestamp)
+
 
     def get_locations(self):
-      return self.locs
\ No newline at end of file
+      '''
+      Returns:
+      --------
+      locations -> dict
+        robot id : np.array([x, y, z, yaw]), copied from a consistent snapshot of the locations
+      '''
+      if self.pose_table is not None:
+        self.sync_pose_table()
+      return self.locations.snapshot().as_dict()
+
+
+    def get_snapshot(self):
+      '''
+      Returns:
+      --------
+      snapshot -> LocationSnapshot
+        The latest published locations, readable without locking or copying
+      '''
+      if self.pose_table is not None:
+        self.sync_pose_table()
+      return self.locations.snapshot()
@@ -0,0 +1,127 @@
+from threading import Condition
+
+
+class LatestFrameSlot:
+    '''
+    Single slot frame buffer between the capture thread and the detection workers
+    A new frame overwrites one that no worker has claimed yet, so workers always pick up the most
+    recent frame instead of working through a backlog of stale ones
+    '''
+
+    def __init__(self):
+        self.condition = Condition()
+        self.frame = None
+        self.timestamp = 0
+        self.sequence = 0  # Number of frames claimed so far
+        self.dropped = 0  # Frames overwritten before any worker claimed them
+        self.closed = False
+
+
+    def put(self, frame, timestamp):
+      '''
+      Offer a newly captured frame to the detection workers
+
+      Parameters:
+      -----------
+      frame -> np.array
+        The captured image
+      timestamp -> float
+        Time the frame was captured
+      '''
+      with self.condition:
+        if self.frame is not None:
+          self.dropped += 1
+        self.frame = frame
+        self.timestamp = timestamp
+        self.condition.notify()
+
+
+    def take(self):
+      '''
+      Claim the latest frame, blocking until one is available
+
+      Returns:
+      --------
+      (sequence, timestamp, frame) -> tuple ~ if a frame was claimed. Sequence numbers count
+        claimed frames, so they have no gaps even when frames are dropped
+
+      None ~ if the slot has been closed
+      '''
+      with self.condition:
+        while self.frame is None and not self.closed:
+          self.condition.wait()
+        if self.frame is None:
+          return None
+        claimed = (self.sequence, self.timestamp, self.frame)
+        self.sequence += 1
+        self.frame = None
+        return claimed
+
+
+    def close(self):
+      '''
+      Stop handing out frames and wake every waiting worker
+      '''
+      with self.condition:
+        self.closed = True
+        self.condition.notify_all()
+
+
+class ReorderBuffer:
+    '''
+    Collects results from several workers and hands them out in sequence order
+    :param producers: int. Number of workers putting results. The buffer closes once they are all done
+    '''
+
+    def __init__(self, producers=1):
+        self.condition = Condition()
+        self.results = {}  # sequence : result
+        self.next_sequence = 0
+        self.producers = producers
+
+
+    def put(self, sequence, result):
+      '''
+      Parameters:
+      -----------
+      sequence -> int
+        Sequence number of the frame the result belongs to, see LatestFrameSlot.take
+      result ->
+        The result of processing the frame. None marks a frame that produced no result, which
+        ReorderBuffer.get passes over
+      '''
+      with self.condition:
+        self.results[sequence] = result
+        self.condition.notify_all()
+
+
+    def producer_done(self):
+      '''
+      Called by each worker as it exits
+      '''
+      with self.condition:
+        self.producers -= 1
+        self.condition.notify_all()
+
+
+    def get(self):
+      '''
+      Block until the result following the previously returned one is available. Frames that
+      produced no result are skipped
+
+      Returns:
+      --------
+      result ~ the next result in sequence order
+
+      None   ~ once every producer is done and every result has been handed out
+      '''
+      with self.condition:
+        while True:
+          while self.next_sequence not in self.results and self.producers > 0:
+            self.condition.wait()
+          if self.next_sequence not in self.results:
+            return None
+          self.next_sequence += 1
+          result = self.results.pop(self.next_sequence - 1)
+          if result is not None:
+            return result
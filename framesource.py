@@ -0,0 +1,371 @@
+import math
+import os
+import time
+
+from collections import deque
+
+import numpy as np
+
+import cv2
+
+
+class FrameSource:
+    '''
+    Frame Source
+    Common interface of everything ArUcoTracker can read frames from. It mirrors the parts of
+    cv2.VideoCapture the tracker uses, so a cv2.VideoCapture can be used wherever a FrameSource is
+    expected. Subclasses implement FrameSource.read and, where it applies, FrameSource.set
+    :param name: string. Identifies the source, e.g. in stored calibrations
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def __str__(self):
+      return self.name
+
+
+    def isOpened(self):
+      return True
+
+
+    def read(self):
+      '''
+      Returns:
+      --------
+      (ret, frame) -> tuple
+        ret is False, and frame None, once the source has no more frames
+      '''
+      raise NotImplementedError
+
+
+    def get(self, prop):
+      return 0.0
+
+
+    def set(self, prop, value):
+      return False
+
+
+    def release(self):
+      pass
+
+
+class Camera(FrameSource):
+    '''
+    Live camera, read through cv2.VideoCapture
+    :param index: int. Index of the camera, or a device path
+    '''
+
+    def __init__(self, index):
+        super().__init__(str(index))
+        self.cap = cv2.VideoCapture(index)
+
+
+    def isOpened(self):
+      return self.cap.isOpened()
+
+
+    def read(self):
+      return self.cap.read()
+
+
+    def get(self, prop):
+      return self.cap.get(prop)
+
+
+    def set(self, prop, value):
+      return self.cap.set(prop, value)
+
+
+    def release(self):
+      self.cap.release()
+
+
+class VideoFile(Camera):
+    '''
+    Recorded video file. The resolution is fixed by the recording, so requests to change it are
+    ignored
+    :param path: string. Path of the video file
+    :param loop: bool. Start again from the first frame at the end of the file
+    :param realtime: bool. Deliver frames at the recorded frame rate rather than as fast as they decode
+    '''
+
+    def __init__(self, path, loop=False, realtime=False):
+        super().__init__(path)
+        self.loop = loop
+        self.period = 0.0
+        if realtime and self.cap.get(cv2.CAP_PROP_FPS) > 0:
+            self.period = 1 / self.cap.get(cv2.CAP_PROP_FPS)
+        self.next_frame = time.perf_counter()
+
+
+    def read(self):
+      if self.period:
+        self.next_frame = max(self.next_frame + self.period, time.perf_counter())
+        time.sleep(max(self.next_frame - self.period - time.perf_counter(), 0))
+      ret, frame = self.cap.read()
+      if not ret and self.loop:
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        ret, frame = self.cap.read()
+      return ret, frame
+
+
+    def set(self, prop, value):
+      if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+        return False
+      return self.cap.set(prop, value)
+
+
+class ImageDirectory(FrameSource):
+    '''
+    Directory of still images, read in file name order
+    :param path: string. Path of the directory
+    :param loop: bool. Start again from the first image after the last one
+    '''
+
+    EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+    def __init__(self, path, loop=False):
+        super().__init__(path)
+        self.loop = loop
+        self.files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(self.EXTENSIONS))
+        self.position = 0
+        self.resolution = None  # (width, height) frames are resized to, None keeps them as stored
+        first = cv2.imread(self.files[0]) if self.files else None
+        self.shape = first.shape[1::-1] if first is not None else (0, 0)
+
+
+    def isOpened(self):
+      return len(self.files) > 0
+
+
+    def read(self):
+      if self.position == len(self.files):
+        if not self.loop or not self.files:
+          return False, None
+        self.position = 0
+      frame = cv2.imread(self.files[self.position])
+      self.position += 1
+      if frame is None:
+        return False, None
+      if self.resolution is not None and frame.shape[1::-1] != self.resolution:
+        frame = cv2.resize(frame, self.resolution)
+      return True, frame
+
+
+    def get(self, prop):
+      width, height = self.resolution or self.shape
+      if prop == cv2.CAP_PROP_FRAME_WIDTH:
+        return float(width)
+      if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+        return float(height)
+      if prop == cv2.CAP_PROP_FRAME_COUNT:
+        return float(len(self.files))
+      return 0.0
+
+
+    def set(self, prop, value):
+      width, height = self.resolution or self.shape
+      if prop == cv2.CAP_PROP_FRAME_WIDTH:
+        self.resolution = (int(value), height)
+      elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+        self.resolution = (width, int(value))
+      else:
+        return False
+      return True
+
+
+class Synthetic(FrameSource):
+    '''
+    Synthetic Arena
+    Renders DICT_5X5_50 markers at known poses: the two arena markers down the left hand side, and
+    'num_robots' robots, with IDs from 1, each circling its own spot in the arena. The ground truth
+    of every rendered frame is kept, so tracking accuracy can be measured
+    :param num_robots: int. Number of robots rendered
+    :param resolution: tuple. (width, height) of the frames. Can be changed with FrameSource.set
+    :param frames: int. Number of frames before the source runs out. None never runs out
+    :param fps: float. Rate frames are delivered at. None delivers them as fast as they are rendered
+    :param speed: float. Angular speed of the robots in radians per frame
+    :param history: int. Number of frames ground truth is kept for
+    :param arena_measurement: float. Distance between the arena markers in m, as in ArUcoTracker
+    '''
+
+    def __init__(self, num_robots=8, resolution=(1280, 720), frames=None, fps=None, speed=0.02,
+                 history=1000, arena_measurement=0.88):
+        super().__init__(f"synthetic-{num_robots}")
+        self.dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_5X5_50)
+        self.num_robots = num_robots
+        self.frames = frames
+        self.period = 1 / fps if fps else 0.0
+        self.speed = speed
+        self.arena_measurement = arena_measurement
+        self.frame_index = 0
+        self.next_frame = time.perf_counter()
+        self.history = deque(maxlen=history)  # (time, robot ids, pixel centres, bearings) per frame
+        self.resize(*resolution)
+
+
+    def resize(self, width, height):
+      '''
+      PRIVATE
+      Lay the arena out for frames of width x height pixels
+      '''
+      self.width, self.height = int(width), int(height)
+      self.marker_size = max(self.height // 10, 12)
+      self.border = self.marker_size // 5  # White quiet zone drawn around every marker
+      margin = self.marker_size // 2
+      self.markers = {}
+      self.arena = [(margin, margin), (margin, self.height - margin - self.marker_size)]
+
+      # Give every robot its own cell, right of the arena markers, to circle around in
+      left = 3 * self.marker_size
+      columns = max(math.ceil(math.sqrt(self.num_robots * max(self.width - left, 1) / self.height)), 1)
+      rows = max(math.ceil(self.num_robots / columns), 1)
+      cell_width, cell_height = (self.width - left) / columns, self.height / rows
+      # Keep the robots, even when rotated, between the arena markers
+      self.orbit = max(min(cell_width, cell_height) / 2 - 1.5 * self.marker_size, 0)
+      self.spots = np.array([(left + (i % columns + 0.5) * cell_width, (i // columns + 0.5) * cell_height)
+                             for i in range(self.num_robots)])
+
+
+    def marker(self, marker_id):
+      '''
+      PRIVATE
+      Image of a marker with a white quiet zone around it
+      '''
+      if marker_id not in self.markers:
+        image = cv2.aruco.drawMarker(self.dictionary, marker_id, self.marker_size)
+        self.markers[marker_id] = cv2.copyMakeBorder(image, self.border, self.border, self.border,
+                                                     self.border, cv2.BORDER_CONSTANT, value=255)
+      return self.markers[marker_id]
+
+
+    def read(self):
+      if self.frames is not None and self.frame_index >= self.frames:
+        return False, None
+      if self.period:
+        self.next_frame = max(self.next_frame + self.period, time.perf_counter())
+        time.sleep(max(self.next_frame - self.period - time.perf_counter(), 0))
+
+      frame = np.full((self.height, self.width), 255, dtype=np.uint8)
+      for (x, y) in self.arena:
+        image = self.marker(0)
+        frame[y:y + image.shape[0], x:x + image.shape[1]] = image
+
+      phase = self.frame_index * self.speed + np.arange(self.num_robots)
+      orbits = self.spots + self.orbit * np.column_stack((np.cos(phase), np.sin(phase)))
+      headings = np.degrees(phase) % 360
+      centres, bearings = np.empty((self.num_robots, 2)), np.empty(self.num_robots)
+      for index, ((x, y), heading) in enumerate(zip(orbits, headings)):
+        centres[index], bearings[index] = self.draw(frame, index + 1, x, y, heading)
+
+      self.frame_index += 1
+      self.history.append((time.time(), np.arange(1, self.num_robots + 1), centres, bearings))
+      return True, cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+
+    def draw(self, frame, marker_id, x, y, angle):
+      '''
+      PRIVATE
+      Draw a marker centred on (x, y), rotated anticlockwise by 'angle' degrees
+
+      Returns:
+      --------
+      (centre, bearing) -> tuple
+        Pixel centre the marker was drawn at, after rounding to whole pixels, and its bearing as
+        measured by ArUcoTracker, from its centre to the middle of its top edge
+      '''
+      image = self.marker(marker_id)
+      side = int(math.ceil(image.shape[0] * math.sqrt(2)))
+      rotation = cv2.getRotationMatrix2D((image.shape[1] / 2, image.shape[0] / 2), angle, 1)
+      rotation[:, 2] += (side - image.shape[0]) / 2
+      patch = cv2.warpAffine(image, rotation, (side, side), borderValue=255)
+
+      x0, y0 = int(round(x - side / 2)), int(round(y - side / 2))
+      fx0, fy0 = max(x0, 0), max(y0, 0)
+      fx1, fy1 = min(x0 + side, self.width), min(y0 + side, self.height)
+      if fx1 > fx0 and fy1 > fy0:
+        region = frame[fy0:fy1, fx0:fx1]
+        np.minimum(region, patch[fy0 - y0:fy1 - y0, fx0 - x0:fx1 - x0], out=region)
+
+      # Where the middle of the marker's top edge ends up once rotated, relative to its centre
+      front = rotation @ np.array([image.shape[1] / 2, image.shape[0] / 2 - self.marker_size / 2, 1])
+      centre = (x0 + side / 2, y0 + side / 2)
+      return centre, math.atan2(front[1] - side / 2, front[0] - side / 2)
+
+
+    def pixels_per_metre(self):
+      '''
+      Returns:
+      --------
+      scale -> float
+        True number of pixels in 1 metre, from the outer edges of the arena markers
+      '''
+      top = self.arena[0][1] + self.border
+      bottom = self.arena[1][1] + self.border + self.marker_size
+      return (bottom - top) / self.arena_measurement
+
+
+    def ground_truth(self, timestamp):
+      '''
+      Look up what was rendered in the frame a tracker stamped with 'timestamp'
+
+      Returns:
+      --------
+      (robot_ids, centres, bearings) -> tuple of np.array ~ pixel centres and bearings of the robots
+        in the latest frame delivered at or before 'timestamp'
+
+      None ~ if that frame is no longer in the history
+      '''
+      for delivered, robot_ids, centres, bearings in reversed(self.history):
+        if delivered <= timestamp:
+          return robot_ids, centres, bearings
+      return None
+
+
+    def get(self, prop):
+      if prop == cv2.CAP_PROP_FRAME_WIDTH:
+        return float(self.width)
+      if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+        return float(self.height)
+      if prop == cv2.CAP_PROP_FPS:
+        return 1 / self.period if self.period else 0.0
+      if prop == cv2.CAP_PROP_FRAME_COUNT:
+        return float(self.frames or 0)
+      return 0.0
+
+
+    def set(self, prop, value):
+      if prop == cv2.CAP_PROP_FRAME_WIDTH:
+        self.resize(value, self.height)
+      elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+        self.resize(self.width, value)
+      else:
+        return False
+      return True
+
+
+def open_source(source):
+  '''
+  Open a frame source from what is passed to ArUcoTracker as CHOSEN_CAMERA
+
+  Parameters:
+  -----------
+  source -> int/string/FrameSource
+    Camera index, video file or image directory path, or an already opened source
+
+  Returns:
+  --------
+  source -> FrameSource
+  '''
+  if isinstance(source, (FrameSource, cv2.VideoCapture)):
+    return source
+  if isinstance(source, str):
+    if os.path.isdir(source):
+      return ImageDirectory(source)
+    if os.path.isfile(source):
+      return VideoFile(source)
+  return Camera(source)
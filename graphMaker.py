@@ -1,95 +1,90 @@
 from threading import Thread, Lock
 import csv
-import itertools
-import math
-import matplotlib.pyplot as plt
 import time
 import numpy
 
+from swarmmetrics import MetricsStream, swarm_metrics
+
 class graphMaker():
-  def __init__(self, commHub=None, frequency=1, experiment_length=30, num_robots=10):
+  '''
+  Samples the positions of the swarm from the CommHub and streams aggregation metrics to CSV files
+  in 'results_dir' as they are taken, see swarmmetrics.MetricsStream
+  :param frequency: float. Time between samples in seconds, e.g. 0.02 to sample at 50 Hz
+  :param experiment_length: float. Length of the experiment in seconds
+  :param num_robots: int. Size of the swarm. Metrics are computed over the robots actually located
+  :param rolling_window: int. Number of samples in the rolling means of the metrics, 0 to leave them out
+  '''
+
+  def __init__(self, commHub=None, frequency=1, experiment_length=30, num_robots=10, start_prompt=True,
+               results_dir='results', rolling_window=0):
     self.commHub = commHub
     self.frequency = frequency
     self.experiment_length = experiment_length
     self.num_robots = num_robots
+    self.results_dir = results_dir
+    self.rolling_window = rolling_window
 
     self.current_time = 0
+    self.latest = None  # Metrics of the most recent sample
 
-    #Graph Variables
-    self.time_axis = []
-    self.total_distance_axis = []
-    self.indiv_distance_axis = {}
-
-    input("Press Enter to Begin Data Collection")
+    if start_prompt:
+      input("Press Enter to Begin Data Collection")
     self.gatherDataThread = Thread(target=self.gather_data, name="Retrieve Data")
     self.gatherDataThread.start()
 
 
-  def calc_average_total_distance(self, saved_locations, comparison):
-    return math.sqrt(math.pow(saved_locations[comparison[0]][0] - saved_locations[comparison[1]][0], 2) +
-                    math.pow(saved_locations[comparison[0]][1] - saved_locations[comparison[1]][1], 2) +
-                    math.pow(saved_locations[comparison[0]][2] - saved_locations[comparison[1]][2], 2))
-
   def write_to_csv(self, total_dist):
-    with open(r'results/total_dist.csv', 'a') as file:
+    with open(f'{self.results_dir}/total_dist.csv', 'a') as file:
         writer = csv.writer(file)
         writer.writerow(total_dist)
 
 
   def gather_data(self):
-    while self.experiment_length > self.current_time:
-      saved_locations = self.commHub.get_locations()
-      total_dist = 0
-      num_of_indiv_comps = 0
-      indiv_distance = {}
-
-      try:
-        for comparison in itertools.combinations(saved_locations, 2):
-          #Comparison saved in the form (ID, ID)
-          distance = self.calc_average_total_distance(saved_locations, comparison)
-          total_dist += distance
-          num_of_indiv_comps += 1
-
-          for indiv_robot in comparison:
-            try:
-              indiv_distance[indiv_robot].append(distance)
-            except:
-              indiv_distance[indiv_robot] = []
-
-        total_average_distance = total_dist / num_of_indiv_comps
-
-        for key in indiv_distance:
-          try:
-            self.indiv_distance_axis[key].append(sum(indiv_distance[key])/(self.num_robots-1))
-          except:
-            self.indiv_distance_axis[key] = [sum(indiv_distance[key])/(self.num_robots-1)]
-
-        print(self.indiv_distance_axis)
-        self.time_axis.append(self.current_time)
-        self.total_distance_axis.append(total_average_distance)
-      except ZeroDivisionError:
-        continue # Robot Comm Hub not yet initialised
-
-      time.sleep(self.frequency)
-      self.current_time += self.frequency
-    self.write_to_csv([total_average_distance])
+    stream = MetricsStream(self.results_dir, window=self.rolling_window)
+    start = deadline = time.perf_counter()
+    try:
+      while self.experiment_length > self.current_time:
+        snapshot = self.commHub.get_snapshot()
+        robot_ids = list(snapshot.index)
+
+        if len(robot_ids) >= 2: # Otherwise Robot Comm Hub not yet initialised
+          positions = snapshot.poses(robot_ids)[:, :3]
+          self.latest = swarm_metrics(positions)
+          stream.write(self.current_time, robot_ids, self.latest)
+
+        # Sample on fixed deadlines so the time taken by a sample does not lower the rate
+        deadline += self.frequency
+        time.sleep(max(deadline - time.perf_counter(), 0))
+        self.current_time = time.perf_counter() - start
+    finally:
+      stream.close()
+    if self.latest is not None:
+      self.write_to_csv([self.latest['mean_distance']])
 
 
   def draw_graphs(self):
+    # Imported here as matplotlib is slow to load and only needed once the experiment is over
+    import matplotlib.pyplot as plt
+
+    # Read back from the streamed files, the samples are not kept in memory
+    swarm = numpy.genfromtxt(f'{self.results_dir}/swarm_metrics.csv', delimiter=',', names=True, ndmin=1)
+    robots = numpy.genfromtxt(f'{self.results_dir}/robot_metrics.csv', delimiter=',', names=True, ndmin=1)
+
     plt.title('Graph showing total average distance for the swarm')
-    plt.xlabel('Time Steps')
+    plt.xlabel('Time (s)')
     plt.ylabel('Average Distance (m)')
 
-    plt.plot(self.time_axis, self.total_distance_axis, color='blue', linewidth=3)
+    plt.plot(swarm['time'], swarm['mean_distance'], color='blue', linewidth=3)
 
     plt.savefig('graphs/test1.png')
     plt.clf()
 
     plt.title('Graph showing individual average distance for the swarm')
-    plt.xlabel('Time Steps')
+    plt.xlabel('Time (s)')
     plt.ylabel('Average Distance (m)')
-    for key, value in self.indiv_distance_axis.items():
-      plt.plot(self.time_axis, value, label=key)
+    for robot_id in numpy.unique(robots['robot_id']):
+      robot = robots[robots['robot_id'] == robot_id]
+      plt.plot(robot['time'], robot['mean_distance'], label=int(robot_id))
     plt.savefig('graphs/indiv1.png')
 
     pass
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+import argparse
+import json
+import math
+import selectors
+import socket
+import struct
+import time
+
+from multiprocessing import Process, Queue
+from threading import Event, Thread
+
+import numpy as np
+
+from commhub import CommHub
+from impairment import Impairment
+from packet import HEADER, MSG_LENGTH, MSG_SIZE, UDP_MTU, Packet, decode_frame, is_frame
+from shardedhub import ShardedCommHub
+
+# Every message sent by the swarm starts with its send time and a sequence number
+STAMP = struct.Struct('=dI')
+
+
+def swarm(hub_address, num_robots, rate, msg_size, duration, results):
+  '''
+  Simulated robots, run in their own process so that they do not compete with the CommHub for the
+  GIL. Every robot has its own UDP socket and sends one Packet carrying a single 'msg_size' byte
+  message to the CommHub at 'rate' Hz, and times every message forwarded back to it
+
+  Parameters:
+  -----------
+  hub_address -> tuple
+    (host, port) of the CommHub
+  results -> multiprocessing.Queue
+    Receives a dict of the swarm's counters once the run is over
+  '''
+  sockets = []
+  for _ in range(num_robots):
+    robot_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    robot_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    robot_socket.bind(('127.0.0.1', 0))
+    robot_socket.setblocking(False)
+    sockets.append(robot_socket)
+  packets = [bytearray(Packet(0.0, 0.0, 0.0, robot_id, [bytes(max(msg_size, STAMP.size))]).byte_string())
+             for robot_id in range(1, num_robots + 1)]
+  stamp_offset = HEADER.size + MSG_LENGTH.size
+
+  received = {'datagrams': 0, 'delivered': 0}
+  latencies = []
+  done = Event()
+
+  def receive():
+    selector = selectors.DefaultSelector()
+    for robot_id, robot_socket in enumerate(sockets, start=1):
+      selector.register(robot_socket, selectors.EVENT_READ, robot_id)
+    buffer = bytearray(max(UDP_MTU, MSG_SIZE))
+    view = memoryview(buffer)
+    while not done.is_set():
+      for key, _ in selector.select(timeout=0.1):
+        while True:
+          try:
+            length = key.fileobj.recv_into(buffer)
+          except BlockingIOError:
+            break
+          now = time.perf_counter()
+          received['datagrams'] += 1
+          if is_frame(view[:length]):
+            forwarded = decode_frame(buffer, length) or []
+          else:
+            forwarded = [Packet.from_buffer(buffer, length)]
+          for packet in forwarded:
+            if not packet or packet.comm_id == key.data:
+              continue  # The robot's own position
+            for msg in packet.msgs:
+              if len(msg) >= STAMP.size:
+                latencies.append(now - STAMP.unpack_from(msg)[0])
+                received['delivered'] += 1
+
+  receiver = Thread(target=receive, name="Swarm Receiver")
+  receiver.start()
+
+  # Register every robot with the CommHub first, so the first timed messages reach everyone
+  for robot_id, robot_socket in enumerate(sockets, start=1):
+    robot_socket.sendto(Packet(0.0, 0.0, 0.0, robot_id).byte_string(), hub_address)
+  time.sleep(0.2)
+
+  sent = 0
+  period = 1 / rate
+  deadline = start = time.perf_counter()
+  while deadline - start < duration:
+    now = time.perf_counter()
+    if deadline > now:
+      time.sleep(deadline - now)
+    for robot_socket, packet in zip(sockets, packets):
+      STAMP.pack_into(packet, stamp_offset, time.perf_counter(), sent)
+      robot_socket.sendto(packet, hub_address)
+      sent += 1
+    deadline += period
+
+  # Give the last packets time to be forwarded
+  time.sleep(0.5)
+  done.set()
+  receiver.join()
+  for robot_socket in sockets:
+    robot_socket.close()
+
+  latencies = np.array(latencies or [np.nan]) * 1000
+  results.put({
+    'sent': sent,
+    'datagrams': received['datagrams'],
+    'delivered': received['delivered'],
+    'latency_p50_ms': float(np.percentile(latencies, 50)),
+    'latency_p95_ms': float(np.percentile(latencies, 95)),
+    'latency_p99_ms': float(np.percentile(latencies, 99)),
+  })
+
+
+def trajectories(comm_hub, num_robots, radius, rate, stop):
+  '''
+  Feed the CommHub the positions of robots circling the arena, as the tracker would
+  '''
+  robot_ids = np.arange(1, num_robots + 1)
+  offsets = 2 * math.pi * robot_ids / num_robots
+  poses = np.zeros((num_robots, 4))
+  while not stop.wait(1 / rate):
+    phase = offsets + time.perf_counter() * 0.5
+    poses[:, 0] = radius * (1 + np.cos(phase))
+    poses[:, 1] = radius * (1 + np.sin(phase))
+    poses[:, 3] = phase + math.pi / 2
+    comm_hub.update_positions(robot_ids, poses)
+
+
+def run(num_robots, forward_freq, args):
+  options = dict(forward_freq=forward_freq, host='127.0.0.1', port=0, range_limited=args.range_limited,
+                 coalesce=args.coalesce, event_driven=args.event_driven,
+                 queue_length=args.queue_length, queue_policy=args.queue_policy)
+  if args.loss or args.delay or args.jitter or args.duplication or args.position_noise:
+    options['impairment'] = Impairment(args.seed, loss=args.loss, delay=args.delay, jitter=args.jitter,
+                                       duplication=args.duplication, position_noise=args.position_noise)
+  if args.shards:
+    comm_hub = ShardedCommHub(args.shards, **options)
+    hub_address = comm_hub.address
+  else:
+    comm_hub = CommHub(**options)
+    hub_address = comm_hub.socket.getsockname()
+  stop = Event()
+  mover = Thread(target=trajectories, name="Trajectories",
+                 args=(comm_hub, num_robots, args.radius, args.pose_rate, stop))
+  mover.start()
+
+  results = Queue()
+  robots = Process(target=swarm, name="Swarm", args=(hub_address, num_robots,
+                   args.rate, args.msg_size, args.duration, results))
+  if not args.shards:
+    comm_hub.scheduler.reset_stats()
+  robots.start()
+  result = results.get()
+  robots.join()
+
+  forwarding = comm_hub.forward_stats()
+  stop.set()
+  mover.join()
+  dropped = sum(queue['dropped'] for queue in comm_hub.queue_stats().values())
+  comm_hub.close()
+
+  # Every message should reach every other robot, unless forwarding is range limited
+  expected = result['sent'] * (num_robots - 1)
+  result.update({
+    'robots': num_robots,
+    'forward_freq': forward_freq,
+    'tick_rate': forwarding['rate'],
+    # Messages delivered to other robots, comparable with and without coalescing, and the datagrams
+    # carrying them along with the robots' own positions
+    'forwarded_pps': result['delivered'] / args.duration,
+    'datagrams_ps': result['datagrams'] / args.duration,
+    'dropped': dropped,
+    'lost': None if args.range_limited else expected - result['delivered'],
+    'forwarder_cpu': forwarding['cpu_utilisation'],
+    'forwarder_cpu_time': forwarding['cpu_time'],
+  })
+  return result
+
+
+def report(result):
+  lost = '-' if result['lost'] is None else f"{result['lost']:,}"
+  print(f"  {result['robots']:>6} {result['forward_freq']:>6} Hz  ticks {result['tick_rate']:7.1f}/s"
+        f"  forwarded {result['forwarded_pps']:>9,.0f} pkt/s in {result['datagrams_ps']:>9,.0f} datagrams/s"
+        f"  latency {result['latency_p50_ms']:6.2f}/{result['latency_p95_ms']:6.2f}/{result['latency_p99_ms']:7.2f} ms"
+        f"  dropped {result['dropped']:>7,}  lost {lost:>9}  forwarder CPU {result['forwarder_cpu']:6.1%}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Loopback swarm load test of the CommHub")
+  parser.add_argument('--robots', type=int, nargs='+', default=[2, 8, 32], help="Swarm sizes to sweep")
+  parser.add_argument('--freqs', type=float, nargs='+', default=[100, 500],
+                      help="forward_freq values to sweep, 0 forwards back to back")
+  parser.add_argument('--rate', type=float, default=20, help="Packets sent per robot per second")
+  parser.add_argument('--msg-size', type=int, default=40, help="Size of the message in each packet in bytes")
+  parser.add_argument('--duration', type=float, default=5, help="Length of each run in seconds")
+  parser.add_argument('--pose-rate', type=float, default=30, help="Position updates per second")
+  parser.add_argument('--radius', type=float, default=0.5, help="Radius of the robots' circle in m")
+  parser.add_argument('--range-limited', action='store_true')
+  parser.add_argument('--coalesce', action='store_true')
+  parser.add_argument('--event-driven', action='store_true')
+  parser.add_argument('--queue-length', type=int, default=64)
+  parser.add_argument('--queue-policy', default='drop-oldest')
+  parser.add_argument('--loss', type=float, default=0, help="Impair forwarding, see impairment.Impairment")
+  parser.add_argument('--delay', type=float, default=0)
+  parser.add_argument('--jitter', type=float, default=0)
+  parser.add_argument('--duplication', type=float, default=0)
+  parser.add_argument('--position-noise', type=float, default=0)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--shards', type=int, default=0,
+                      help="Run a ShardedCommHub with this many worker processes instead of a CommHub")
+  parser.add_argument('--json', help="Also write the results to this file, e.g. to track regressions in CI")
+  args = parser.parse_args()
+
+  print(f"Each robot sends {args.rate:g} packets/s with a {args.msg_size} byte message for {args.duration:g} s."
+        f" Latency is p50/p95/p99")
+  results = []
+  for num_robots in args.robots:
+    for forward_freq in args.freqs:
+      result = run(num_robots, forward_freq, args)
+      report(result)
+      results.append(result)
+
+  if args.json:
+    with open(args.json, 'w') as file:
+      json.dump(results, file, indent=2)
@@ -0,0 +1,202 @@
+import math
+import time
+
+import numpy as np
+
+import instrumentation
+
+LINKS_LOST = instrumentation.counter('impairment.links_lost')
+LINKS_DELAYED = instrumentation.counter('impairment.links_delayed')
+LINKS_DUPLICATED = instrumentation.counter('impairment.links_duplicated')
+
+
+class TimerWheel:
+    '''
+    PRIVATE
+    Datagrams waiting to be sent, bucketed by the slot of time they are due in. Scheduling and
+    collecting are constant time per datagram, however many are waiting. Datagrams are held along
+    with a target, the address or robot they are bound for
+    :param resolution: float. Width of a slot in seconds
+    :param span: float. Longest delay in seconds. Longer delays are cut short to it
+    '''
+
+    def __init__(self, resolution, span):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(int(math.ceil(span / resolution)) + 2)]
+        self.current = self.slot(time.perf_counter())  # Next slot to be collected
+        self.pending = 0
+
+
+    def slot(self, when):
+      return int(when / self.resolution)
+
+
+    def schedule(self, delay, payload, target, now):
+      '''
+      Parameters:
+      -----------
+      delay -> float
+        Time from 'now' the datagram is due in seconds
+      payload -> bytes
+        The datagram, which must not be reused by the caller
+      target ->
+        (host, port) it is sent to, or the robot it is bound for
+      now -> float
+        time.perf_counter() reading
+      '''
+      due = max(self.slot(now + delay), self.current)
+      due = min(due, self.current + len(self.slots) - 1)
+      self.slots[due % len(self.slots)].append((payload, target))
+      self.pending += 1
+
+
+    def collect(self, now):
+      '''
+      Returns:
+      --------
+      due -> list
+        (payload, target) of every datagram due by 'now', in the order they fell due
+      '''
+      due = []
+      last = self.slot(now)
+      # Every bucket is visited at most once, however long it has been since the last collection
+      for slot in range(self.current, min(last, self.current + len(self.slots) - 1) + 1):
+        bucket = self.slots[slot % len(self.slots)]
+        if bucket:
+          due.extend(bucket)
+          bucket.clear()
+      self.current = max(self.current, last + 1)
+      self.pending -= len(due)
+      return due
+
+
+    def next_due(self):
+      '''
+      Returns:
+      --------
+      when -> float
+        time.perf_counter() reading by which the earliest waiting datagram is due, None if there are none
+      '''
+      if not self.pending:
+        return None
+      for slot in range(self.current, self.current + len(self.slots)):
+        if self.slots[slot % len(self.slots)]:
+          return (slot + 1) * self.resolution
+      return None
+
+
+class Impairment:
+    '''
+    Network Impairment
+    Degrades forwarding in a reproducible way, for packet loss and noise experiments. Every
+    forwarding tick makes one vectorised draw for all the links between robots in the tick, from a
+    seeded generator, so the same seed and swarm give the same impairments. Impairments act per
+    link and tick: a lost link drops every packet forwarded over it in that tick
+    :param seed: int. Seed of the random generator
+    :param loss: float. Probability that a link loses its packets
+    :param range_loss: float. Extra loss probability of a link as long as CommHub.neighbor_distance,
+        growing with the link's length to the power 'range_exponent'
+    :param range_exponent: float. How sharply loss rises with distance
+    :param delay: float. Time packets are held back before they are sent, in seconds
+    :param jitter: float. Standard deviation of a normally distributed addition to 'delay', in seconds
+    :param duplication: float. Probability that a link delivers its packets twice
+    :param position_noise: float. Standard deviation of the noise added to the x and y of every
+        robot, in m, before its position and range and bearings are computed
+    :param bearing_noise: float. Standard deviation of the noise added to the bearing of every robot,
+        in radians
+    :param resolution: float. Granularity of delays in seconds
+    '''
+
+    def __init__(self, seed=0, loss=0.0, range_loss=0.0, range_exponent=2.0, delay=0.0, jitter=0.0,
+                 duplication=0.0, position_noise=0.0, bearing_noise=0.0, resolution=0.001):
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.loss = loss
+        self.range_loss = range_loss
+        self.range_exponent = range_exponent
+        self.delay = delay
+        self.jitter = jitter
+        self.duplication = duplication
+        self.position_noise = position_noise
+        self.bearing_noise = bearing_noise
+        self.defers = bool(delay or jitter or duplication)
+        self.wheel = TimerWheel(resolution, delay + 4 * jitter + resolution) if self.defers else None
+
+
+    def perturb(self, positions):
+      '''
+      Returns:
+      --------
+      positions -> np.array
+        Copy of the (N, 4) [x, y, z, yaw] 'positions' with noise added
+      '''
+      if not (self.position_noise or self.bearing_noise):
+        return positions
+      noise = self.rng.standard_normal((len(positions), 3))
+      positions = positions.copy()
+      positions[:, :2] += noise[:, :2] * self.position_noise
+      positions[:, 3] += noise[:, 2] * self.bearing_noise
+      return positions
+
+
+    def draw(self, distance, neighbor_distance):
+      '''
+      Decide what happens to every link of a tick
+
+      Parameters:
+      -----------
+      distance -> np.array
+        Length of every link in m
+      neighbor_distance -> float
+        Comms distance of the CommHub, see CommHub
+
+      Returns:
+      --------
+      (delivered, delays, copies) -> tuple of np.array
+        Mask of the links that are not lost, and the delay in seconds and number of copies of every
+        link. delays and copies are None when nothing is deferred
+      '''
+      draws = self.rng.random((2, len(distance)))
+      loss = self.loss
+      if self.range_loss:
+        loss = loss + self.range_loss * (distance / neighbor_distance) ** self.range_exponent
+      delivered = draws[0] >= loss
+      LINKS_LOST.add(len(distance) - int(np.count_nonzero(delivered)))
+      if not self.defers:
+        return delivered, None, None
+
+      delays = np.full(len(distance), self.delay)
+      if self.jitter:
+        delays += self.rng.standard_normal(len(distance)) * self.jitter
+        np.maximum(delays, 0.0, out=delays)
+      copies = 1 + (draws[1] < self.duplication)
+      LINKS_DELAYED.add(int(np.count_nonzero(delays[delivered])))
+      LINKS_DUPLICATED.add(int(np.count_nonzero(copies[delivered] > 1)))
+      return delivered, delays, copies
+
+
+    def schedule(self, delay, payload, target, now):
+      '''
+      Hold a copy of 'payload' back for 'delay' seconds, see TimerWheel.schedule and Impairment.collect
+      '''
+      self.wheel.schedule(delay, bytes(payload), target, now)
+
+
+    def collect(self, now):
+      '''
+      Returns:
+      --------
+      due -> list
+        (payload, target) of every held back datagram due to be sent by 'now'
+      '''
+      return self.wheel.collect(now) if self.wheel is not None else []
+
+
+    def next_due(self):
+      '''
+      Returns:
+      --------
+      when -> float
+        time.perf_counter() reading by which the next held back datagram is due, None if there are none
+      '''
+      return self.wheel.next_due() if self.wheel is not None else None
@@ -0,0 +1,325 @@
+import json
+import os
+import socket
+import sys
+import time
+
+from bisect import bisect_left
+from threading import Event, Lock, Thread
+
+
+# Histogram bucket upper bounds in seconds, four per decade from 1 us to 10 s
+LATENCY_BOUNDS = tuple(10 ** (exponent / 4) * 1e-6 for exponent in range(29))
+
+
+class Counter:
+    '''
+    PRIVATE
+    Running count, e.g. of packets received. Updated without a lock, so concurrent updates from
+    several threads may very occasionally lose an increment
+    :param registry: Registry. Registry the counter belongs to
+    '''
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.clear()
+
+
+    def clear(self):
+      self.value = 0
+
+
+    def add(self, amount=1):
+      if self.registry.enabled:
+        self.value += amount
+
+
+    def snapshot(self):
+      return self.value
+
+
+class Histogram:
+    '''
+    PRIVATE
+    Distribution of durations over fixed buckets. Recording a value is a bisect and two additions,
+    without a lock, so concurrent updates from several threads may very occasionally lose a count
+    :param registry: Registry. Registry the histogram belongs to
+    :param bounds: tuple. Ascending upper bounds of the buckets, values above the last bound go in
+        an overflow bucket
+    '''
+
+    def __init__(self, registry, bounds=LATENCY_BOUNDS):
+        self.registry = registry
+        self.bounds = bounds
+        self.clear()
+
+
+    def clear(self):
+      self.counts = [0] * (len(self.bounds) + 1)
+      self.total = 0.0
+      self.max = 0.0
+
+
+    def record(self, value):
+      '''
+      Parameters:
+      -----------
+      value -> float
+        Value to count, in seconds for the default bounds
+      '''
+      if self.registry.enabled:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        if value > self.max:
+          self.max = value
+
+
+    def record_since(self, start):
+      '''
+      Record the time elapsed since 'start', a time.perf_counter() reading
+      '''
+      if self.registry.enabled:
+        self.record(time.perf_counter() - start)
+
+
+    def percentile(self, counts, fraction):
+      '''
+      PRIVATE
+      Upper bound of the bucket holding the given fraction of the values, at most the largest value
+      '''
+      target = fraction * sum(counts)
+      seen = 0
+      for bucket, count in enumerate(counts):
+        seen += count
+        if count and seen >= target:
+          return min(self.bounds[bucket], self.max) if bucket < len(self.bounds) else self.max
+      return 0.0
+
+
+    def snapshot(self):
+      counts = list(self.counts)
+      count = sum(counts)
+      return {
+        'count': count,
+        'mean': self.total / count if count else 0.0,
+        'max': self.max,
+        'p50': self.percentile(counts, 0.50),
+        'p95': self.percentile(counts, 0.95),
+        'p99': self.percentile(counts, 0.99),
+        'buckets': [[self.bounds[bucket] if bucket < len(self.bounds) else None, count]
+                    for bucket, count in enumerate(counts) if count],
+      }
+
+
+class Registry:
+    '''
+    Instrumentation Registry
+    Named counters, histograms and gauges, read all at once with Registry.snapshot. When disabled,
+    recording returns straight away and nothing is counted
+    '''
+
+    def __init__(self):
+        self.enabled = True
+        self.lock = Lock()  # Only taken to create metrics and take snapshots
+        self.metrics = {}
+        self.gauges = {}
+        self.started = time.time()
+
+
+    def counter(self, name):
+      '''
+      Returns:
+      --------
+      counter -> Counter
+        The counter called 'name', created on first use
+      '''
+      return self.metric(name, Counter)
+
+
+    def histogram(self, name, bounds=LATENCY_BOUNDS):
+      '''
+      Returns:
+      --------
+      histogram -> Histogram
+        The histogram called 'name', created on first use
+      '''
+      return self.metric(name, lambda registry: Histogram(registry, bounds))
+
+
+    def metric(self, name, create):
+      with self.lock:
+        if name not in self.metrics:
+          self.metrics[name] = create(self)
+        return self.metrics[name]
+
+
+    def gauge(self, name, read):
+      '''
+      Register a value that is only read when a snapshot is taken, such as a queue depth
+
+      Parameters:
+      -----------
+      name -> string
+        Name of the gauge. Registering the same name again replaces the previous gauge
+      read -> function
+        Called without arguments to get the current value
+      '''
+      with self.lock:
+        self.gauges[name] = read
+
+
+    def reset(self):
+      '''
+      Forget every recorded value, keeping the metrics themselves
+      '''
+      with self.lock:
+        for metric in self.metrics.values():
+          metric.clear()
+        self.started = time.time()
+
+
+    def snapshot(self):
+      '''
+      Returns:
+      --------
+      snapshot -> dict
+        Current value of every counter, histogram and gauge, keyed by name. Histogram times are
+        in seconds
+      '''
+      with self.lock:
+        metrics = dict(self.metrics)
+        gauges = dict(self.gauges)
+      snapshot = {'time': time.time(), 'uptime': time.time() - self.started, 'enabled': self.enabled}
+      for name, metric in sorted(metrics.items()):
+        snapshot[name] = metric.snapshot()
+      for name, read in sorted(gauges.items()):
+        try:
+          snapshot[name] = read()
+        except Exception as e:
+          snapshot[name] = f"error: {e}"
+      return snapshot
+
+
+# Shared by the whole process
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+snapshot = REGISTRY.snapshot
+
+
+def enable():
+  REGISTRY.enabled = True
+
+
+def disable():
+  '''
+  Stop recording. Metrics keep the values they had
+  '''
+  REGISTRY.enabled = False
+
+
+class StatsServer:
+    '''
+    Stats Endpoint
+    Replies to every datagram received on a local UDP port with a JSON snapshot of the registry.
+    Query it with: python instrumentation.py <port>
+    :param port: int. Port to listen on
+    :param host: string. Address to listen on, local only by default
+    :param registry: Registry. Registry to report
+    '''
+
+    def __init__(self, port=4243, host='127.0.0.1', registry=REGISTRY):
+        self.registry = registry
+        self.alive = True
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.thread = Thread(target=self.serve, name="Stats Server", daemon=True)
+        self.thread.start()
+
+
+    def serve(self):
+      while self.alive:
+        try:
+          _, addr = self.socket.recvfrom(64)
+        except OSError:
+          break
+        if not self.alive:
+          break
+        try:
+          self.socket.sendto(json.dumps(self.registry.snapshot()).encode(), addr)
+        except OSError as e:
+          print(f"Stats Server could not reply to {addr}: {e}")
+
+
+    def close(self):
+      self.alive = False
+      try:
+        self.socket.sendto(b'', self.socket.getsockname())
+      except OSError:
+        pass
+      self.thread.join()
+      self.socket.close()
+
+
+class SnapshotWriter:
+    '''
+    Periodically writes a JSON snapshot of the registry to a file, replacing the previous one
+    :param path: string. Path of the file
+    :param interval: float. Time between snapshots in seconds
+    :param registry: Registry. Registry to report
+    '''
+
+    def __init__(self, path, interval=1.0, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, name="Stats Writer", daemon=True)
+        self.thread.start()
+
+
+    def run(self):
+      while not self.stopped.wait(self.interval):
+        self.write()
+
+
+    def write(self):
+      temp_path = self.path + '.tmp'
+      try:
+        with open(temp_path, 'w') as file:
+          json.dump(self.registry.snapshot(), file, indent=2)
+        os.replace(temp_path, self.path)
+      except OSError as e:
+        print(f"Could not write stats to '{self.path}': {e}")
+
+
+    def close(self):
+      self.stopped.set()
+      self.thread.join()
+      self.write()
+
+
+def query(port=4243, host='127.0.0.1', timeout=1.0):
+  '''
+  Fetch a snapshot from a StatsServer
+
+  Returns:
+  --------
+  snapshot -> dict
+  '''
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+    client.settimeout(timeout)
+    client.sendto(b'stats', (host, port))
+    return json.loads(client.recv(1 << 20))
+
+
+if __name__ == '__main__':
+  stats = query(int(sys.argv[1]) if len(sys.argv) > 1 else 4243)
+  for name, value in stats.items():
+    if isinstance(value, dict) and 'p50' in value:
+      print(f"{name:<28} n={value['count']:<10} mean={value['mean'] * 1000:9.3f} ms"
+            f"  p50={value['p50'] * 1000:9.3f}  p95={value['p95'] * 1000:9.3f}"
+            f"  p99={value['p99'] * 1000:9.3f}  max={value['max'] * 1000:9.3f} ms")
+    else:
+      print(f"{name:<28} {value}")
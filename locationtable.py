@@ -0,0 +1,185 @@
+import numpy as np
+import time
+
+from threading import Lock
+
+
+class LocationSnapshot:
+    '''
+    PRIVATE
+    A published, read only view of a LocationTable
+    Snapshots are recycled by the table once it has published LocationTable.buffers newer ones, which
+    is detected through LocationSnapshot.generation. Use LocationSnapshot.poses to read a
+    consistent copy regardless
+    :param capacity: int. Number of robot slots
+    '''
+
+    # Rows of LocationSnapshot.data, one per field of the struct of arrays
+    X, Y, Z, YAW, TIMESTAMP = range(5)
+
+    def __init__(self, capacity):
+        self.data = np.zeros((5, capacity))
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.index = {}  # robot id : slot
+        self.count = 0
+        self.generation = 0
+
+
+    def __len__(self):
+      return self.count
+
+
+    def __contains__(self, robot_id):
+      return robot_id in self.index
+
+
+    def poses(self, robot_ids):
+      '''
+      Gather the poses of the given robots into a contiguous array, retrying if the
+      snapshot is recycled by the writer while being read
+
+      Parameters:
+      -----------
+      robot_ids -> list
+        IDs of robots present in the snapshot
+
+      Returns:
+      --------
+      poses -> np.array
+        (N, 4) array with one [x, y, z, yaw] row per robot, in the order of robot_ids
+      '''
+      while True:
+        generation = self.generation
+        slots = [self.index[robot_id] for robot_id in robot_ids]
+        poses = self.data[:self.TIMESTAMP, slots].T
+        if generation == self.generation and generation >= 0:
+          return poses
+
+
+    def as_dict(self):
+      '''
+      Returns:
+      --------
+      locations -> dict
+        robot id : np.array([x, y, z, yaw]) for every robot in the snapshot
+      '''
+      robot_ids = list(self.index)
+      return dict(zip(robot_ids, self.poses(robot_ids)))
+
+
+class LocationTable:
+    '''
+    Location Table
+    Preallocated struct of arrays holding the x, y, z, yaw and timestamp of every robot, with one slot
+    per robot id. Every update is published as a new LocationSnapshot, from a small ring of
+    preallocated buffers, so readers never take a lock or copy the whole table
+    :param capacity: int. Initial number of robot slots. The table grows when it runs out
+    :param buffers: int. Number of snapshot buffers published in rotation
+    '''
+
+    def __init__(self, capacity=64, buffers=3):
+        self.write_lock = Lock()
+        self.data = np.zeros((5, capacity))
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.index = {}  # robot id : slot
+        self.generation = 0
+
+        self.snapshots = [LocationSnapshot(capacity) for _ in range(buffers)]
+        self.current = self.snapshots[0]
+
+
+    def snapshot(self):
+      '''
+      Returns:
+      --------
+      snapshot -> LocationSnapshot
+        The latest published locations
+      '''
+      return self.current
+
+
+    def update(self, robot_id, x, y, z, yaw, timestamp=None):
+      '''
+      Update the pose of a single robot and publish it
+
+      Parameters:
+      -----------
+      robot_id -> int
+        The ID of the robot
+      x, y, z -> float
+        The position of the robot
+      yaw -> float
+        Bearing of the robot
+      timestamp -> float
+        Time the pose was measured. Defaults to now
+      '''
+      with self.write_lock:
+        slot = self.slot(robot_id)
+        self.data[:, slot] = (x, y, z, yaw, time.time() if timestamp is None else timestamp)
+        self.publish()
+
+
+    def update_many(self, robot_ids, poses, timestamp=None):
+      '''
+      Update the poses of several robots and publish them together
+
+      Parameters:
+      -----------
+      robot_ids -> list/np.array
+        IDs of the robots
+      poses -> np.array
+        (N, 4) array with one [x, y, z, yaw] row per robot
+      timestamp -> float/np.array
+        Time the poses were measured, or one time per robot. Defaults to now
+      '''
+      with self.write_lock:
+        slots = [self.slot(robot_id) for robot_id in robot_ids]
+        self.data[:LocationSnapshot.TIMESTAMP, slots] = np.asarray(poses).T
+        self.data[LocationSnapshot.TIMESTAMP, slots] = time.time() if timestamp is None else timestamp
+        self.publish()
+
+
+    def slot(self, robot_id):
+      '''
+      PRIVATE
+      Find the slot of a robot, assigning one if the robot is new. Must hold write_lock
+
+      Returns:
+      --------
+      slot -> int
+        Column of LocationTable.data holding the robot
+      '''
+      robot_id = int(robot_id)
+      slot = self.index.get(robot_id)
+      if slot is None:
+        slot = len(self.index)
+        if slot == len(self.ids):
+          self.data = np.concatenate((self.data, np.zeros_like(self.data)), axis=1)
+          self.ids = np.concatenate((self.ids, np.full_like(self.ids, -1)))
+        self.ids[slot] = robot_id
+        # Replace rather than mutate, published snapshots keep referring to the old index
+        self.index = {**self.index, robot_id: slot}
+      return slot
+
+
+    def publish(self):
+      '''
+      PRIVATE
+      Copy the table into the oldest snapshot buffer and make it the current snapshot.
+      Must hold write_lock
+      '''
+      self.generation += 1
+      snapshot = self.snapshots[self.generation % len(self.snapshots)]
+      count = len(self.index)
+
+      # Mark the buffer as being rewritten, readers still holding it will retry
+      snapshot.generation = -1
+      if snapshot.data.shape != self.data.shape:
+        snapshot.data = np.empty_like(self.data)
+        snapshot.ids = np.empty_like(self.ids)
+      np.copyto(snapshot.data[:, :count], self.data[:, :count])
+      np.copyto(snapshot.ids[:count], self.ids[:count])
+      snapshot.index = self.index
+      snapshot.count = count
+      snapshot.generation = self.generation
+      self.current = snapshot
@@ -2,6 +2,62 @@ import struct
 import time
 
 MSG_SIZE = 500
+ZERO_PADDING = memoryview(bytes(MSG_SIZE))
+
+# Precompiled layouts of the fields making up a packet, see Packet.byte_string
+HEADER = struct.Struct('=H4f')
+MSG_LENGTH = struct.Struct('=H')
+TERMINATOR = struct.Struct('=I')
+RAB = struct.Struct('=3f')
+# The header followed by the length of the first message, 0 when the packet carries none
+HEADER_AND_LENGTH = struct.Struct('=H4fH')
+
+# Coalesced datagrams start with a marker no robot uses as its comm_id, followed by the record count
+FRAME_HEADER = struct.Struct('=HH')
+FRAME_MARKER = 0xFFFF
+UDP_MTU = 1472  # 1500 byte Ethernet MTU, less the IPv4 and UDP headers
+
+
+class BufferPool:
+    '''
+    PRIVATE
+    Pool of reusable receive buffers, so that decoding a packet does not allocate. Buffers are handed
+    out as memoryviews, so messages can be sliced out of them without creating a view per packet
+    :param count: int. Number of buffers preallocated by the pool
+    :param size: int. Size of each buffer in bytes
+    '''
+
+    def __init__(self, count=64, size=MSG_SIZE):
+        self.size = size
+        self.free = [memoryview(bytearray(size)) for _ in range(count)]
+
+
+    def acquire(self):
+      '''
+      Take a buffer from the pool, allocating a new one if the pool has run dry
+
+      Returns:
+      --------
+      buffer -> memoryview
+        Buffer of BufferPool.size bytes
+      '''
+      try:
+        return self.free.pop()
+      except IndexError:
+        return memoryview(bytearray(self.size))
+
+
+    def release(self, buffer):
+      '''
+      Return a buffer to the pool once nothing refers to its contents anymore
+
+      Parameters:
+      -----------
+      buffer -> memoryview
+        Buffer previously handed out by BufferPool.acquire
+      '''
+      self.free.append(buffer)
+
 
 class Packet:
     '''
@@ -12,15 +68,37 @@ class Packet:
     :param msgs: list of bytes objects. Each bytes object is fed directly to the buzz script using feed_buzz_message
     '''
 
-    def __init__(self, x, y, z, sender_id, msgs=[], theta=0, received_time=0, addr=('0.0.0.0', 4242)):
+    __slots__ = ('x', 'y', 'z', 'theta', 'comm_id', 'received_time', 'addr',
+                 '_msgs', '_buffer', '_length', '_pool')
+
+    def __init__(self, x, y, z, sender_id, msgs=None, theta=0, received_time=0, addr=('0.0.0.0', 4242)):
         self.x = x
         self.y = y
         self.z = z
         self.theta = theta
         self.comm_id = sender_id
-        self.msgs = msgs
+        self._msgs = [] if msgs is None else msgs
         self.received_time = received_time
         self.addr = addr
+        self._buffer = None
+        self._length = 0
+        self._pool = None
+
+
+    @property
+    def msgs(self):
+      '''
+      Messages carried by the packet. Packets decoded from a socket only split their
+      messages out of the receive buffer, as memoryview slices, the first time they are read
+      '''
+      if self._msgs is None:
+        self._msgs = self._split_msgs()
+      return self._msgs
+
+
+    @msgs.setter
+    def msgs(self, msgs):
+      self._msgs = msgs
 
 
     def set_rb(self, rng, bearing, elevation):
@@ -63,20 +141,151 @@ class Packet:
       b_string -> bytes
         Bytes object representing entire packet
       '''
-      b_string = struct.pack('=H4f', int(self.comm_id), float(
+      buffer = bytearray(self.encoded_size())
+      self.encode_into(buffer)
+      return bytes(buffer)
+
+
+    def encode_into(self, buffer):
+      '''
+      Write the packet into a preallocated buffer, in the same layout as Packet.byte_string
+
+      Parameters:
+      -----------
+      buffer -> bytearray
+        Destination buffer. Must be at least Packet.encoded_size() bytes long
+
+      Returns:
+      --------
+      length -> int
+        Number of bytes of the buffer making up the packet
+      '''
+      HEADER.pack_into(buffer, 0, int(self.comm_id), float(
         self.x), float(self.y), float(self.z), float(self.theta))
-      for msg in self.msgs:
-        b_string += struct.pack('H', len(msg))
-        b_string += msg
-      b_string += struct.pack('I', 0)
-      while len(b_string) < MSG_SIZE:
-        b_string += struct.pack('B', 0)
-      return b_string
+      tot = HEADER.size
+      if self._msgs is None:
+        # Messages were never split out of the receive buffer, copy them across as they arrived
+        tot = self._length
+        buffer[HEADER.size:tot] = memoryview(self._buffer)[HEADER.size:tot]
+        length = max(tot, MSG_SIZE)
+        buffer[tot:length] = ZERO_PADDING[:length-tot]
+        return length
+      for msg in self._msgs:
+        MSG_LENGTH.pack_into(buffer, tot, len(msg))
+        tot += MSG_LENGTH.size
+        buffer[tot:tot+len(msg)] = msg
+        tot += len(msg)
+      length = max(tot + TERMINATOR.size, MSG_SIZE)
+      # Zero the terminator and the padding left over from any previous contents
+      buffer[tot:length] = ZERO_PADDING[:length-tot]
+      return length
+
+
+    def encoded_size(self):
+      '''
+      Returns:
+      --------
+      size -> int
+        Number of bytes produced when encoding this packet
+      '''
+      if self._msgs is None:
+        return max(self._length, MSG_SIZE)
+      tot = HEADER.size + sum(MSG_LENGTH.size + len(msg) for msg in self._msgs) + TERMINATOR.size
+      return max(tot, MSG_SIZE)
+
 
+    def release(self):
+      '''
+      Hand the receive buffer of a decoded packet back to its BufferPool.
+      Any message views taken from the packet must not be used afterwards
+      '''
+      if self._pool is not None:
+        if self._msgs is None:
+          self._msgs = []
+        self._pool.release(self._buffer)
+        self._pool = None
+      self._buffer = None
+
+
+    def _split_msgs(self):
+      '''
+      Split the embedded messages out of the receive buffer, without copying them
+
+      Returns:
+      --------
+      msgs -> list of memoryview
+        One view per message, in the order they were packed
+      '''
+      if self._buffer is None:
+        return []
+      view = self._buffer
+      if type(view) is not memoryview:
+        view = memoryview(view)
+      unpack_length = MSG_LENGTH.unpack_from
+      last = self._length - MSG_LENGTH.size
+      tot = HEADER.size
+      msgs = []
+      while tot <= last:
+        msg_size = unpack_length(view, tot)[0]
+        if msg_size == 0:
+          break
+        tot += MSG_LENGTH.size
+        msgs.append(view[tot:tot+msg_size])
+        tot += msg_size
+        # print('rcv msg from {} size {} tot {}'.format(self.comm_id, msg_size, tot))
+      return msgs
 
 
     @staticmethod
-    def from_socket(socketUDP):
+    def from_buffer(buffer, length, addr=('0.0.0.0', 4242), pool=None):
+      '''
+      Create a packet from bytes already read from a socket. Only the header and the length of
+      the first message are unpacked, any messages are split out lazily when Packet.msgs is first read
+
+      Parameters:
+      ------------
+      buffer -> memoryview/bytearray/bytes
+        Buffer holding the datagram. The packet keeps a reference to it
+      length -> int
+        Number of valid bytes in the buffer
+      addr -> tuple
+        Address of the sender
+      pool -> BufferPool
+        Pool the buffer is handed back to by Packet.release, if any
+
+      Returns:
+      ---------
+      Packet object ~ if successful
+
+      False         ~ if the buffer is too short to hold a packet
+      '''
+      if length >= HEADER_AND_LENGTH.size:
+        sender_id, x, y, z, theta, msg_size = HEADER_AND_LENGTH.unpack_from(buffer)
+      elif length >= HEADER.size:
+        sender_id, x, y, z, theta = HEADER.unpack_from(buffer)
+        msg_size = 0
+      else:
+        return False
+      # print('Pos ({},{},{}) angle {} of ID: {}'.format(x,y,z,theta,sender_id) )
+      # Bypass __init__, every slot is assigned here
+      packet = Packet.__new__(Packet)
+      packet.x = x
+      packet.y = y
+      packet.z = z
+      packet.theta = 0
+      packet.comm_id = sender_id
+      packet.received_time = time.time()
+      packet.addr = addr
+      # Packets without messages, most of the traffic of a quiet swarm, need no splitting at all
+      packet._msgs = None if msg_size else []
+      packet._buffer = buffer
+      packet._length = length
+      packet._pool = pool
+      return packet
+
+
+    @staticmethod
+    def from_socket(socketUDP, pool=None):
       '''
       Create a packet from a socket
       Block until a string of bytes comes in, and unpack these bytes into a new Packet object.
@@ -86,6 +295,8 @@ class Packet:
       ------------
       s: socket object
         Socket object
+      pool: BufferPool
+        Pool to receive into. If left as None, a new buffer is allocated for the packet
 
       Returns:
       ---------
@@ -94,35 +305,232 @@ class Packet:
       False         ~ if socket.error occured
       '''
       addr = ('0.0.0.0', 4242)
+      buffer = pool.acquire() if pool is not None else memoryview(bytearray(MSG_SIZE))
       try:
-        try:
-          msg, addr = socketUDP.recvfrom(MSG_SIZE)
-          # print(f"m={m} -=- addr={addr}")
-        except:
-          return False
-
-        if len(msg) == 0:
-          # The socket is broken
-          return False
-
-        # Process the message
-        sender_id, x, y, z, theta = struct.unpack_from('=H4f', msg)
-        # print('Pos ({},{},{}) angle {} of ID: {}'.format(x,y,z,theta,sender_id) )
-        tot = struct.calcsize('=H4f')
-        msgs = []
-        while (tot < MSG_SIZE):
-          try:
-            msg_size = struct.unpack_from('H', msg, tot)[0]
-            tot += 2
-          except struct.error as e:
-            print(e)
-            return False
+        length, addr = socketUDP.recvfrom_into(buffer, MSG_SIZE)
+        # print(f"m={m} -=- addr={addr}")
+      except OSError:
+        length = 0
+
+      packet = Packet.from_buffer(buffer, length, addr, pool) if length else False
+      if not packet and pool is not None:
+        # The socket is broken or the datagram is malformed
+        pool.release(buffer)
+      return packet
+
+
+class PacketTemplate:
+    '''
+    PRIVATE
+    A packet serialised once into a preallocated buffer, so that it can be forwarded to many
+    destinations by only rewriting the 12 byte range/bearing/elevation field in place
+    '''
+
+    RAB_OFFSET = struct.calcsize('=H')
+
+    def __init__(self):
+        self.buffer = bytearray(MSG_SIZE)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self.content_length = 0
+
+
+    def load(self, packet):
+      '''
+      Serialise 'packet' into the template. The packet itself is left untouched
+
+      Parameters:
+      -----------
+      packet -> Packet
+        Packet to be forwarded
+      '''
+      size = packet.encoded_size()
+      if size > len(self.buffer):
+        self.view.release()
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+      self.length = packet.encode_into(self.buffer)
+      self.content_length = None
+      return self
+
+
+    def content(self):
+      '''
+      Returns:
+      --------
+      content -> memoryview
+        View of the serialised header and messages, without the terminator and padding
+      '''
+      if self.content_length is None:
+        tot = HEADER.size
+        while tot + MSG_LENGTH.size <= self.length:
+          msg_size = MSG_LENGTH.unpack_from(self.buffer, tot)[0]
           if msg_size == 0:
             break
-          msgs.append(msg[tot:tot+msg_size])
+          tot += MSG_LENGTH.size + msg_size
+        self.content_length = min(tot, self.length)
+      return self.view[:self.content_length]
+
+
+    def set_rb(self, rng, bearing, elevation):
+      '''
+      Overwrite the Range, Bearing and Elevation of the serialised packet
+
+      Parameters:
+      ------------
+      rng ->
+        Range between two robots
+      bearing ->
+        Bearing between two robots
+      elevation ->
+        Elevation between the robot and the camera
+      '''
+      RAB.pack_into(self.buffer, self.RAB_OFFSET, rng, bearing, elevation)
+
+
+    def payload(self):
+      '''
+      Returns:
+      --------
+      payload -> memoryview
+        View of the bytes making up the serialised packet, ready to be sent
+      '''
+      return self.view[:self.length]
+
 
-          tot += msg_size
-          # print('rcv msg from {} size {} tot {}'.format(sender_id, msg_size, tot))
-        return Packet(x, y, z, sender_id, msgs, received_time=time.time(), addr=addr)
-      except:
+class FrameBuilder:
+    '''
+    PRIVATE
+    Packs several packets bound for the same robot into a single datagram of at most 'mtu' bytes
+
+    Contents:
+    ---------
+    * 2 bytes FRAME_MARKER
+    * 2 bytes number of records
+    * for each record {
+      2 bytes record length (n)
+      n bytes packet, laid out as in Packet.byte_string without the terminator and padding
+    }
+    '''
+
+    def __init__(self, mtu=UDP_MTU):
+        self.buffer = bytearray(mtu)
+        self.view = memoryview(self.buffer)
+        self.length = FRAME_HEADER.size
+        self.count = 0
+
+
+    def reset(self):
+      '''
+      Empty the frame, ready to be filled for the next datagram
+      '''
+      self.length = FRAME_HEADER.size
+      self.count = 0
+
+
+    def add(self, template, rel_rb=None):
+      '''
+      Append a serialised packet to the frame
+
+      Parameters:
+      -----------
+      template -> PacketTemplate
+        Serialised packet to append
+      rel_rb -> tuple/np.array
+        The Distance, Range and Bearing to write into the record. If left as None, the
+        coordinates of the template are kept
+
+      Returns:
+      --------
+      True  ~ if the record fit in the frame
+
+      False ~ if the frame is full
+      '''
+      return self.add_record(template.content(), rel_rb)
+
+
+    def add_record(self, content, rel_rb=None):
+      '''
+      Append a record already laid out as PacketTemplate.content, see FrameBuilder.add
+      '''
+      start = self.length + MSG_LENGTH.size
+      end = start + len(content)
+      if end > len(self.buffer):
         return False
+      MSG_LENGTH.pack_into(self.buffer, self.length, len(content))
+      self.buffer[start:end] = content
+      if rel_rb is not None:
+        RAB.pack_into(self.buffer, start + PacketTemplate.RAB_OFFSET, rel_rb[0], rel_rb[1], rel_rb[2])
+      self.length = end
+      self.count += 1
+      return True
+
+
+    def payload(self):
+      '''
+      Returns:
+      --------
+      payload -> memoryview
+        View of the bytes making up the frame, ready to be sent
+      '''
+      FRAME_HEADER.pack_into(self.buffer, 0, FRAME_MARKER, self.count)
+      return self.view[:self.length]
+
+
+def is_frame(buffer):
+  '''
+  Returns:
+  --------
+  True if 'buffer' holds a coalesced datagram built by FrameBuilder, False otherwise
+  '''
+  return len(buffer) >= FRAME_HEADER.size and FRAME_HEADER.unpack_from(buffer)[0] == FRAME_MARKER
+
+
+def decode_frame(buffer, length=None, addr=('0.0.0.0', 4242)):
+  '''
+  Unpack a coalesced datagram into the packets it carries. Messages are memoryview
+  slices of 'buffer', so it must not be reused while the packets are in use
+
+  Parameters:
+  ------------
+  buffer -> bytearray/bytes
+    Buffer holding the datagram
+  length -> int
+    Number of valid bytes in the buffer. Defaults to the whole buffer
+  addr -> tuple
+    Address of the sender
+
+  Returns:
+  ---------
+  packets -> list of Packet Objects ~ if successful
+
+  False ~ if the datagram is not a valid frame
+  '''
+  view = memoryview(buffer)[:len(buffer) if length is None else length]
+  if not is_frame(view):
+    return False
+  received_time = time.time()
+  count = FRAME_HEADER.unpack_from(view)[1]
+  tot = FRAME_HEADER.size
+  packets = []
+  for _ in range(count):
+    if tot + MSG_LENGTH.size + HEADER.size > len(view):
+      return False
+    record_length = MSG_LENGTH.unpack_from(view, tot)[0]
+    tot += MSG_LENGTH.size
+    end = tot + record_length
+    if end > len(view) or record_length < HEADER.size:
+      return False
+    sender_id, x, y, z, theta = HEADER.unpack_from(view, tot)
+    msgs = []
+    tot += HEADER.size
+    while tot + MSG_LENGTH.size <= end:
+      msg_size = MSG_LENGTH.unpack_from(view, tot)[0]
+      if msg_size == 0:
+        break
+      tot += MSG_LENGTH.size
+      msgs.append(view[tot:min(tot+msg_size, end)])
+      tot += msg_size
+    tot = end
+    packets.append(Packet(x, y, z, sender_id, msgs, theta=theta, received_time=received_time, addr=addr))
+  return packets
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+import argparse
+import struct
+import time
+
+from packet import BufferPool, MSG_SIZE, Packet, PacketTemplate
+
+
+def legacy_byte_string(packet):
+  '''
+  Packet.byte_string as it was implemented before the precompiled codec, kept as a baseline
+  '''
+  b_string = struct.pack('=H4f', int(packet.comm_id), float(
+    packet.x), float(packet.y), float(packet.z), float(packet.theta))
+  for msg in packet.msgs:
+    b_string += struct.pack('H', len(msg))
+    b_string += msg
+  b_string += struct.pack('I', 0)
+  while len(b_string) < MSG_SIZE:
+    b_string += struct.pack('B', 0)
+  return b_string
+
+
+def legacy_from_socket(socketUDP):
+  '''
+  Packet.from_socket as it was implemented before the precompiled codec, kept as a baseline
+  '''
+  msg, addr = socketUDP.recvfrom(MSG_SIZE)
+  sender_id, x, y, z, theta = struct.unpack_from('=H4f', msg)
+  tot = struct.calcsize('=H4f')
+  msgs = []
+  while (tot < MSG_SIZE):
+    msg_size = struct.unpack_from('H', msg, tot)[0]
+    tot += 2
+    if msg_size == 0:
+      break
+    msgs.append(msg[tot:tot+msg_size])
+    tot += msg_size
+  return Packet(x, y, z, sender_id, msgs, received_time=time.time(), addr=addr)
+
+
+class ReplaySocket:
+  '''
+  Stand-in for a UDP socket that hands out the same datagram forever, so that decoding
+  is measured without any kernel or network cost
+  '''
+
+  def __init__(self, datagram):
+    self.datagram = bytearray(datagram)
+    self.view = memoryview(self.datagram)
+    self.addr = ('127.0.0.1', 4242)
+
+
+  def recvfrom(self, size):
+    # Copy out a new bytes object, like a real recvfrom does
+    return bytes(self.datagram[:size]), self.addr
+
+
+  def recvfrom_into(self, buffer, size):
+    length = min(size, len(self.datagram))
+    buffer[:length] = self.view[:length]
+    return length, self.addr
+
+
+def rate(function, iterations, repeats=5):
+  '''
+  Returns:
+  --------
+  rate -> float
+    Calls of 'function' per second, taken from the fastest of 'repeats' runs
+  '''
+  best = float('inf')
+  for _ in range(repeats):
+    start = time.perf_counter()
+    for _ in range(iterations):
+      function()
+    best = min(best, time.perf_counter() - start)
+  return iterations / best
+
+
+def run(iterations, num_msgs, msg_size):
+  packet = Packet(1.0, 2.0, 0.0, 7, [bytes(msg_size)] * num_msgs, theta=0.5)
+  replay = ReplaySocket(packet.byte_string())
+  pool = BufferPool()
+  buffer = bytearray(MSG_SIZE)
+
+  def decode_pooled():
+    Packet.from_socket(replay, pool).release()
+
+  def decode_pooled_msgs():
+    decoded = Packet.from_socket(replay, pool)
+    decoded.msgs
+    decoded.release()
+
+  # Receive a packet and serialise it for forwarding, as CommHub does once per tick
+  def forward_legacy():
+    received = legacy_from_socket(replay)
+    received.set_rb(1.0, 0.5, 0.0)
+    legacy_byte_string(received)
+
+  template = PacketTemplate()
+
+  def forward_template():
+    received = Packet.from_socket(replay, pool)
+    template.load(received)
+    received.release()
+    template.set_rb(1.0, 0.5, 0.0)
+
+  results = [
+    ('encode', 'legacy byte_string', rate(lambda: legacy_byte_string(packet), iterations)),
+    ('encode', 'byte_string', rate(packet.byte_string, iterations)),
+    ('encode', 'encode_into', rate(lambda: packet.encode_into(buffer), iterations)),
+    ('decode', 'legacy from_socket', rate(lambda: legacy_from_socket(replay), iterations)),
+    ('decode', 'from_socket (pooled)', rate(decode_pooled, iterations)),
+    ('decode', 'from_socket (pooled) + msgs', rate(decode_pooled_msgs, iterations)),
+    ('forward', 'legacy decode + byte_string', rate(forward_legacy, iterations)),
+    ('forward', 'pooled decode + template', rate(forward_template, iterations)),
+  ]
+
+  print(f"Packet with {num_msgs} message(s) of {msg_size} bytes, {iterations} iterations")
+  baseline = {}
+  for kind, name, packets_per_second in results:
+    baseline.setdefault(kind, packets_per_second)
+    print(f"  {kind:<7} {name:<30} {packets_per_second:>12,.0f} packets/s"
+          f"  ({packets_per_second / baseline[kind]:.2f}x)")
+
+  split = dict((name, packets_per_second) for _, name, packets_per_second in results)
+  if split['from_socket (pooled) + msgs'] < baseline['decode']:
+    # Splitting the messages out is a Python loop like the legacy decoder's, plus the pooling the
+    # forwarding path relies on, so reading every message does not beat the legacy decoder
+    print("  note: reading msgs is slower than the legacy decoder, the pooled decoder only pays off"
+          " when packets are forwarded without reading their messages, as CommHub does")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Micro-benchmark of the Packet encoder and decoder")
+  parser.add_argument('--iterations', type=int, default=5000)
+  parser.add_argument('--msg-size', type=int, default=40, help="Size of each embedded message in bytes")
+  args = parser.parse_args()
+
+  for num_msgs in (0, 1, 4):
+    run(args.iterations, num_msgs, args.msg_size)
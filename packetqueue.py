@@ -0,0 +1,96 @@
+import time
+
+from collections import deque
+
+
+class PacketQueue:
+    '''
+    Bounded queue of the packets received from one robot and waiting to be forwarded
+    :param maxlen: int. Most packets held at once
+    :param policy: string. What to drop once the queue is full
+        'drop-oldest' ~ discard the oldest queued packet to make room
+        'drop-newest' ~ discard the incoming packet
+        'latest'      ~ only ever hold the most recent packet from the robot
+    '''
+
+    POLICIES = ('drop-oldest', 'drop-newest', 'latest')
+
+    def __init__(self, maxlen=64, policy='drop-oldest'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}', expected one of {self.POLICIES}")
+        self.maxlen = 1 if policy == 'latest' else maxlen
+        self.policy = policy
+        self.queue = deque()
+
+        self.received = 0
+        self.dropped = 0
+        self.forwarded = 0
+        self.max_depth = 0
+        self.max_age = 0.0  # Longest a packet waited in the queue before being forwarded
+
+
+    def __len__(self):
+      return len(self.queue)
+
+
+    def append(self, packet):
+      '''
+      Queue a packet, applying the drop policy if the queue is full
+
+      Parameters:
+      -----------
+      packet -> Packet
+        The received packet
+
+      Returns:
+      --------
+      dropped -> Packet
+        The packet discarded to respect the bound, None if nothing was discarded
+      '''
+      self.received += 1
+      dropped = None
+      if len(self.queue) >= self.maxlen:
+        self.dropped += 1
+        if self.policy == 'drop-newest':
+          return packet
+        dropped = self.queue.popleft()
+      self.queue.append(packet)
+      self.max_depth = max(self.max_depth, len(self.queue))
+      return dropped
+
+
+    def drain(self):
+      '''
+      Take every queued packet out of the queue
+
+      Returns:
+      --------
+      packets -> list of Packet Objects
+        The queued packets, oldest first
+      '''
+      packets = list(self.queue)
+      self.queue.clear()
+      if packets:
+        self.forwarded += len(packets)
+        self.max_age = max(self.max_age, time.time() - packets[0].received_time)
+      return packets
+
+
+    def get_stats(self):
+      '''
+      Returns:
+      --------
+      stats -> dict
+        Current depth and age of the oldest queued packet, with running counts of
+        received, dropped and forwarded packets
+      '''
+      oldest = self.queue[0].received_time if self.queue else None
+      return {
+        'depth': len(self.queue),
+        'max_depth': self.max_depth,
+        'received': self.received,
+        'dropped': self.dropped,
+        'forwarded': self.forwarded,
+        'age': time.time() - oldest if oldest is not None else 0.0,
+        'max_age': self.max_age,
+      }
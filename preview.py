@@ -0,0 +1,174 @@
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Thread
+
+import cv2
+
+
+class PreviewRenderer:
+    '''
+    Tracking Preview
+    Draws the detected markers onto the latest frame and shows it, on its own thread and at a capped
+    rate, so that rendering never holds up detection. Frames offered faster than the cap are skipped
+    :param window_name: string. Title of the preview window
+    :param max_fps: float. Most frames rendered per second
+    :param sink: None, string or int. Where to render to
+        None   ~ an OpenCV window
+        string ~ path of an image file, overwritten with every rendered frame
+        int    ~ port of a local HTTP server streaming the frames as MJPEG
+    :param on_quit: function. Called when 'q' is pressed in the preview window
+    '''
+
+    def __init__(self, window_name, max_fps=15, sink=None, on_quit=None):
+        self.window_name = window_name
+        self.period = 1 / max_fps if max_fps else 0
+        self.sink = sink
+        self.on_quit = on_quit
+
+        self.condition = Condition()
+        self.latest = None
+        self.alive = True
+
+        self.stream = None
+        if isinstance(sink, int):
+            self.stream = MjpegStream(sink)
+
+        self.render_thread = Thread(target=self.render, name=f"Preview {window_name}", daemon=True)
+        self.render_thread.start()
+
+
+    def offer(self, frame, tags, centres):
+      '''
+      Hand over the latest tracking result. Never blocks
+
+      Parameters:
+      -----------
+      frame -> np.array
+        The captured image. It is drawn on, so must not be used by the caller afterwards
+      tags -> tuple
+        Detected marker corners, as returned by cv2.aruco.detectMarkers
+      centres -> list of tuple
+        (x, y) pixel centre of each tracked robot
+      '''
+      with self.condition:
+        self.latest = (frame, tags, centres)
+        self.condition.notify()
+
+
+    def render(self):
+      next_render = time.perf_counter()
+      while self.alive:
+        with self.condition:
+          while self.latest is None and self.alive:
+            self.condition.wait()
+          if not self.alive:
+            break
+          frame, tags, centres = self.latest
+          self.latest = None
+
+        cv2.aruco.drawDetectedMarkers(frame, tags, borderColor = (0, 255, 0))
+        for (centreX, centreY) in centres:
+          cv2.circle(frame, (int(centreX), int(centreY)), 4, (0, 0, 255), -1)
+        self.show(frame)
+
+        # Cap the render rate, whatever arrives in the meantime replaces the pending frame
+        next_render = max(next_render + self.period, time.perf_counter())
+        time.sleep(max(next_render - time.perf_counter(), 0))
+
+
+    def show(self, frame):
+      '''
+      Output a rendered frame to the sink
+      '''
+      if self.stream is not None:
+        self.stream.publish(frame)
+      elif self.sink is not None:
+        cv2.imwrite(self.sink, frame)
+      else:
+        # Display the resulting frame
+        cv2.imshow(self.window_name, frame)
+        # Waits for exit of the program
+        if cv2.waitKey(1) == ord('q') and self.on_quit is not None:
+          self.on_quit()
+
+
+    def close(self):
+      '''
+      Stop rendering and release the sink
+      '''
+      with self.condition:
+        self.alive = False
+        self.condition.notify()
+      if self.stream is not None:
+        self.stream.close()
+      elif self.sink is None:
+        cv2.destroyWindow(self.window_name)
+
+
+class MjpegStream:
+    '''
+    PRIVATE
+    Minimal HTTP server streaming the latest published frame as multipart MJPEG
+    :param port: int. Port to serve on, on every interface
+    :param quality: int. JPEG quality from 0 to 100
+    '''
+
+    BOUNDARY = b'frame'
+
+    def __init__(self, port, quality=80):
+        self.quality = quality
+        self.condition = Condition()
+        self.jpeg = None
+        self.alive = True
+
+        self.server = ThreadingHTTPServer(('', port), MjpegHandler)
+        self.server.stream = self
+        self.server.daemon_threads = True
+        self.server_thread = Thread(target=self.server.serve_forever, name="MJPEG Stream", daemon=True)
+        self.server_thread.start()
+
+
+    def publish(self, frame):
+      ok, jpeg = cv2.imencode('.jpg', frame, (cv2.IMWRITE_JPEG_QUALITY, self.quality))
+      if ok:
+        with self.condition:
+          self.jpeg = jpeg.tobytes()
+          self.condition.notify_all()
+
+
+    def close(self):
+      with self.condition:
+        self.alive = False
+        self.condition.notify_all()
+      self.server.shutdown()
+      self.server.server_close()
+
+
+class MjpegHandler(BaseHTTPRequestHandler):
+    '''
+    PRIVATE
+    Streams every frame published to the server's MjpegStream to one HTTP client
+    '''
+
+    def do_GET(self):
+      stream = self.server.stream
+      self.send_response(200)
+      self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + stream.BOUNDARY.decode())
+      self.end_headers()
+      jpeg = None
+      try:
+        while stream.alive:
+          with stream.condition:
+            while stream.jpeg is jpeg and stream.alive:
+              stream.condition.wait()
+            jpeg = stream.jpeg
+          if jpeg is None:
+            break
+          self.wfile.write(b'--' + stream.BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+      except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+    def log_message(self, format, *args):
+      pass
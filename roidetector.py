@@ -0,0 +1,134 @@
+import numpy as np
+
+from threading import Lock
+
+import cv2
+
+
+class RoiDetector:
+    '''
+    Incremental ArUco Detector
+    Only searches padded regions of interest around the last known corners of each marker, and falls
+    back to a full frame search every 'resync_interval' frames, or as soon as a marker goes missing,
+    so that new and lost markers are still found
+    :param arucoDict: cv2.aruco.Dictionary. Dictionary of the markers to detect
+    :param arucoParams: cv2.aruco.DetectorParameters. Detection parameters
+    :param resync_interval: int. Number of frames between full frame searches
+    :param padding: float. Margin added around a marker's last corners, as a multiple of its size
+    :param ignore_ids: list. IDs of markers that are not tracked incrementally, such as the arena markers
+    '''
+
+    def __init__(self, arucoDict, arucoParams, resync_interval=30, padding=1.0, ignore_ids=()):
+        self.arucoDict = arucoDict
+        self.arucoParams = arucoParams
+        self.resync_interval = resync_interval
+        self.padding = padding
+        self.ignore_ids = set(ignore_ids)
+
+        self.lock = Lock()
+        self.last_corners = {}  # marker id : (4, 2) corners in the last frame it was seen
+        self.frames_since_resync = 0
+        self.resync_requested = True
+
+
+    def detect(self, frame):
+      '''
+      Detect markers in 'frame', either within the regions of interest or over the full frame
+
+      Parameters:
+      -----------
+      frame -> np.array
+        The captured image
+
+      Returns:
+      --------
+      (tags, ids, full_frame) -> tuple
+        tags and ids in the same format as cv2.aruco.detectMarkers, and whether the full frame
+        was searched
+      '''
+      with self.lock:
+        full_frame = (self.resync_requested or not self.last_corners or
+                      self.frames_since_resync >= self.resync_interval)
+        if full_frame:
+          self.resync_requested = False
+          self.frames_since_resync = 0
+        else:
+          self.frames_since_resync += 1
+        last_corners = list(self.last_corners.values())
+
+      if full_frame:
+        (tags, ids, rejected) = cv2.aruco.detectMarkers(frame,
+          self.arucoDict, parameters=self.arucoParams)
+        return tags, ids, True
+
+      tags, found_ids = [], []
+      for (x0, y0, x1, y1) in self.regions(last_corners, frame.shape[1], frame.shape[0]):
+        (roi_tags, roi_ids, rejected) = cv2.aruco.detectMarkers(frame[y0:y1, x0:x1],
+          self.arucoDict, parameters=self.arucoParams)
+        if len(roi_tags) > 0:
+          # Move the corners back into full frame coordinates
+          offset = np.array((x0, y0), dtype=np.float32)
+          tags.extend(tag + offset for tag in roi_tags)
+          found_ids.extend(roi_ids.flatten())
+      ids = np.array(found_ids, dtype=np.int32).reshape(-1, 1) if found_ids else None
+      return tuple(tags), ids, False
+
+
+    def regions(self, last_corners, width, height):
+      '''
+      Compute the padded regions of interest around each set of corners, merging overlapping ones
+
+      Returns:
+      --------
+      regions -> list of tuple
+        (x0, y0, x1, y1) pixel bounds of each region, clamped to the frame
+      '''
+      regions = []
+      for corners in last_corners:
+        (minX, minY), (maxX, maxY) = corners.min(axis=0), corners.max(axis=0)
+        pad = self.padding * max(maxX - minX, maxY - minY)
+        regions.append([max(int(minX - pad), 0), max(int(minY - pad), 0),
+                        min(int(maxX + pad) + 1, width), min(int(maxY + pad) + 1, height)])
+
+      # Merge overlapping regions so that no marker is searched for, or found, twice
+      merged = True
+      while merged:
+        merged = False
+        for i in range(len(regions)):
+          for j in range(i + 1, len(regions)):
+            a, b = regions[i], regions[j]
+            if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+              regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+              del regions[j]
+              merged = True
+              break
+          if merged:
+            break
+      return [tuple(region) for region in regions]
+
+
+    def update(self, tags, ids, full_frame):
+      '''
+      Record where markers were found. Called in frame order with the results of RoiDetector.detect
+
+      Parameters:
+      -----------
+      tags, ids ->
+        Detected markers, in the same format as cv2.aruco.detectMarkers
+      full_frame -> bool
+        Whether the full frame was searched
+      '''
+      found = {}
+      if len(tags) > 0:
+        for markerCorner, markerID in zip(tags, ids.flatten()):
+          if markerID not in self.ignore_ids:
+            found[int(markerID)] = markerCorner.reshape((4, 2))
+
+      with self.lock:
+        if full_frame:
+          self.last_corners = found
+          return
+        if any(markerID not in found for markerID in self.last_corners):
+          # A marker left its region, search the whole frame for it on the next frame
+          self.resync_requested = True
+        self.last_corners = found
@@ -0,0 +1,173 @@
+import time
+
+from threading import Event, Lock
+
+
+class ForwardScheduler:
+    '''
+    Forwarding Scheduler
+    Calls 'callback' on deadline based ticks, or whenever it is notified of new data
+    :param callback: function. Called once per tick
+    :param period: float. Time between ticks in seconds. Each deadline is computed from the previous
+        deadline, not from the end of the previous tick, so slow ticks do not lower the rate.
+        Set period=0 to tick back to back
+    :param event_driven: bool. Only tick after ForwardScheduler.notify has been called. The period then
+        becomes the longest the scheduler stays idle, with period=0 waiting indefinitely
+    :param coalesce_window: float. When event driven, time in seconds to keep gathering notifications
+        before ticking
+    '''
+
+    def __init__(self, callback, period, event_driven=False, coalesce_window=0.0):
+        self.callback = callback
+        self.period = period
+        self.event_driven = event_driven
+        self.coalesce_window = coalesce_window
+        self.alive = True
+        self.pending = Event()
+        self.wakeup = None  # time.perf_counter() reading an event driven scheduler ticks by anyway
+
+        self.stats_lock = Lock()
+        self.reset_stats()
+
+
+    def reset_stats(self):
+      '''
+      Clear the tick accounting
+      '''
+      with self.stats_lock:
+        self.started = time.perf_counter()
+        self.ticks = 0
+        self.overruns = 0  # Ticks that took longer than the period
+        self.missed = 0  # Deadlines skipped because a tick overran them
+        self.busy_time = 0.0
+        self.cpu_time = 0.0  # CPU time of the forwarding thread spent in ticks
+        self.max_duration = 0.0
+        self.max_lateness = 0.0  # Latest a tick started after its deadline
+
+
+    def notify(self):
+      '''
+      Signal that new packets or positions are waiting to be forwarded
+      '''
+      self.pending.set()
+
+
+    def wake_at(self, when):
+      '''
+      Make an event driven scheduler tick by 'when' even if it is not notified, e.g. for datagrams
+      held back until then. Only lasts until the next tick
+
+      Parameters:
+      -----------
+      when -> float
+        time.perf_counter() reading
+      '''
+      if self.wakeup is None or when < self.wakeup:
+        self.wakeup = when
+
+
+    def stop(self):
+      '''
+      Make ForwardScheduler.run return after the current tick
+      '''
+      self.alive = False
+      self.pending.set()
+
+
+    def run(self):
+      '''
+      Tick until ForwardScheduler.stop is called
+      '''
+      self.reset_stats()
+      if self.event_driven:
+        self.run_event_driven()
+      else:
+        self.run_periodic()
+
+
+    def run_periodic(self):
+      deadline = time.perf_counter()
+      while self.alive:
+        now = time.perf_counter()
+        if deadline > now:
+          time.sleep(deadline - now)
+          now = time.perf_counter()
+        self.tick(now - deadline)
+
+        deadline += self.period
+        now = time.perf_counter()
+        if self.period and now > deadline:
+          # Skip the deadlines that have already passed rather than running them back to back
+          missed = int((now - deadline) / self.period)
+          deadline += missed * self.period
+          with self.stats_lock:
+            self.missed += missed
+
+
+    def run_event_driven(self):
+      while self.alive:
+        timeout = self.period or None
+        if self.wakeup is not None:
+          timeout = min(timeout or float('inf'), max(self.wakeup - time.perf_counter(), 0.0))
+        if not self.pending.wait(timeout):
+          # Idle for a whole period, or until a wakeup, tick anyway so robots keep receiving their positions
+          self.tick(0.0)
+          continue
+        notified = time.perf_counter()
+        if self.coalesce_window:
+          time.sleep(self.coalesce_window)
+        self.pending.clear()
+        if self.alive:
+          self.tick(time.perf_counter() - notified)
+
+
+    def tick(self, lateness):
+      '''
+      Call the callback once, accounting for how long it took
+
+      Parameters:
+      -----------
+      lateness -> float
+        Time between the tick's deadline, or notification, and its start
+      '''
+      start = time.perf_counter()
+      cpu_start = time.thread_time()
+      self.wakeup = None
+      self.callback()
+      cpu = time.thread_time() - cpu_start
+      duration = time.perf_counter() - start
+
+      with self.stats_lock:
+        self.ticks += 1
+        self.busy_time += duration
+        self.cpu_time += cpu
+        self.max_duration = max(self.max_duration, duration)
+        self.max_lateness = max(self.max_lateness, lateness)
+        if self.period and duration > self.period:
+          self.overruns += 1
+
+
+    def get_stats(self):
+      '''
+      Returns:
+      --------
+      stats -> dict
+        Tick accounting since the scheduler started or ForwardScheduler.reset_stats was called.
+        'rate' is the achieved tick rate and 'target_rate' the rate asked for, in Hertz.
+        'cpu_time' is the CPU time spent ticking, which leaves out time waiting on the GIL
+      '''
+      with self.stats_lock:
+        elapsed = time.perf_counter() - self.started
+        return {
+          'ticks': self.ticks,
+          'rate': self.ticks / elapsed if elapsed else 0.0,
+          'target_rate': 1/self.period if self.period and not self.event_driven else None,
+          'overruns': self.overruns,
+          'missed': self.missed,
+          'mean_duration': self.busy_time / self.ticks if self.ticks else 0.0,
+          'max_duration': self.max_duration,
+          'max_lateness': self.max_lateness,
+          'utilisation': self.busy_time / elapsed if elapsed else 0.0,
+          'cpu_time': self.cpu_time,
+          'cpu_utilisation': self.cpu_time / elapsed if elapsed else 0.0,
+        }
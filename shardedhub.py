@@ -0,0 +1,494 @@
+import numpy as np
+import os
+import socket
+import struct
+import time
+
+from multiprocessing import Event as ProcessEvent, Process
+from multiprocessing import shared_memory
+from threading import Lock, Thread
+
+import instrumentation
+from commhub import CommHub
+from locationtable import LocationTable
+from sharedposes import SharedPoseTable
+
+
+def pack_address(addr):
+  '''
+  Returns:
+  --------
+  (ip, port) -> tuple of int
+    An IPv4 (host, port) address as two integers
+  '''
+  return struct.unpack('!I', socket.inet_aton(addr[0]))[0], addr[1]
+
+
+def unpack_address(ip, port):
+  return socket.inet_ntoa(struct.pack('!I', int(ip))), int(port)
+
+
+class SharedRegistry:
+    '''
+    Shared Memory Robot Registry
+    The address of every robot known to the shards of a ShardedCommHub, along with each shard's
+    forwarding stats, in a multiprocessing.shared_memory block. Every shard has its own region and
+    is its only writer, with the same sequence lock as sharedposes.SharedPoseTable, so shards never
+    wait on each other. A robot is owned by the shard that most recently registered it
+    :param name: string. Name of the shared memory block. None creates a new block
+    :param shards: int. Number of shards. Only used when creating the block
+    :param capacity: int. Most robots registered by each shard. Only used when creating the block
+    '''
+
+    # Fields of the header. PORT is the port the shards bound, and STOPPING is set to stop them all
+    SHARDS, CAPACITY, PORT, STOPPING = range(4)
+    SEQUENCE, COUNT = range(2)  # Fields of each shard's header
+    # Fields of each shard's stats
+    TICKS, RATE, CPU_TIME, CPU_UTILISATION, UTILISATION, QUEUED, DROPPED = range(7)
+
+    def __init__(self, name=None, shards=1, capacity=256):
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.size(shards, capacity))
+        else:
+            self.shm = SharedPoseTable.attach(name)
+            shards, capacity = (int(value) for value in np.ndarray(2, dtype=np.int64, buffer=self.shm.buf))
+        self.name = self.shm.name
+        self.shards = shards
+        self.capacity = capacity
+
+        offset = 0
+        arrays = []
+        for shape, dtype in self.layout(shards, capacity):
+            arrays.append(np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+            offset += int(np.prod(shape)) * 8
+        self.header, self.shard_headers, self.ids, self.addrs, self.registered, self.stats = arrays
+        if self.owner:
+            self.header[:] = (shards, capacity, 0, 0)
+            self.shard_headers[:] = 0
+            self.stats[:] = 0
+
+        self.index = {}  # Writer side robot id : slot, of the shard this process writes
+        self.full_warned = False
+
+
+    @staticmethod
+    def layout(shards, capacity):
+      '''
+      PRIVATE
+      Shape and type of every array in the block, in order. All of them have 8 byte items
+      '''
+      return [((4,), np.int64), ((shards, 2), np.int64), ((shards, capacity), np.int64),
+              ((shards, capacity, 2), np.int64), ((shards, capacity), np.float64),
+              ((shards, 7), np.float64)]
+
+
+    @classmethod
+    def size(cls, shards, capacity):
+      return sum(int(np.prod(shape)) * 8 for shape, _ in cls.layout(shards, capacity))
+
+
+    def reset(self, shard):
+      '''
+      Forget every robot registered by 'shard', e.g. when its worker is restarted
+      '''
+      self.index = {}
+      # A worker killed part way through a write leaves the sequence odd, start from the next even one
+      self.shard_headers[shard, self.SEQUENCE] += 1 - self.shard_headers[shard, self.SEQUENCE] % 2
+      self.shard_headers[shard, self.COUNT] = 0
+      self.stats[shard] = 0
+      self.shard_headers[shard, self.SEQUENCE] += 1
+
+
+    def register(self, shard, robot_id, addr):
+      '''
+      Record the address of a robot in the region of 'shard'. Only the shard's worker may call this
+
+      Parameters:
+      -----------
+      shard -> int
+        Shard the robot's packets arrive at
+      robot_id -> int
+        The ID of the robot
+      addr -> tuple
+        (host, port) the robot sends from
+      '''
+      slot = self.index.get(robot_id)
+      if slot is None:
+        slot = len(self.index)
+        if slot == self.capacity:
+          if not self.full_warned:
+            print(f"SharedRegistry shard {shard} is full, dropping robot {robot_id} and any other new robots")
+            self.full_warned = True
+          return
+        self.index[robot_id] = slot
+
+      self.shard_headers[shard, self.SEQUENCE] += 1  # Odd, write in progress
+      self.ids[shard, slot] = robot_id
+      self.addrs[shard, slot] = pack_address(addr)
+      self.registered[shard, slot] = time.time()
+      self.shard_headers[shard, self.COUNT] = len(self.index)
+      self.shard_headers[shard, self.SEQUENCE] += 1  # Even, write complete
+
+
+    def sequences(self):
+      '''
+      Returns:
+      --------
+      sequences -> np.array
+        Sequence number of every shard, which changes with every registration
+      '''
+      return self.shard_headers[:, self.SEQUENCE].copy()
+
+
+    def read(self):
+      '''
+      Copy a consistent view of every shard's region
+
+      Returns:
+      --------
+      (id2ip, owners) -> tuple of dict
+        robot id : (host, port) and robot id : shard owning the robot, for every registered robot
+      '''
+      id2ip, owners, latest = {}, {}, {}
+      for shard in range(self.shards):
+        while True:
+          sequence = int(self.shard_headers[shard, self.SEQUENCE])
+          if sequence % 2:
+            time.sleep(0)
+            continue
+          count = int(self.shard_headers[shard, self.COUNT])
+          robot_ids = self.ids[shard, :count].copy()
+          addrs = self.addrs[shard, :count].copy()
+          registered = self.registered[shard, :count].copy()
+          if int(self.shard_headers[shard, self.SEQUENCE]) == sequence:
+            break
+        for robot_id, (ip, port), when in zip(robot_ids.tolist(), addrs, registered.tolist()):
+          if when > latest.get(robot_id, -1.0):
+            latest[robot_id] = when
+            id2ip[robot_id] = unpack_address(ip, port)
+            owners[robot_id] = shard
+      return id2ip, owners
+
+
+    def close(self):
+      '''
+      Detach from the block, and free it if this registry created it
+      '''
+      self.header = self.shard_headers = self.ids = self.addrs = self.registered = self.stats = None
+      self.shm.close()
+      if self.owner:
+        self.shm.unlink()
+
+
+class ShardWorker(CommHub):
+    '''
+    PRIVATE
+    One shard of a ShardedCommHub, run in its own process. Every shard binds the same address with
+    SO_REUSEPORT, and the kernel hands each robot's datagrams to one of them by the robot's
+    address. A shard forwards the packets, and own position, of the robots it receives from, to
+    every robot in range of them, reading the addresses of the robots registered by other shards
+    from the SharedRegistry and the positions from a sharedposes.SharedPoseTable. With coalescing,
+    a robot gets its own position from the shard it sends to, and only neighbour records from others
+    :param shard: int. Index of the shard
+    :param registry: string. Name of the SharedRegistry
+    :param kwargs: Passed on to CommHub, 'pose_table' naming the shared pose table
+    '''
+
+    def __init__(self, shard, registry, **kwargs):
+        self.shard = shard
+        self.registry = SharedRegistry(registry)
+        self.registry.reset(shard)
+        self.published = {}  # robot id : address registered by this shard
+        self.owned = set()
+        self.registry_sequences = None
+        super().__init__(**kwargs)
+        self.registry.header[SharedRegistry.PORT] = self.socket.getsockname()[1]
+
+
+    def bind(self, host, port):
+      udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+      try:
+        udp_socket.bind((host, port))
+      except OSError as e:
+        udp_socket.close()
+        print(f"ERROR: Shard {self.shard} could not bind {host}:{port}")
+        raise e
+      return udp_socket
+
+
+    def wake_receiver(self):
+      # A datagram sent to the shared address could be handed to any shard, so stop receiving instead
+      try:
+        self.socket.shutdown(socket.SHUT_RD)
+      except OSError:
+        pass
+
+
+    def queue_packets(self, received_packets):
+      # Robots given to another shard are dropped from published, so they are claimed back here as soon
+      # as their packets arrive at this shard again, e.g. after a restart rehashes the flows
+      for received_packet in received_packets:
+        if self.published.get(received_packet.comm_id) != received_packet.addr:
+          self.registry.register(self.shard, received_packet.comm_id, received_packet.addr)
+          self.published[received_packet.comm_id] = received_packet.addr
+      CommHub.queue_packets(self, received_packets)
+
+
+    def forward_packets(self):
+      self.sync_registry()
+      CommHub.forward_packets(self)
+
+
+    def sync_registry(self):
+      '''
+      Pick up the robots registered by every shard since the last tick
+      '''
+      sequences = self.registry.sequences()
+      if self.registry_sequences is not None and np.array_equal(sequences, self.registry_sequences):
+        return
+      id2ip, owners = self.registry.read()
+      self.id2ip = id2ip
+      self.owned = {robot_id for robot_id, shard in owners.items() if shard == self.shard}
+      self.registry_sequences = sequences
+
+      # Forget the robots another shard has taken over, along with any of their packets left queued here
+      for robot_id in list(self.published):
+        if owners.get(robot_id, self.shard) == self.shard:
+          continue
+        self.published.pop(robot_id, None)
+        self.packets_lock.acquire()
+        queue = self.packets.pop(robot_id, None)
+        self.packets_lock.release()
+        if queue is not None:
+          self.release_packets(queue.drain())
+
+
+    def forward_sources(self, robots):
+      return [(robot_id, addr) for robot_id, addr in robots if robot_id in self.owned]
+
+
+    def record_poses(self, robot_ids, poses, timestamp):
+      # Every shard reads the same pose table, so only the first records it, once for the whole run
+      if self.shard == 0:
+        CommHub.record_poses(self, robot_ids, poses, timestamp)
+
+
+    def publish_stats(self):
+      '''
+      Copy the shard's forwarding and queue stats into the registry, for ShardedCommHub.forward_stats
+      '''
+      forwarding = self.forward_stats()
+      queues = self.queue_stats().values()
+      self.registry.stats[self.shard] = (
+        forwarding['ticks'], forwarding['rate'], forwarding['cpu_time'], forwarding['cpu_utilisation'],
+        forwarding['utilisation'], sum(queue['depth'] for queue in queues),
+        sum(queue['dropped'] for queue in queues))
+
+
+    def close(self):
+      CommHub.close(self)
+      self.registry.close()
+
+
+def run_worker(shard, registry, ready, stats_port, kwargs):
+  '''
+  Entry point of a ShardedCommHub worker process
+
+  Parameters:
+  -----------
+  ready -> multiprocessing.Event
+    Set once the shard's socket is bound
+  stats_port -> int
+    Local UDP port the shard's instrumentation is served on, see instrumentation.StatsServer.
+    None does not serve it
+  '''
+  worker = ShardWorker(shard, registry, **kwargs)
+  statsServer = instrumentation.StatsServer(stats_port) if stats_port is not None else None
+  ready.set()
+  try:
+    # Poll rather than wait on a multiprocessing.Event, which breaks for everyone once a waiter is killed
+    while not worker.registry.header[SharedRegistry.STOPPING]:
+      time.sleep(0.5)
+      worker.publish_stats()
+  finally:
+    worker.publish_stats()
+    if statsServer is not None:
+      statsServer.close()
+    worker.close()
+
+
+class ShardedCommHub:
+    '''
+    Sharded Communication Hub
+    Spreads a CommHub over several worker processes, so forwarding is not bound to a single core
+    and GIL. Every worker binds the same host:port with SO_REUSEPORT, and forwards for the robots
+    whose datagrams the kernel hands to it, see ShardWorker. Robot addresses are shared between
+    workers through a SharedRegistry, and positions through a sharedposes.SharedPoseTable.
+    The supervisor restarts any worker that dies
+    Positions are updated through the same update_position(s) methods as CommHub, so it can be
+    handed to ArUcoTracker and graphMaker in place of one
+    :param shards: int. Number of worker processes. Defaults to the number of cores
+    :param forward_freq: float. Frequency of every worker's forwarding ticks, see CommHub
+    :param host: string. The host of the CommHub
+    :param port: int. The port of the CommHub. 0 picks a free port, see ShardedCommHub.address
+    :param pose_table: string. Name of a sharedposes.SharedPoseTable written by a tracker in another
+        process. None creates one, written through ShardedCommHub.update_position(s)
+    :param capacity: int. Most robots tracked, and registered by each worker
+    :param stats_port: int. Serve the instrumentation of worker n on local UDP port stats_port + n
+    :param monitor_interval: float. Time between checks on the workers in seconds
+    :param kwargs: Passed on to every worker's CommHub. A telemetry path gets '.shard<n>' added before
+        its extension, as each worker records its own traffic. Poses are only recorded by shard 0
+    '''
+
+    def __init__(self, shards=None, forward_freq=None, host='144.32.175.138', port=4242, pose_table=None,
+                 capacity=256, stats_port=None, monitor_interval=1.0, **kwargs):
+        self.alive = True
+        self.shards = shards or os.cpu_count()
+        self.registry = SharedRegistry(shards=self.shards, capacity=capacity)
+        self.external_poses = pose_table is not None
+        self.pose_table = SharedPoseTable(pose_table, readonly=True) if self.external_poses \
+                          else SharedPoseTable(capacity=capacity)
+        self.pose_sequence = 0
+        self.locations = LocationTable()
+        self.write_lock = Lock()  # The shared pose table takes a single writer, and sync at a time
+        self.stats_port = stats_port
+
+        self.worker_kwargs = dict(kwargs, forward_freq=forward_freq, host=host, port=port,
+                                  pose_table=self.pose_table.name)
+        self.workers = [None] * self.shards
+        # The first shard picks the port when port is 0, the others then bind the same one
+        self.start_worker(0)
+        self.address = (host, int(self.registry.header[SharedRegistry.PORT]))
+        self.worker_kwargs['port'] = self.address[1]
+        for shard in range(1, self.shards):
+          self.start_worker(shard)
+
+        self.monitor_interval = monitor_interval
+        self.monitor_thread = Thread(target=self.monitor, name="Shard Monitor", daemon=True)
+        self.monitor_thread.start()
+
+
+    def start_worker(self, shard, timeout=10.0):
+      '''
+      PRIVATE
+      Start the worker process of 'shard' and wait until its socket is bound
+      '''
+      kwargs = dict(self.worker_kwargs)
+      if kwargs.get('telemetry') is not None:
+        root, extension = os.path.splitext(kwargs['telemetry'])
+        kwargs['telemetry'] = f"{root}.shard{shard}{extension}"
+      ready = ProcessEvent()
+      stats_port = self.stats_port + shard if self.stats_port is not None else None
+      worker = Process(target=run_worker, name=f"CommHub Shard {shard}", daemon=True,
+                       args=(shard, self.registry.name, ready, stats_port, kwargs))
+      worker.start()
+      if not ready.wait(timeout):
+        print(f"ERROR: CommHub shard {shard} did not start")
+      self.workers[shard] = worker
+
+
+    def monitor(self):
+      '''
+      New thread restarting any worker that has died
+      '''
+      while self.alive:
+        time.sleep(self.monitor_interval)
+        for shard, worker in enumerate(self.workers):
+          if self.alive and not worker.is_alive():
+            print(f"CommHub shard {shard} exited with code {worker.exitcode}, restarting")
+            self.start_worker(shard)
+
+
+    def update_position(self, robot_id, loc, yaw, timestamp=None):
+      '''
+      Update the position of a single robot, see CommHub.update_position
+      '''
+      self.update_positions([robot_id], [[loc[0], loc[1], loc[2], np.ravel(yaw)[0]]], timestamp)
+
+
+    def update_positions(self, robot_ids, poses, timestamp=None):
+      '''
+      Update the positions of several robots at once, see CommHub.update_positions. Every worker
+      picks them up before its next tick. Safe to call from several threads
+      '''
+      with self.write_lock:
+        self.pose_table.update_positions(robot_ids, poses, timestamp)
+        self.locations.update_many(robot_ids, poses, timestamp)
+
+
+    def sync_pose_table(self):
+      '''
+      Copy any poses written by an external tracker since the last sync, see CommHub.sync_pose_table
+      '''
+      if not self.external_poses or self.pose_table.sequence() == self.pose_sequence:
+        return
+      with self.write_lock:
+        if self.pose_table.sequence() == self.pose_sequence:
+          return  # Already synced by another thread
+        sequence, robot_ids, poses, timestamps = self.pose_table.read()
+        if len(robot_ids) > 0:
+          self.locations.update_many(robot_ids, poses, timestamps)
+        self.pose_sequence = sequence
+
+
+    def get_locations(self):
+      '''
+      Returns:
+      --------
+      locations -> dict
+        robot id : np.array([x, y, z, yaw]), see CommHub.get_locations
+      '''
+      self.sync_pose_table()
+      return self.locations.snapshot().as_dict()
+
+
+    def get_snapshot(self):
+      self.sync_pose_table()
+      return self.locations.snapshot()
+
+
+    def forward_stats(self):
+      '''
+      Returns:
+      --------
+      stats -> dict
+        Forwarding of all the workers together, as last published by them. 'rate' is the mean
+        tick rate of a worker, while 'cpu_time' and the utilisations are summed over workers
+      '''
+      stats = self.registry.stats
+      return {
+        'shards': self.shards,
+        'ticks': int(stats[:, SharedRegistry.TICKS].sum()),
+        'rate': float(stats[:, SharedRegistry.RATE].mean()),
+        'cpu_time': float(stats[:, SharedRegistry.CPU_TIME].sum()),
+        'cpu_utilisation': float(stats[:, SharedRegistry.CPU_UTILISATION].sum()),
+        'utilisation': float(stats[:, SharedRegistry.UTILISATION].sum()),
+      }
+
+
+    def queue_stats(self):
+      '''
+      Returns:
+      --------
+      stats -> dict
+        shard : depth and drop counters summed over the shard's queues
+      '''
+      return {shard: {'depth': int(stats[SharedRegistry.QUEUED]), 'dropped': int(stats[SharedRegistry.DROPPED])}
+              for shard, stats in enumerate(self.registry.stats)}
+
+
+    def close(self):
+      '''
+      Stop every worker and free the shared memory
+      '''
+      self.alive = False
+      self.registry.header[SharedRegistry.STOPPING] = 1
+      for worker in self.workers:
+        worker.join(5)
+        if worker.is_alive():
+          worker.terminate()
+          worker.join()
+      self.registry.close()
+      self.pose_table.close()
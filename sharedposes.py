@@ -0,0 +1,171 @@
+import numpy as np
+import time
+
+from multiprocessing import shared_memory
+
+
+class SharedPoseTable:
+    '''
+    Shared Memory Pose Table
+    Fixed size table of robot poses in a multiprocessing.shared_memory block, so that the tracker
+    can run in its own process and hand poses to the CommHub without sharing a GIL. There is a
+    single writer, and readers never block it: every write is wrapped in a sequence lock, an
+    odd sequence number meaning a write is in progress, and readers retry until they copy the
+    table without the sequence number changing underneath them
+    The writer exposes the same update_position(s) methods as CommHub, so it can be handed to
+    ArUcoTracker in place of one
+    :param name: string. Name of the shared memory block. None creates a new block
+    :param capacity: int. Most robots held. Only used when creating the block
+    :param readonly: bool. Attach to an existing block for reading only
+    :param stall_timeout: float. Longest time in seconds a reader waits on a write in progress before
+        deciding the writer died part way through it, see SharedPoseTable.read
+    '''
+
+    # Rows of the pose data, matching LocationSnapshot
+    X, Y, Z, YAW, TIMESTAMP = range(5)
+    SEQUENCE, COUNT, CAPACITY = range(3)  # Fields of the header
+
+    def __init__(self, name=None, capacity=256, readonly=False, stall_timeout=0.1):
+        self.owner = name is None
+        if self.owner:
+            size = 8 * (3 + capacity + 5 * capacity)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = self.attach(name)
+            capacity = int(np.ndarray(3, dtype=np.int64, buffer=self.shm.buf)[self.CAPACITY])
+        self.name = self.shm.name
+        self.readonly = readonly
+        self.stall_timeout = stall_timeout
+        self.stalled = None  # Sequence number of a write its writer never finished
+        self.full_warned = False
+
+        self.header = np.ndarray(3, dtype=np.int64, buffer=self.shm.buf)
+        self.ids = np.ndarray(capacity, dtype=np.int64, buffer=self.shm.buf, offset=8 * 3)
+        self.data = np.ndarray((5, capacity), dtype=np.float64, buffer=self.shm.buf,
+                               offset=8 * (3 + capacity))
+        if self.owner:
+            self.header[:] = (0, 0, capacity)
+            self.ids[:] = -1
+        if readonly:
+            for array in (self.header, self.ids, self.data):
+                array.flags.writeable = False
+
+        # Writer side slot lookup, rebuilt from the table so a restarted writer carries on where it left off
+        count = int(self.header[self.COUNT])
+        self.index = {int(robot_id): slot for slot, robot_id in enumerate(self.ids[:count])}
+        # Last consistent copy, handed out while the writer is stalled
+        self.last_read = (0, np.empty(0, dtype=np.int64), np.empty((0, 4)), np.empty(0))
+
+
+    @staticmethod
+    def attach(name):
+      '''
+      PRIVATE
+      Attach to an existing block without taking ownership of it. Before Python 3.13 the block is
+      still registered with the resource tracker, which is shared with the creating process, so
+      it stays alive until the creator unlinks it
+      '''
+      try:
+        return shared_memory.SharedMemory(name=name, track=False)
+      except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+    def update_position(self, robot_id, loc, yaw, timestamp=None):
+      '''
+      Update the position of a single robot, see CommHub.update_position
+      '''
+      pose = [[loc[0], loc[1], loc[2], np.ravel(yaw)[0]]]
+      self.update_positions([robot_id], pose, timestamp)
+
+
+    def update_positions(self, robot_ids, poses, timestamp=None):
+      '''
+      Write the poses of several robots as one atomic update
+
+      Parameters:
+      -----------
+      robot_ids -> list/np.array
+        IDs of the robots
+      poses -> np.array
+        (N, 4) array with one [x, y, z, yaw] row per robot
+      timestamp -> float
+        Time the poses were measured. Defaults to now
+      '''
+      if self.readonly:
+        raise PermissionError("SharedPoseTable is attached read only")
+      slots, kept = [], []
+      for row, robot_id in enumerate(robot_ids):
+        slot = self.index.get(int(robot_id))
+        if slot is None:
+          slot = len(self.index)
+          if slot == len(self.ids):
+            if not self.full_warned:
+              print(f"SharedPoseTable is full, dropping robot {robot_id} and any other new robots")
+              self.full_warned = True
+            continue
+          self.index[int(robot_id)] = slot
+        slots.append(slot)
+        kept.append(row)
+      poses = np.asarray(poses)[kept]
+
+      self.header[self.SEQUENCE] += 1  # Odd, write in progress
+      self.ids[slots] = np.asarray(robot_ids)[kept]
+      self.data[:self.TIMESTAMP, slots] = poses.T
+      self.data[self.TIMESTAMP, slots] = time.time() if timestamp is None else timestamp
+      self.header[self.COUNT] = len(self.index)
+      self.header[self.SEQUENCE] += 1  # Even, write complete
+
+
+    def sequence(self):
+      '''
+      Returns:
+      --------
+      sequence -> int
+        Changes with every write, so readers can tell whether there is anything new
+      '''
+      return int(self.header[self.SEQUENCE])
+
+
+    def read(self):
+      '''
+      Copy a consistent view of the table, retrying while the writer is part way through a write.
+      A write still in progress after stall_timeout is taken to be from a writer that died, and the
+      last consistent copy is returned instead, straight away on later reads
+
+      Returns:
+      --------
+      (sequence, robot_ids, poses, timestamps) -> tuple
+        Sequence number of the copy, the IDs of every robot in the table, an (N, 4) array of
+        their [x, y, z, yaw] and an array of the time each pose was measured
+      '''
+      deadline = None
+      while True:
+        sequence = int(self.header[self.SEQUENCE])
+        if sequence % 2:
+          if deadline is None:
+            deadline = time.perf_counter() + self.stall_timeout
+          if sequence == self.stalled or time.perf_counter() > deadline:
+            if sequence != self.stalled:
+              print("SharedPoseTable writer stalled part way through a write, keeping the last poses read")
+              self.stalled = sequence
+            # Report the stalled sequence, so callers comparing sequences do not read again
+            return (sequence,) + self.last_read[1:]
+          time.sleep(0)
+          continue
+        count = int(self.header[self.COUNT])
+        robot_ids = self.ids[:count].copy()
+        data = self.data[:, :count].copy()
+        if int(self.header[self.SEQUENCE]) == sequence:
+          self.last_read = (sequence, robot_ids, data[:self.TIMESTAMP].T, data[self.TIMESTAMP])
+          return self.last_read
+
+
+    def close(self):
+      '''
+      Detach from the block, destroying it if this table created it
+      '''
+      self.header = self.ids = self.data = None
+      self.shm.close()
+      if self.owner:
+        self.shm.unlink()
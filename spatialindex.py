@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class UniformGrid:
+    '''
+    Uniform Grid Spatial Index
+    Buckets robot positions into square cells on the X/Y plane so that neighbour queries only
+    visit the surrounding cells instead of every other robot
+    :param cell_size: float. Side length of a cell. Using the query radius as the cell size means
+        every neighbour is found within the 3x3 block of cells around a robot
+    '''
+
+    # (dx, dy) offsets of the 3x3 block of cells around (and including) a cell
+    OFFSETS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.order = np.empty(0, dtype=np.intp)
+        self.sorted_keys = np.empty(0, dtype=np.int64)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.width = 0
+
+
+    def rebuild(self, positions):
+      '''
+      Rebuild the index from the current robot positions
+
+      Parameters:
+      -----------
+      positions -> np.array
+        (N, 3+) array of robot positions. Only the X and Y columns are used for bucketing
+      '''
+      cells = np.floor(positions[:, :2] / self.cell_size).astype(np.int64)
+      if len(cells):
+        cells -= cells.min(axis=0)
+      # Leave a one cell margin on each side so neighbour keys never wrap onto another row
+      self.width = int(cells[:, 1].max()) + 3 if len(cells) else 3
+      self.keys = (cells[:, 0] + 1) * self.width + (cells[:, 1] + 1)
+      self.order = np.argsort(self.keys, kind='stable')
+      self.sorted_keys = self.keys[self.order]
+
+
+    def candidate_pairs(self):
+      '''
+      Enumerate every (source, destination) pair of robots that share a cell or sit in
+      adjacent cells. Pairs are grouped by source index, in ascending order
+
+      Returns:
+      --------
+      (src, dst) -> tuple of np.array
+        Indices into the positions passed to UniformGrid.rebuild. Self pairs are excluded
+      '''
+      offsets = self.OFFSETS[:, 0] * self.width + self.OFFSETS[:, 1]
+      neighbour_keys = self.keys[:, np.newaxis] + offsets[np.newaxis, :]
+      starts = np.searchsorted(self.sorted_keys, neighbour_keys, side='left').ravel()
+      ends = np.searchsorted(self.sorted_keys, neighbour_keys, side='right').ravel()
+      counts = ends - starts
+
+      # Expand each [start, end) range of the sorted keys into individual candidates
+      src = np.repeat(np.repeat(np.arange(len(self.keys)), len(offsets)), counts)
+      firsts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+      dst = self.order[np.arange(counts.sum()) + firsts]
+
+      not_self = src != dst
+      return src[not_self], dst[not_self]
+
+
+    def neighbour_pairs(self, positions, radius):
+      '''
+      Find every ordered pair of robots closer than 'radius' to each other
+
+      Parameters:
+      -----------
+      positions -> np.array
+        (N, 3+) array of robot positions
+      radius -> float
+        Communication range. The cell size follows it if it has changed, e.g. when
+        CommHub.neighbor_distance is raised at runtime
+
+      Returns:
+      --------
+      (src, dst) -> tuple of np.array
+        Indices of robots within range of each other, grouped by source index
+      '''
+      if radius != self.cell_size:
+        # The 3x3 block of cells only covers the radius when the cells are at least as large.
+        # The index is rebuilt on every query anyway, so resizing the cells costs nothing
+        self.cell_size = float(radius)
+      self.rebuild(positions)
+      src, dst = self.candidate_pairs()
+      rel_vector = positions[src, :3] - positions[dst, :3]
+      in_range = np.einsum('ij,ij->i', rel_vector, rel_vector) < radius * radius
+      return src[in_range], dst[in_range]
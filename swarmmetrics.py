@@ -0,0 +1,149 @@
+import csv
+import os
+import time
+
+import numpy as np
+
+
+def pairwise_distances(positions):
+  '''
+  Distance between every pair of robots, computed with a single broadcast
+
+  Parameters:
+  -----------
+  positions -> np.array
+    (N, 3) array with one [x, y, z] row per robot
+
+  Returns:
+  --------
+  distances -> np.array
+    (N, N) symmetric array of distances, with zeros on the diagonal
+  '''
+  offsets = positions[:, np.newaxis, :] - positions[np.newaxis, :, :]
+  return np.sqrt(np.einsum('ijk,ijk->ij', offsets, offsets))
+
+
+def swarm_metrics(positions):
+  '''
+  Aggregation metrics of the swarm at one instant
+
+  Parameters:
+  -----------
+  positions -> np.array
+    (N, 3) array with one [x, y, z] row per robot, N >= 2
+
+  Returns:
+  --------
+  metrics -> dict
+    'mean_distance': mean distance over every pair of robots
+    'cohesion': mean distance of the robots from their centroid
+    'nearest_neighbour': mean distance of every robot to its nearest neighbour
+    'robot_distances': (N,) mean distance of each robot to every other robot
+    'robot_nearest': (N,) distance of each robot to its nearest neighbour
+  '''
+  num_robots = len(positions)
+  distances = pairwise_distances(positions)
+  robot_distances = distances.sum(axis=1) / (num_robots - 1)
+  np.fill_diagonal(distances, np.inf)
+  robot_nearest = distances.min(axis=1)
+  centroid = positions.mean(axis=0)
+  return {
+    'mean_distance': robot_distances.mean(),  # Every pair is counted twice, so this is the mean over pairs
+    'cohesion': np.linalg.norm(positions - centroid, axis=1).mean(),
+    'nearest_neighbour': robot_nearest.mean(),
+    'robot_distances': robot_distances,
+    'robot_nearest': robot_nearest,
+  }
+
+
+class RollingMean:
+    '''
+    Mean of the last 'window' values, updated in constant time per value
+    :param window: int. Number of values averaged
+    '''
+
+    def __init__(self, window):
+        self.values = np.zeros(window)
+        self.count = 0
+        self.position = 0
+        self.total = 0.0
+
+
+    def add(self, value):
+      '''
+      Returns:
+      --------
+      mean -> float
+        Mean of the values in the window, including 'value'
+      '''
+      self.total += value - self.values[self.position]
+      self.values[self.position] = value
+      self.position = (self.position + 1) % len(self.values)
+      self.count = min(self.count + 1, len(self.values))
+      if self.position == 0:
+        # Resum once per window so rounding errors in the running total cannot build up
+        self.total = self.values.sum()
+      return self.total / self.count
+
+
+class MetricsStream:
+    '''
+    Metrics Stream
+    Appends every sample to CSV files as it is taken, so long runs do not hold their history in memory.
+    Swarm wide metrics go to 'swarm_metrics.csv', one row per sample, and per robot metrics to
+    'robot_metrics.csv', one row per robot per sample. Both are overwritten when the stream opens
+    :param directory: string. Directory the files are written to
+    :param aggregates: tuple. Swarm metrics written in every row, see swarm_metrics
+    :param window: int. Number of samples in the rolling means of the aggregates, 0 to leave them out
+    :param flush_interval: float. Longest time in seconds samples are buffered before reaching the disk
+    '''
+
+    AGGREGATES = ('mean_distance', 'cohesion', 'nearest_neighbour')
+
+    def __init__(self, directory='results', aggregates=AGGREGATES, window=0, flush_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.swarm_path = os.path.join(directory, 'swarm_metrics.csv')
+        self.robot_path = os.path.join(directory, 'robot_metrics.csv')
+        self.aggregates = aggregates
+        self.rolling = {name: RollingMean(window) for name in aggregates} if window else {}
+        self.flush_interval = flush_interval
+        self.flushed = time.perf_counter()
+
+        self.swarm_file = open(self.swarm_path, 'w', newline='')
+        self.robot_file = open(self.robot_path, 'w', newline='')
+        self.swarm_writer = csv.writer(self.swarm_file)
+        self.robot_writer = csv.writer(self.robot_file)
+        self.swarm_writer.writerow(['time', 'robots', *aggregates, *(f'rolling_{name}' for name in self.rolling)])
+        self.robot_writer.writerow(['time', 'robot_id', 'mean_distance', 'nearest_neighbour'])
+
+
+    def write(self, sample_time, robot_ids, metrics):
+      '''
+      Parameters:
+      -----------
+      sample_time -> float
+        Time of the sample since the start of the experiment
+      robot_ids -> list
+        IDs of the robots, in the order of the rows of the positions the metrics came from
+      metrics -> dict
+        Output of swarm_metrics
+      '''
+      values = [metrics[name] for name in self.aggregates]
+      rolling = [mean.add(metrics[name]) for name, mean in self.rolling.items()]
+      self.swarm_writer.writerow([sample_time, len(robot_ids), *values, *rolling])
+      self.robot_writer.writerows(zip([sample_time] * len(robot_ids), robot_ids,
+                                      metrics['robot_distances'], metrics['robot_nearest']))
+
+      if time.perf_counter() - self.flushed > self.flush_interval:
+        self.flush()
+
+
+    def flush(self):
+      self.swarm_file.flush()
+      self.robot_file.flush()
+      self.flushed = time.perf_counter()
+
+
+    def close(self):
+      self.swarm_file.close()
+      self.robot_file.close()
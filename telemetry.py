@@ -0,0 +1,226 @@
+import mmap
+import struct
+import time
+
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+# One fixed size record per pose update, or per robot whose packets were forwarded in a tick
+RECORD = np.dtype([
+  ('time', '<f8'),
+  ('robot_id', '<i4'),
+  ('kind', '<u4'),
+  ('x', '<f8'),
+  ('y', '<f8'),
+  ('z', '<f8'),
+  ('yaw', '<f8'),
+  ('received', '<u4'),  # Packets from the robot forwarded in the tick
+  ('forwarded', '<u4'),  # Copies of those packets sent to other robots
+])
+POSE, FORWARD = range(2)  # Values of RECORD['kind']
+
+# Magic, version, record size and number of records flushed to disk, padded to 64 bytes
+HEADER = struct.Struct('<8sIIQ40x')
+MAGIC = b'RCHTELEM'
+VERSION = 1
+
+
+class TelemetryRecorder:
+    '''
+    Telemetry Recorder
+    Append only recording of robot poses and forwarded traffic, written straight into a preallocated
+    memory mapped file. Appending copies the records into the mapping under a short lock, and a
+    background thread flushes the mapping to disk and then publishes the number of records in the
+    header, so a reader only ever sees complete records. The file grows by 'capacity' records
+    whenever it fills, and is trimmed to the records written when the recorder closes
+    Open recordings with telemetry.load
+    :param path: string. Path of the recording, overwritten if it exists
+    :param capacity: int. Number of records the file is grown by at a time
+    :param flush_interval: float. Time between flushes to disk in seconds
+    '''
+
+    def __init__(self, path, capacity=1 << 16, flush_interval=1.0):
+        self.path = path
+        self.growth = capacity
+        self.lock = Lock()
+        self.count = 0
+        self.flushed = 0
+
+        self.file = open(path, 'w+b')
+        self.mapping = None
+        self.grow(capacity)
+        self.write_header(0)
+
+        self.stopped = Event()
+        self.flush_interval = flush_interval
+        self.flush_thread = Thread(target=self.run_flusher, name="Telemetry Flusher", daemon=True)
+        self.flush_thread.start()
+
+
+    def grow(self, capacity):
+      '''
+      PRIVATE
+      Resize the file to hold 'capacity' records and map it again. Must hold lock, or be called
+      before the recorder is shared
+      '''
+      self.records = None  # Release the view of the old mapping so it can be closed
+      if self.mapping is not None:
+        self.mapping.flush()
+        self.mapping.close()
+      self.file.truncate(HEADER.size + capacity * RECORD.itemsize)
+      self.mapping = mmap.mmap(self.file.fileno(), 0)
+      self.records = np.frombuffer(self.mapping, dtype=RECORD, count=capacity, offset=HEADER.size)
+      self.capacity = capacity
+
+
+    def reserve(self, count):
+      '''
+      PRIVATE
+      Claim the next 'count' records. Must hold lock
+
+      Returns:
+      --------
+      records -> np.array
+        View of the claimed records in the mapping
+      '''
+      if self.count + count > self.capacity:
+        self.grow(max(self.capacity + self.growth, self.count + count))
+      records = self.records[self.count:self.count + count]
+      self.count += count
+      return records
+
+
+    def record_poses(self, robot_ids, poses, timestamp=None):
+      '''
+      Record a pose update, see CommHub.update_positions
+
+      Parameters:
+      -----------
+      robot_ids -> list/np.array
+        IDs of the robots
+      poses -> np.array
+        (N, 4) array with one [x, y, z, yaw] row per robot
+      timestamp -> float/np.array
+        Time the poses were measured, or one time per robot. Defaults to now
+      '''
+      self.append(POSE, robot_ids, poses, timestamp, 0, 0)
+
+
+    def record_traffic(self, robot_ids, poses, received, forwarded):
+      '''
+      Record the packets forwarded in a tick, along with the poses they were forwarded from
+
+      Parameters:
+      -----------
+      robot_ids -> list/np.array
+        IDs of the robots whose packets were forwarded
+      poses -> np.array
+        (N, 4) array with the [x, y, z, yaw] row of every robot used in the tick
+      received -> list/np.array
+        Number of packets forwarded from each robot
+      forwarded -> list/np.array
+        Number of copies of those packets sent to other robots
+      '''
+      self.append(FORWARD, robot_ids, poses, None, received, forwarded)
+
+
+    def append(self, kind, robot_ids, poses, timestamp, received, forwarded):
+      '''
+      PRIVATE
+      Copy one record per robot into the mapping
+      '''
+      poses = np.asarray(poses)
+      with self.lock:
+        records = self.reserve(len(poses))
+        records['time'] = time.time() if timestamp is None else timestamp
+        records['robot_id'] = robot_ids
+        records['kind'] = kind
+        for column, field in enumerate(('x', 'y', 'z', 'yaw')):
+          records[field] = poses[:, column]
+        records['received'] = received
+        records['forwarded'] = forwarded
+
+
+    def write_header(self, count):
+      '''
+      PRIVATE
+      Publish the number of records on disk. Must hold lock
+      '''
+      HEADER.pack_into(self.mapping, 0, MAGIC, VERSION, RECORD.itemsize, count)
+
+
+    def flush(self):
+      '''
+      Write the records appended so far to disk, then make them visible to readers
+      '''
+      with self.lock:
+        count = self.count
+        if count != self.flushed:
+          self.mapping.flush()
+          self.write_header(count)
+          self.flushed = count
+
+
+    def run_flusher(self):
+      while not self.stopped.wait(self.flush_interval):
+        self.flush()
+
+
+    def close(self):
+      '''
+      Stop the flusher, flush the remaining records and trim the file to them
+      '''
+      self.stopped.set()
+      self.flush_thread.join()
+      with self.lock:
+        self.mapping.flush()
+        self.write_header(self.count)
+        self.records = None
+        self.mapping.close()
+        self.file.truncate(HEADER.size + self.count * RECORD.itemsize)
+        self.file.close()
+
+
+def load(path):
+  '''
+  Open a recording without reading it into memory
+
+  Parameters:
+  -----------
+  path -> string
+    Path of a recording written by TelemetryRecorder, complete or still being written
+
+  Returns:
+  --------
+  records -> np.memmap
+    Read only structured array of RECORD, holding every record flushed to disk
+  '''
+  with open(path, 'rb') as file:
+    magic, version, record_size, count = HEADER.unpack(file.read(HEADER.size))
+  if magic != MAGIC or version != VERSION or record_size != RECORD.itemsize:
+    raise ValueError(f"'{path}' is not a version {VERSION} telemetry recording")
+  if count == 0:
+    return np.empty(0, dtype=RECORD)
+  return np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size, shape=(count,))
+
+
+def final_poses(records):
+  '''
+  Latest recorded pose of every robot
+
+  Parameters:
+  -----------
+  records -> np.array
+    Records of RECORD, in the order they were recorded, e.g. from telemetry.load
+
+  Returns:
+  --------
+  (robot_ids, poses) -> tuple
+    Robot IDs in ascending order and the (N, 4) array of their last [x, y, z, yaw]
+  '''
+  poses = records[records['kind'] == POSE]
+  # np.unique finds the first occurrence, so search the records from the end
+  robot_ids, last = np.unique(poses['robot_id'][::-1], return_index=True)
+  latest = poses[::-1][last]
+  return robot_ids, np.column_stack([latest[field] for field in ('x', 'y', 'z', 'yaw')])
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+import argparse
+import json
+import time
+
+from collections import defaultdict
+
+import numpy as np
+
+from ArUcoTracker import ArUcoTracker
+from framesource import Synthetic, VideoFile
+
+
+class PoseRecorder:
+  '''
+  Stands in for the CommHub, keeping every batch of poses published by the tracker
+  '''
+
+  def __init__(self):
+    self.updates = []
+
+
+  def update_positions(self, robot_ids, poses, timestamp=None):
+    self.updates.append((timestamp, np.array(robot_ids), np.array(poses)))
+
+
+def pose_errors(tracker, source, updates):
+  '''
+  Compare the published poses with what the synthetic source rendered
+
+  Returns:
+  --------
+  (position_errors, bearing_errors, found) -> tuple
+    Position errors in m and bearing errors in radians of every published pose, and the
+    fraction of rendered robots present in each published frame
+  '''
+  scale = source.pixels_per_metre()
+  origin = np.array([tracker.arenaMinX, tracker.arenaMinY])
+  position_errors, bearing_errors, found = [], [], []
+  for timestamp, robot_ids, poses in updates:
+    truth = source.ground_truth(timestamp)
+    if truth is None:
+      continue
+    truth_ids, centres, bearings = truth
+    rows = {robot_id: row for row, robot_id in enumerate(truth_ids)}
+    matched = [(row, rows[robot_id]) for row, robot_id in enumerate(robot_ids) if robot_id in rows]
+    if not matched:
+      continue
+    published, rendered = map(list, zip(*matched))
+    expected = (centres[rendered] - origin) / scale
+    position_errors.extend(np.hypot(*(poses[published, :2] - expected).T))
+    # Wrap the difference into [-pi, pi] before taking its size
+    bearing_errors.extend(np.abs(np.angle(np.exp(1j * (poses[published, 3] - bearings[rendered])))))
+    found.append(len(matched) / len(truth_ids))
+  return position_errors, bearing_errors, found
+
+
+def run(source, resolution, incremental, workers, ground_truth):
+  timings = defaultdict(list)
+  recorder = PoseRecorder()
+  tracker = ArUcoTracker(CHOSEN_CAMERA=source, commHub=recorder, headless=True, calibration_file=None,
+                         resolution=resolution, incremental=incremental, detect_workers=workers,
+                         stage_timer=lambda stage, seconds: timings[stage].append(seconds))
+  if not tracker.scale or tracker.scale < 0:
+    return None
+
+  start = time.perf_counter()
+  tracker.sendCoordinates_thread.join()
+  elapsed = time.perf_counter() - start
+
+  result = {
+    'resolution': resolution,
+    'mode': 'incremental' if incremental else 'full frame',
+    'frames': len(timings['pose']),
+    'fps': len(timings['pose']) / elapsed,
+    'dropped': tracker.frames.dropped,
+  }
+  for stage in ('capture', 'detect', 'pose', 'publish', 'latency'):
+    values = np.array(timings[stage] or [np.nan]) * 1000
+    result[f'{stage}_p50_ms'] = float(np.median(values))
+    result[f'{stage}_p95_ms'] = float(np.percentile(values, 95))
+
+  if ground_truth:
+    position_errors, bearing_errors, found = pose_errors(tracker, source, recorder.updates)
+    result['found'] = float(np.mean(found)) if found else 0.0
+    result['position_error_mm'] = float(np.mean(position_errors)) * 1000 if position_errors else float('nan')
+    result['bearing_error_deg'] = float(np.degrees(np.mean(bearing_errors))) if bearing_errors else float('nan')
+  return result
+
+
+def report(result):
+  line = (f"  {result['resolution']:<10} {result['mode']:<12} {result['fps']:>7.1f} fps"
+          f"  capture {result['capture_p50_ms']:6.2f}  detect {result['detect_p50_ms']:6.2f}"
+          f"  pose {result['pose_p50_ms']:5.2f}  publish {result['publish_p50_ms']:5.2f}"
+          f"  latency {result['latency_p50_ms']:6.2f}/{result['latency_p95_ms']:6.2f} ms")
+  if 'found' in result:
+    line += (f"  found {result['found']:6.1%}  error {result['position_error_mm']:5.1f} mm"
+             f" {result['bearing_error_deg']:4.2f} deg")
+  print(line)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Throughput, latency and accuracy benchmark of ArUcoTracker")
+  parser.add_argument('--frames', type=int, default=300, help="Frames tracked per run")
+  parser.add_argument('--robots', type=int, default=8, help="Robots rendered by the synthetic source")
+  parser.add_argument('--workers', type=int, default=2, help="Detection workers")
+  parser.add_argument('--resolutions', nargs='+', default=list(ArUcoTracker.POSSIBLE_RESOLUTIONS),
+                      choices=list(ArUcoTracker.POSSIBLE_RESOLUTIONS))
+  parser.add_argument('--video', help="Replay a recorded video instead of the synthetic source. "
+                      "Pose error is then not measured")
+  parser.add_argument('--json', help="Also write the results to this file, e.g. to track regressions in CI")
+  args = parser.parse_args()
+
+  print(f"Median latency per stage in ms, {args.frames} frames per run, {args.workers} detection workers")
+  results = []
+  for resolution in ([None] if args.video else args.resolutions):
+    for incremental in (False, True):
+      if args.video:
+        source, resolution = VideoFile(args.video), "1280x720"
+      else:
+        source = Synthetic(args.robots, frames=args.frames)
+      result = run(source, resolution, incremental, args.workers, ground_truth=not args.video)
+      if result is None:
+        print(f"  {resolution:<10} {'incremental' if incremental else 'full frame':<12}"
+              f" arena markers not found")
+        continue
+      report(result)
+      results.append(result)
+
+  if args.json:
+    with open(args.json, 'w') as file:
+      json.dump(results, file, indent=2)